@@ -0,0 +1,249 @@
+import io
+import os
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from string_table import StringTable
+
+# Bump this whenever the layout of a compiled index changes, it's part of the cache key so old artifacts just stop matching
+FORMAT_VERSION = 2
+# How far the IDF the vectorizer was fitted with may drift from a fresh fit before appended rows force a full refit
+MAX_IDF_DRIFT = 0.05
+
+# Everything that changes what the index looks like (preprocessing, vectorizer params, columns), it goes into the key with the CSV
+def index_settings(text_column, label_columns, vectorizer_params, preprocessor, fillna=None, string_columns=None):
+    return {
+        'format': FORMAT_VERSION,
+        'text_column': text_column,
+        'label_columns': label_columns,
+        'string_columns': string_columns,
+        'fillna': fillna,
+        'vectorizer': vectorizer_params,
+        'preprocessing': preprocessor.settings(),
+    }
+
+def _key_from_bytes(raw, settings):
+    digest = hashlib.sha256(raw)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+# Hashes the raw CSV bytes together with the settings, read a chunk at a time so a huge CSV never has to fit in memory
+# Returns (key, source), source being the size and hash of the CSV on its own
+def hash_source(data_path, settings):
+    digest = hashlib.sha256()
+    keyed = hashlib.sha256()
+    size = 0
+    with open(data_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+            keyed.update(chunk)
+            size += len(chunk)
+    keyed.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return keyed.hexdigest()[:20], {'size': size, 'sha256': digest.hexdigest()}
+
+def dataset_key(data_path, settings):
+    return hash_source(data_path, settings)[0]
+
+# The folder is <name>-<settings>-<key>, the settings part is there so the full and fast preprocessing modes (or any other
+# settings) each keep their own index instead of wiping each other's out on every switch
+def cache_path(name, data_path, key, settings, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(data_path), "compiled")
+    tag = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{name}-{tag}-{key}")
+
+# Only the newest index for each dataset and settings is kept around, plus keep (the folder of the index a handler is still using)
+# Called once the new index is in place, so a build that fails half way never leaves nothing behind
+def remove_stale(path, keep=None):
+    cache_dir = os.path.dirname(path)
+    prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+    keep = {os.path.basename(path)} | ({os.path.basename(keep)} if keep else set())
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(prefix) and entry not in keep:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+# Everything a handler needs to answer queries: the fitted vectorizer, the TF-IDF rows, the preprocessed texts and the label columns
+# Saved as plain .npy/.json files so the matrix can be memory-mapped straight back in instead of retraining on every start
+#
+# An index is never changed once it's made, extend() hands back a new one, so a handler can swap in the new index in one assignment
+# while queries already running carry on with the old one
+# source is the size and hash of the CSV it came from, which is how an append is told apart from an edit
+# fit_rows is how many rows the vectorizer was fitted on, the rows after that were appended with its vocabulary and IDF frozen
+# unseen_terms are the terms in those appended rows that the vocabulary doesn't have, with how many of the rows use each
+# string_columns are the label columns kept as a StringTable ({column: delimiter or None}) rather than a list, i.e. the answers
+# path is the folder it was saved to or loaded from, None while it only exists in memory
+class CompiledIndex:
+    def __init__(self, vectorizer, matrix, texts, labels, key=None, source=None, fit_rows=None, unseen_terms=None, string_columns=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self._texts = texts
+        self._texts_file = None
+        self._texts_lock = threading.Lock()
+        self.path = None
+        self.labels = labels
+        self.key = key
+        self.source = source
+        self.fit_rows = matrix.shape[0] if fit_rows is None else fit_rows
+        self.unseen_terms = unseen_terms or {}
+        self.string_columns = string_columns or {}
+        self.origin = 'built'
+
+    # The preprocessed texts are only needed to append to or refit an index, a loaded one reads them the first time they're asked for
+    # texts.json is opened when the index is loaded and kept open until then, so it can still be read after the folder is cleaned up
+    # (by a newer index here, or another Maila sharing the cache)
+    @property
+    def texts(self):
+        with self._texts_lock:
+            if self._texts is None and self._texts_file is not None:
+                with self._texts_file as f:
+                    self._texts = json.load(f)
+                self._texts_file = None
+        return self._texts
+
+    @classmethod
+    def build(cls, texts, labels, vectorizer_params, key=None, source=None, string_columns=None):
+        vectorizer = TfidfVectorizer(**vectorizer_params)
+        matrix = vectorizer.fit_transform(texts)
+        string_columns = string_columns or {}
+        labels = {column: StringTable.from_strings(values, string_columns[column]) if column in string_columns and not isinstance(values, StringTable) else values
+                  for column, values in labels.items()}
+        return cls(vectorizer, matrix, texts, labels, key, source, string_columns=string_columns)
+
+    # The new rows go through the existing vectorizer, so the old rows don't have to be touched at all
+    # Terms it has never seen are dropped from those rows (that's counted, see idf_drift)
+    def extend(self, texts, labels, key=None, source=None):
+        analyzer = self.vectorizer.build_analyzer()
+        vocabulary = self.vectorizer.vocabulary_
+        unseen = dict(self.unseen_terms)
+        for text in texts:
+            for term in set(analyzer(text)):
+                if term not in vocabulary:
+                    unseen[term] = unseen.get(term, 0) + 1
+        matrix = sparse.vstack([self.matrix, self.vectorizer.transform(texts)], format='csr')
+        labels = {column: values.extend(labels[column]) if isinstance(values, StringTable) else list(values) + list(labels[column])
+                  for column, values in self.labels.items()}
+        index = CompiledIndex(self.vectorizer, matrix, list(self.texts) + list(texts), labels, key, source, self.fit_rows, unseen, self.string_columns)
+        index.origin = 'appended'
+        return index
+
+    # 0 straight after a fit, grows as rows are appended: how far the IDF a refit would give is from the frozen one (L1, relative
+    # to the frozen total). A term the vocabulary doesn't have counts as its whole refit IDF, nothing can match on it until then
+    def idf_drift(self):
+        if self.matrix.shape[0] == self.fit_rows:
+            return 0.0
+        rows = self.matrix.shape[0]
+        idf = self.vectorizer.idf_
+        doc_freq = np.bincount(np.asarray(self.matrix.indices), minlength=len(idf))
+        refit_idf = np.log((1 + rows) / (1 + doc_freq)) + 1
+        drift = np.abs(refit_idf - idf).sum()
+        unseen = np.fromiter(self.unseen_terms.values(), dtype=np.float64, count=len(self.unseen_terms))
+        drift += (np.log((1 + rows) / (1 + unseen)) + 1).sum()
+        return float(drift / idf.sum())
+
+    def save(self, path):
+        # Written to a temp folder first and renamed, a half-written index must never be picked up by the next start
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        matrix = self.matrix.tocsr()
+        np.save(os.path.join(tmp_path, "data.npy"), matrix.data)
+        np.save(os.path.join(tmp_path, "indices.npy"), matrix.indices)
+        np.save(os.path.join(tmp_path, "indptr.npy"), matrix.indptr)
+        np.save(os.path.join(tmp_path, "idf.npy"), self.vectorizer.idf_)
+        vocabulary = {term: int(i) for term, i in self.vectorizer.vocabulary_.items()}
+        params = {k: v for k, v in self.vectorizer.get_params().items() if k in ('analyzer', 'stop_words')}
+        meta = {'format': FORMAT_VERSION, 'key': self.key, 'shape': list(matrix.shape), 'params': params, 'source': self.source,
+                'fit_rows': self.fit_rows, 'unseen_terms': self.unseen_terms, 'string_columns': self.string_columns}
+        for column in self.string_columns:
+            self.labels[column].save(os.path.join(tmp_path, column))
+        labels = {column: values for column, values in self.labels.items() if column not in self.string_columns}
+        for name, content in (("vocabulary.json", vocabulary), ("texts.json", self.texts), ("labels.json", labels), ("meta.json", meta)):
+            with open(os.path.join(tmp_path, name), 'w', encoding='utf-8') as f:
+                json.dump(content, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "vocabulary.json"), encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        with open(os.path.join(path, "labels.json"), encoding='utf-8') as f:
+            labels = json.load(f)
+        data = np.load(os.path.join(path, "data.npy"), mmap_mode='r')
+        indices = np.load(os.path.join(path, "indices.npy"), mmap_mode='r')
+        indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode='r')
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+        # A vectorizer given a fixed vocabulary plus its idf_ transforms exactly like the one that was fitted
+        vectorizer = TfidfVectorizer(vocabulary=vocabulary, **meta['params'])
+        vectorizer.idf_ = np.load(os.path.join(path, "idf.npy"))
+        string_columns = meta.get('string_columns') or {}
+        for column, delimiter in string_columns.items():
+            labels[column] = StringTable.load(os.path.join(path, column), delimiter)
+        index = cls(vectorizer, matrix, None, labels, meta['key'], meta.get('source'), meta.get('fit_rows'), meta.get('unseen_terms'), string_columns)
+        index._texts_file = open(os.path.join(path, "texts.json"), encoding='utf-8')
+        index.path = path
+        index.origin = 'loaded'
+        return index
+
+# Rows only added at the end (the old bytes are all still there, unchanged, and the new ones start on a line of their own)
+# can be appended to previous. Anything else (an edited or removed row, a changed header) needs the whole thing rebuilt
+# The shipped CSVs don't end in a newline, so the line break can be either the old file's last byte or the first new one
+def _is_append(previous, raw):
+    source = previous.source if previous is not None else None
+    if not source or len(raw) <= source['size']:
+        return False
+    size = source['size']
+    if raw[size - 1:size] not in (b'\n', b'\r') and raw[size:size + 1] not in (b'\n', b'\r'):
+        return False
+    return hashlib.sha256(raw[:size]).hexdigest() == source['sha256']
+
+# The one entry point the handlers use, reuses the compiled index if the CSV and settings hash the same, otherwise trains and saves a new one
+# Given the index the handler is using now (previous), rows appended to the CSV since are preprocessed and added on their own,
+# and the vectorizer is only refitted once idf_drift() goes over max_drift. The refit reuses the preprocessed texts too
+def load_or_build(name, data_path, text_column, label_columns, vectorizer_params, preprocessor, fillna=None, cache_dir=None, previous=None, max_drift=MAX_IDF_DRIFT, string_columns=None):
+    settings = index_settings(text_column, label_columns, vectorizer_params, preprocessor, fillna, string_columns)
+    with open(data_path, 'rb') as f:
+        raw = f.read()
+    key = _key_from_bytes(raw, settings)
+    if previous is not None and previous.key == key:
+        return previous
+    path = cache_path(name, data_path, key, settings, cache_dir)
+    if os.path.isdir(path):
+        try:
+            return CompiledIndex.load(path)
+        except Exception as e:
+            print(f"[SYSTEM WARNING]: Compiled index for {name} is unreadable, rebuilding: {e}")
+
+    df = pd.read_csv(io.BytesIO(raw))
+    if fillna:
+        df = df.fillna(fillna)
+    source = {'size': len(raw), 'sha256': hashlib.sha256(raw).hexdigest()}
+    if _is_append(previous, raw) and len(df) > previous.matrix.shape[0]:
+        new_rows = df.iloc[previous.matrix.shape[0]:]
+        texts = [preprocessor.preprocess(t, cache=False) for t in new_rows[text_column].tolist()]
+        labels = {column: new_rows[column].tolist() for column in label_columns}
+        index = previous.extend(texts, labels, key, source)
+        if index.idf_drift() > max_drift:
+            index = CompiledIndex.build(index.texts, index.labels, vectorizer_params, key, source, string_columns)
+            index.origin = 'refit'
+    else:
+        texts = [preprocessor.preprocess(t, cache=False) for t in df[text_column].tolist()]
+        labels = {column: df[column].tolist() for column in label_columns}
+        index = CompiledIndex.build(texts, labels, vectorizer_params, key, source, string_columns)
+    # Failing to write the cache (read-only folder etc.) shouldn't stop Maila, it just means training again next time
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index.save(path)
+        remove_stale(path, keep=previous.path if previous is not None else None)
+    except OSError as e:
+        print(f"[SYSTEM WARNING]: Could not save compiled index for {name}: {e}")
+    return index
@@ -0,0 +1,59 @@
+import os
+import threading
+
+# Keeps an eye on the CSVs behind the intent classifier, QA and small talk and calls the handler's reload() when one changes
+# Just polls the file's size and mtime every few seconds, no extra dependency and it works the same everywhere
+# A change is only acted on once the file has stayed the same for a whole interval, so a CSV still being written isn't picked up half done
+# reload() itself works out if anything actually changed (the compiled index key), so a touched but identical file costs one hash
+class DatasetWatcher:
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.reloads = []
+        self._watched = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    # Returns the handler so it can wrap a factory, the first check always asks for a reload in case the file changed while it trained
+    def watch(self, handler):
+        with self._lock:
+            self._watched.append({'handler': handler, 'seen': None, 'pending': None})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="maila-dataset-watcher", daemon=True)
+                self._thread.start()
+        return handler
+
+    def check(self):
+        with self._lock:
+            watched = list(self._watched)
+        for entry in watched:
+            handler = entry['handler']
+            stat = self._stat(handler.data_path)
+            if stat is None or stat == entry['seen']:
+                entry['pending'] = None
+                continue
+            if stat != entry['pending']:
+                entry['pending'] = stat
+                continue
+            entry['seen'], entry['pending'] = stat, None
+            origin = handler.reload()
+            if origin is not None:
+                self.reloads.append((handler.data_path, origin))
+                print(f"[SYSTEM]: Reloaded {handler.data_path} ({origin})")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[SYSTEM ERROR]: Dataset watcher failed: {e}")
+
+    def stop(self):
+        self._stop.set()
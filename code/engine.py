@@ -0,0 +1,370 @@
+import sys
+import json
+import argparse
+
+from intent_classifier import IntentClassifier
+from small_talk import SmallTalkHandler
+from question_answer import QAHandler
+from identity import IdentityManagement
+from discoverability import Discoverability
+from transaction import EmailHandler, EMAIL_AWAITING_STATES, EMAIL_LOOP_STATES
+from warmup import HandlerRegistry, warm_nltk_resources, warm_wordnet
+from preprocessing import get_preprocessor, PREPROCESSING_MODES
+from dataset_watcher import DatasetWatcher
+from unified_index import UnifiedRetriever
+
+COMMANDS = {"cancel", "go back", "where am i", "where am i?", "repeat", "what now", "what now?"}
+EMAIL_PASS_SIGNAL = "I'm not sure how to handle that email request."
+N_BEST = 3 # how many intent guesses each reply carries
+
+# Registers every handler Maila needs, they train in the background and get() waits on whichever one is asked for
+# preprocessing='fast' swaps the tagger for the lemma table (see preprocessing.py), the three retrievers all share whichever one it is
+# The table is loaded here rather than in the warm-up, so a missing one fails the start with how to build it
+# watch_datasets=True reloads the intent, QA and small talk CSVs whenever they change, without a restart
+# qa_shards=N answers Q&A from N worker processes (QAHandler engine='sharded'), for corpora too big to score on one core
+# The unified index (see unified_index.py) scores a query against all three datasets in one go. It's only used with the plain dense
+# QA engine: the others (sharded, inverted, streaming) are there because the corpus is too big for a full product over an in-memory
+# copy, which is exactly what the unified index would do to it on every turn
+def build_handler_registry(preprocessing='full', watch_datasets=False, qa_shards=None):
+    if preprocessing not in PREPROCESSING_MODES:
+        raise ValueError(f"Unknown preprocessing mode '{preprocessing}', use one of {', '.join(PREPROCESSING_MODES)}.")
+    if preprocessing == 'fast':
+        get_preprocessor('fast')
+    watcher = DatasetWatcher() if watch_datasets else None
+    def retriever(handler_class, **options):
+        def build():
+            handler = handler_class(preprocessor=get_preprocessor(preprocessing), **options)
+            return watcher.watch(handler) if watcher else handler
+        return build
+    handlers = HandlerRegistry(warm=warm_wordnet if preprocessing == 'fast' else warm_nltk_resources)
+    handlers.register("intent", retriever(IntentClassifier))
+    handlers.register("small_talk", retriever(SmallTalkHandler))
+    qa_options = {'engine': 'sharded', 'shards': qa_shards} if qa_shards else {}
+    handlers.register("qa", retriever(QAHandler, **qa_options))
+    handlers.register("identity", IdentityManagement)
+    handlers.register("discoverability", Discoverability, needs_nltk=False)
+    handlers.register("email", EmailHandler, needs_nltk=False)
+    # Registered last so the three retrievers it waits on have all been picked up by the warmup threads already
+    if qa_options.get('engine', 'dense') == 'dense':
+        handlers.register("unified", lambda: UnifiedRetriever(handlers.get("intent"), handlers.get("qa"), handlers.get("small_talk")), needs_nltk=False)
+    return handlers
+
+# An email turn that still has to call Guerrilla Mail, it carries everything finish_email_job needs once the call comes back
+class EmailJob:
+    def __init__(self, query, current_state, intent, subintent, score, session_id, candidates=(), retrieval=None):
+        self.query = query
+        self.current_state = current_state
+        self.intent = intent
+        self.subintent = subintent
+        self.score = score
+        self.candidates = candidates
+        self.retrieval = retrieval
+        self.session_id = session_id
+        self.result = None
+
+# All of Maila's routing used to live inside the GUI and wrote straight into Tk, now it lives here and just returns a dict
+# One engine is one conversation (name, session, chat stack), the handlers themselves can be shared between as many engines as you like
+class DialogueEngine:
+    def __init__(self, handlers=None):
+        self.handlers = handlers if handlers is not None else build_handler_registry()
+        self.username = None
+        self.session_id = None
+        self.email_address = None
+        self.chat_stack = ["normal"] # This is what's used for "context tracking", I call it context tracking but state management would be more accurate, Maila is not that advanced
+        self.state_prompts = {}
+        self.IDENTITY_TASK_STATES = {"awaiting_name", "awaiting_name_confirm"}
+        self.DISCOVER_TASK_STATES = {"general_help_loop", "capabilities_help"}
+        self.EMAIL_TASK_STATES = set(EMAIL_LOOP_STATES + EMAIL_AWAITING_STATES)
+        self.EMAIL_LOOP_STATES = set(EMAIL_LOOP_STATES)
+        self.EMAIL_AWAITING_STATES = set(EMAIL_AWAITING_STATES)
+        self.what_now_prompts = {
+            "normal": "You can chat with me, ask a question, ask for help, or manage your temporary email (e.g., 'start a new session').",
+            "awaiting_name_confirm": "You can say 'yes' to confirm setting your name, or 'no' to cancel.",
+            "awaiting_name": "You can type in the name you'd like me to call you, or say 'cancel'.",
+            "general_help_loop": "You can ask about 'commands', 'identification', or 'capabilities'. You can also say 'no' to exit help.",
+            "capabilities_help": "You can ask for more info on 'small talk', 'Q&A', 'identification', or 'email'. You can also say 'no' to exit.",
+            "email_manage_loop": "You are in your email session. You can say 'list emails', 'view [number]', 'delete [number]', 'download [number]', or 'end session'.",
+            "awaiting_session_start_confirm": "You can say 'yes' to create a new temporary email session, or 'no' to decline.",
+            "awaiting_session_restore_confirm": "You can say 'yes' to try again, 'no' to cancel, or just enter your session ID.",
+            "awaiting_session_restore": "You can type or paste your 24-character session ID, or say 'cancel'.",
+            "awaiting_session_end_confirm": "You can say 'yes' to permanently end your session, or 'no' to keep it active.",
+            "awaiting_view_index": "You can enter the number (index) of the email you want to read, or say 'cancel'.",
+            "awaiting_delete_index": "You can enter the email number(s) to delete (e.g., '1', '1, 3', '2-5', or 'all'), or say 'cancel'.",
+            "awaiting_download_index": "You can enter the email number(s) to download (e.g., '1', '1, 3', '2-5', or 'all', plus 'as zip' or 'as mbox' for a single archive), or say 'cancel'.",
+            "awaiting_delete_all_confirm": "You must say 'yes' to confirm deleting ALL emails, or 'no' to cancel. This cannot be undone."
+        }
+
+    # Each of these blocks until that specific handler has finished loading
+    @property
+    def intent_classifier(self):
+        return self.handlers.get("intent")
+
+    @property
+    def small_talk_handler(self):
+        return self.handlers.get("small_talk")
+
+    @property
+    def qa_handler(self):
+        return self.handlers.get("qa")
+
+    @property
+    def identity_handler(self):
+        return self.handlers.get("identity")
+
+    @property
+    def discoverability_handler(self):
+        return self.handlers.get("discoverability")
+
+    @property
+    def email_handler(self):
+        return self.handlers.get("email")
+
+    # None if the registry doesn't have one, or it's still waiting on one of the three retrievers, the turn then goes through
+    # the classifier and the handlers one by one. Otherwise an early turn would wait for QA and small talk to load just to get its intent
+    @property
+    def unified_retriever(self):
+        if "unified" not in self.handlers or not self.handlers.is_ready("unified"):
+            return None
+        return self.handlers.get("unified")
+
+    # Manages the chat stack as a crude form of context tracking, also builds Maila's prompts for the 'repeat' command
+    def manage_state(self, new_state, prompt_to_save=None):
+            current_state = self.chat_stack[-1]
+            if new_state == "normal":
+                if current_state in self.IDENTITY_TASK_STATES:
+                    while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
+                        state_to_pop = self.chat_stack.pop()
+                        if state_to_pop in self.state_prompts:
+                            del self.state_prompts[state_to_pop]
+                elif current_state in self.DISCOVER_TASK_STATES:
+                    while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
+                        state_to_pop = self.chat_stack.pop()
+                        if state_to_pop in self.state_prompts:
+                            del self.state_prompts[state_to_pop]
+                elif current_state in self.EMAIL_TASK_STATES:
+                    while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
+                        state_to_pop = self.chat_stack.pop()
+                        if state_to_pop in self.state_prompts:
+                            del self.state_prompts[state_to_pop]   
+                elif len(self.chat_stack) > 1:
+                    state_to_pop = self.chat_stack.pop()
+                    if state_to_pop in self.state_prompts:
+                            del self.state_prompts[state_to_pop]           
+            elif new_state != current_state:
+                self.chat_stack.append(new_state)
+                if prompt_to_save:
+                    self.state_prompts[new_state] = prompt_to_save
+
+    # This is the main function that determines Maila's response
+    # Email turns are split in three (begin, run, finish) so a GUI can do the slow Guerrilla Mail part on another thread
+    def respond(self, query):
+        reply, job = self.begin_turn(query)
+        if job is None:
+            return reply
+        self.run_email_job(job)
+        return self.finish_email_job(job)
+
+    def is_command(self, query):
+        return query.lower() in COMMANDS
+
+    # Returns (reply, None) for anything that can be answered straight away, or (None, EmailJob) when the email service has to be called
+    def begin_turn(self, query):
+        current_state = self.chat_stack[-1]
+        response = ""
+
+        # Maila first checks if the query is a command, for commands only it has to be an exact match
+        if query.lower() == "cancel":
+            if current_state in self.IDENTITY_TASK_STATES:
+                while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
+                    state_to_pop = self.chat_stack.pop()
+                    if state_to_pop in self.state_prompts:
+                        del self.state_prompts[state_to_pop]
+                response = f"I've cancelled the identity task. We are now in the '{self.chat_stack[-1]}' state."
+            elif current_state in self.DISCOVER_TASK_STATES:
+                while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
+                    state_to_pop = self.chat_stack.pop()
+                    if state_to_pop in self.state_prompts:
+                        del self.state_prompts[state_to_pop]
+                response = f"I've cancelled the help task. We are now in the '{self.chat_stack[-1]}' state."
+            elif current_state in self.EMAIL_TASK_STATES:
+                while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
+                    state_to_pop = self.chat_stack.pop()
+                    if state_to_pop in self.state_prompts:
+                        del self.state_prompts[state_to_pop]
+                response = f"I've cancelled the email task. We are now in the '{self.chat_stack[-1]}' state."
+            elif len(self.chat_stack) > 1:
+                state_to_pop = self.chat_stack.pop()
+                if state_to_pop in self.state_prompts:
+                        del self.state_prompts[state_to_pop]
+                response = f"I've cancelled the ongoing task. We are now in the '{self.chat_stack[-1]}' state. What now?"
+            else:
+                response = "There is no ongoing task to cancel."
+            return self._reply(response), None
+        elif query.lower() == "go back":
+            if len(self.chat_stack) > 1:
+                state_popped = self.chat_stack.pop()
+                if state_popped in self.state_prompts:
+                    del self.state_prompts[state_popped]
+                response = f"Okay, I've gone back one step. We are now in the '{self.chat_stack[-1]}' state."
+            else:
+                response = "There's nothing to go back to."
+            return self._reply(response), None
+        elif query.lower() == "where am i" or query.lower() == "where am i?":
+            response = f"The chatbot is currently in the '{current_state}' state."
+            return self._reply(response), None
+        elif query.lower() == "repeat":
+            current_state = self.chat_stack[-1]
+            if current_state == "normal":
+                response = "There's no active task to repeat. How can I help?"
+            elif current_state in self.state_prompts:
+                response = self.state_prompts[current_state]
+            else:
+                response = f"I'm in the '{current_state}' state, but I don't have a specific prompt to repeat. What would you like to do?"
+            return self._reply(response), None
+        elif query.lower() == "what now" or query.lower() == "what now?":
+            current_state = self.chat_stack[-1]
+            default_fallback = f"I'm in the '{current_state}' state. You can try 'cancel' to exit this task or 'go back' to the previous step."
+            response = self.what_now_prompts.get(current_state, default_fallback)
+            return self._reply(response), None
+
+        # Next, Maila determines the user's intent, the runners-up come out of the same scoring pass and go back with the reply
+        # With the unified index the best QA and small talk matches come out of that pass as well, _finish_turn just picks the reply
+        unified_retriever = self.unified_retriever
+        retrieval = unified_retriever.search(query, (IntentClassifier.rows_for(N_BEST), 1, 1)) if unified_retriever else None
+        if retrieval is not None:
+            (intent, subintent, score), candidates = self.intent_classifier.decide(*retrieval['intents'], threshold=0.2, n=N_BEST)
+        else:
+            (intent, subintent, score), candidates = self.intent_classifier.classify_n_best(query, threshold=0.2, n=N_BEST)
+        response = ""
+        handled = False
+        
+        # Maila will either route by intent or by the current state, the order of states determine if they would take priority over certain tasks
+        # Please read the report if you want a detailed breakdown, or just analyze my code
+        if current_state in self.IDENTITY_TASK_STATES:
+            handled = True
+            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent="none", current_state=current_state)
+            self.username = new_name
+            prompt_to_save = response_text if new_state != "normal" else None
+            self.manage_state(new_state, prompt_to_save)
+            response = response_text
+        elif intent == "IdentityManagement":
+            handled = True
+            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent=subintent, current_state=current_state)
+            self.username = new_name
+            prompt_to_save = response_text if new_state != "normal" else None
+            if new_state != "normal" or current_state in self.IDENTITY_TASK_STATES:
+                self.manage_state(new_state, prompt_to_save)     
+            response = response_text
+        elif current_state in self.DISCOVER_TASK_STATES:
+            handled = True
+            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent="none", current_state=current_state)
+            prompt_to_save = response_text if new_state != "normal" else None
+            self.manage_state(new_state, prompt_to_save)
+            response = response_text
+
+        # Email states can uniquely pass down intents if it doesn't find a match within transaction.py
+        # For instance, "How are you" while in (general) email loop will not be matched and be passed through here and on to Small Talk
+        elif intent == "Email" or current_state in self.EMAIL_TASK_STATES:
+            return None, EmailJob(query, current_state, intent, subintent, score, self.session_id, candidates, retrieval)
+        return self._finish_turn(query, current_state, intent, subintent, score, handled, response, candidates=candidates, retrieval=retrieval), None
+
+    # Only talks to the email handler and never touches the conversation, so it's safe to run off the main thread
+    def run_email_job(self, job):
+        job.result = self.email_handler.handle_email_task(job.current_state, job.subintent, job.query, job.session_id)
+        return job
+
+    # Has to run wherever the conversation lives (the Tk thread for the GUI), this is where the email result changes the state
+    def finish_email_job(self, job):
+        new_state, response_text, session_data, action_data = job.result
+        response = ""
+        handled = False
+        if response_text != EMAIL_PASS_SIGNAL:
+            handled = True
+            if session_data is not None:
+                self.session_id, self.email_address = session_data
+            managed_new_state = new_state if new_state else "normal"
+            prompt_to_save = response_text if managed_new_state != "normal" else None
+            self.manage_state(managed_new_state, prompt_to_save)
+            response = response_text
+        return self._finish_turn(job.query, job.current_state, job.intent, job.subintent, job.score, handled, response, action_data, job.candidates, job.retrieval)
+
+    def _finish_turn(self, query, current_state, intent, subintent, score, handled, response, action_data=None, candidates=(), retrieval=None):
+        # The order of the intents here don't matter, as the query is only labeled with one intent
+        if not handled and intent == "SmallTalk":
+            handled = True
+            if retrieval is not None:
+                raw_response = self.small_talk_handler.respond(*retrieval['small_talk'], threshold=0.4)
+            else:
+                raw_response = self.small_talk_handler.get_small_talk_response(query, threshold=0.4)
+            if "{username}" in raw_response:
+                name_to_insert = self.username if self.username else "friend"
+                response = raw_response.replace("{username}", name_to_insert)
+            else:
+                response = raw_response
+        elif not handled and intent == "QuestionAnswering":
+            handled = True
+            if retrieval is not None:
+                response = self.qa_handler.respond(*retrieval['question_answer'], threshold=0.65)
+            else:
+                response = self.qa_handler.get_QA_response(query, threshold=0.65)
+        elif not handled and intent == "Discoverability":
+            handled = True
+            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent=subintent, current_state=current_state)
+            prompt_to_save = response_text if new_state != "normal" else None
+            self.manage_state(new_state, prompt_to_save)
+            response = response_text
+        if not handled:
+            if intent == "Unrecognized":
+                response = "Forgive me, but I'm unable to recognize what you are saying."
+            else:
+                # This only really happens if the intent classifier's dataset fails to load, usually it's a permission error
+                response = "[SYSTEM ERROR]: An internal classification error occurred."
+        return self._reply(response, intent, subintent, score, action_data, candidates)
+
+    # Commands never reach the classifier, so they come back tagged as "Command"
+    # candidates are the classifier's n best guesses, best first, so a caller can ask "did you mean..." when the top two are close
+    def _reply(self, text, intent="Command", subintent="none", score=0.0, action=None, candidates=()):
+        return {
+            'text': text,
+            'state': self.chat_stack[-1],
+            'intent': intent,
+            'subintent': subintent,
+            'score': float(score),
+            'action': action,
+            'candidates': [{'intent': i, 'subintent': si, 'score': float(sc)} for i, si, sc in candidates]
+        }
+
+    # Runs a whole list of utterances through this conversation in order, handy for evaluation and throughput testing
+    def respond_many(self, queries):
+        return [self.respond(query) for query in queries]
+
+# Plain stdin/stdout mode, one utterance per line, no display needed
+# e.g. python engine.py < evaluation/some_utterances.txt
+def run_stdio(input_stream=sys.stdin, output_stream=sys.stdout, as_json=False, preprocessing='full', watch_datasets=False, qa_shards=None, handlers=None):
+    engine = DialogueEngine(handlers if handlers is not None else build_handler_registry(preprocessing, watch_datasets, qa_shards))
+    for line in input_stream:
+        query = line.strip()
+        if not query:
+            continue
+        result = engine.respond(query)
+        if as_json:
+            output_stream.write(json.dumps(dict(result, query=query), default=str) + "\n")
+        else:
+            output_stream.write(f"YOU: {query}\nMAILA: {result['text']}\n")
+            if result['action'] and result['action']['action'] == 'view_email':
+                email_data = result['action']['data']
+                output_stream.write(f"--- {email_data.get('mail_subject', 'No Subject')} ({email_data.get('mail_from', 'Unknown Sender')}) ---\n{email_data.get('mail_body', 'No content.')}\n---\n")
+        output_stream.flush()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run Maila without the GUI, reading one utterance per line from stdin.")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per response instead of plain text")
+    parser.add_argument("--preprocessing", choices=PREPROCESSING_MODES, default='full', help="'fast' skips the POS tagger and uses the precomputed lemma table")
+    parser.add_argument("--watch-datasets", action="store_true", help="reload the CSVs in datasets/ when they change")
+    parser.add_argument("--qa-shards", type=int, default=None, help="answer Q&A from this many worker processes")
+    args = parser.parse_args()
+    try:
+        handlers = build_handler_registry(args.preprocessing, args.watch_datasets, args.qa_shards)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    run_stdio(as_json=args.json, handlers=handlers)
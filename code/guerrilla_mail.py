@@ -2,62 +2,289 @@ import requests
 import time
 import os
 import json
-from requests.exceptions import RequestException, HTTPError, ConnectionError
+import random
+import socket
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.exceptions import RequestException, HTTPError, ConnectionError, Timeout
+from urllib.parse import urlsplit
 from urllib3.exceptions import NameResolutionError
+from inbox import Inbox
+from mail_export import build_message, archive_path, open_archive
 
-# This is the API implementation
-class GuerrillaSession:
+# Only AsyncGuerrillaSession needs aiohttp, the GUI and the sync handler work fine without it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# fetch_email responses keyed by mail_id, so viewing an email and then downloading it (or opening it twice) only fetches it once
+# Bounded by the total size of the bodies rather than the number of emails, one huge newsletter shouldn't be able to eat all the memory
+# There's one for the whole process (shared_body_cache below) so the bound holds however many sessions the registry keeps,
+# each session gets a view() of it whose keys are (owner, mail_id) underneath
+class EmailBodyCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._owners = itertools.count(1)
+
+    def view(self):
+        return BodyCacheView(self, next(self._owners))
+
+    def get(self, mail_id):
+        with self._lock:
+            entry = self._entries.get(mail_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(mail_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, mail_id, response):
+        size = len(response.get('mail_body', '').encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(mail_id)
+            self._entries[mail_id] = (response, size)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+
+    def _discard(self, mail_id):
+        entry = self._entries.pop(mail_id, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+
+    def invalidate(self, mail_ids):
+        with self._lock:
+            for mail_id in mail_ids:
+                self._discard(mail_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    # Only when a session is forgotten or evicted, so a scan over the entries is fine
+    def clear_owner(self, owner):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == owner]:
+                self._discard(key)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self.size_bytes, 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+# One session's part of the shared cache, it takes plain mail_ids like the per-session cache used to
+# Two mailboxes can have the same mail_id (the fake server numbers every one from 1), the owner keeps them apart
+class BodyCacheView:
+    def __init__(self, cache, owner):
+        self.cache = cache
+        self.owner = owner
+
+    def get(self, mail_id):
+        return self.cache.get((self.owner, mail_id))
+
+    def put(self, mail_id, response):
+        self.cache.put((self.owner, mail_id), response)
+
+    def invalidate(self, mail_ids):
+        self.cache.invalidate([(self.owner, mail_id) for mail_id in mail_ids])
+
+    def clear(self):
+        self.cache.clear_owner(self.owner)
+
+    def stats(self):
+        return self.cache.stats()
+
+shared_body_cache = EmailBodyCache()
+
+# Raised whenever the API answers with auth-session-not-initialized, i.e. the sid_token is no longer valid on their side
+class SessionExpiredError(Exception):
+    pass
+
+# A requests ConnectionError on purpose, so everything that already handles "can't reach the API" handles this too, it's just instant
+class CircuitOpenError(ConnectionError):
+    pass
+
+# Without this, being offline meant every single email action sat through DNS and the timeout again before failing
+# After a few failures in a row (or a single DNS failure) the breaker opens and calls fail straight away, a background thread keeps trying a plain TCP connect
+# to the API host and closes it again as soon as that works, so nothing has to waste a real request to find out it's back
+class CircuitBreaker:
+    def __init__(self, api_url, failure_threshold=3, probe_interval=5.0, probe_timeout=2.0):
+        parts = urlsplit(api_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failures = 0
+        self.is_open = False
+        self._probe_thread = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        if self.is_open:
+            raise CircuitOpenError(f"{self.host} is unreachable, not trying again until it's back.")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < self.failure_threshold:
+                return
+            self._open()
+
+    # Opens straight away, for a failure that says on its own the next call won't go any better (the hostname doesn't resolve)
+    # The connect timeout doesn't cover the DNS lookup, so waiting for the threshold would mean sitting through it twice more
+    def trip(self):
+        with self._lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            if not self.is_open:
+                self._open()
+
+    # Only with _lock held
+    def _open(self):
+        self.is_open = True
+        print(f"[SYSTEM WARNING]: {self.host} looks unreachable, email actions will fail fast until it's back.")
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="guerrilla-probe", daemon=True)
+            self._probe_thread.start()
+
+    def probe(self):
+        try:
+            socket.create_connection((self.host, self.port), timeout=self.probe_timeout).close()
+            return True
+        except OSError:
+            return False
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            if self.probe():
+                with self._lock:
+                    self.is_open = False
+                    self.failures = 0
+                print(f"[SYSTEM]: {self.host} is reachable again.")
+                return
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# Every session talking to the same API shares one breaker, once one user's call finds it down nobody else has to wait it out
+def get_circuit_breaker(api_url):
+    with _breakers_lock:
+        if api_url not in _breakers:
+            _breakers[api_url] = CircuitBreaker(api_url)
+        return _breakers[api_url]
+
+# Connection problems, timeouts and 5xx mean the API (or the network) is down, a 4xx or a bad sid_token doesn't
+def _is_outage(error):
+    if isinstance(error, HTTPError):
+        response = error.response
+        return response is None or response.status_code >= 500
+    return isinstance(error, (ConnectionError, Timeout))
+
+# A hostname that doesn't resolve (usually no network at all) won't resolve a quarter of a second later either
+# requests buries it as ConnectionError -> MaxRetryError -> NameResolutionError, aiohttp as a gaierror under the ConnectionError
+def _is_name_resolution(error):
+    seen = set()
+    while isinstance(error, BaseException) and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (NameResolutionError, socket.gaierror)):
+            return True
+        inner = error.args[0] if error.args and isinstance(error.args[0], BaseException) else None
+        error = inner or getattr(error, 'reason', None) or getattr(error, 'os_error', None) or error.__cause__
+    return False
+
+# Everything about the Guerrilla Mail protocol that doesn't actually touch the network: building params, reading responses,
+# keeping the inbox in order, turning "1-3" into mail_ids and so on
+# GuerrillaSession (requests) and AsyncGuerrillaSession (aiohttp) only add the transport on top, so the two can't drift apart
+class _GuerrillaProtocol:
     
     API_URL = "https://api.guerrillamail.com/ajax.php"
+    CONNECT_TIMEOUT = 3.05 # Getting a connection is quick or it isn't happening, only the read gets the long timeout
+    READ_TIMEOUT = 10
+    MAX_RETRIES = 2 # Only for GETs, a retried POST could delete or forget twice
+    BACKOFF_BASE = 0.25
+    BACKOFF_CAP = 2.0
+    RESYNC_EVERY = 10 # check_email never says what's gone, so every this many incremental refreshes one is a full get_email_list
 
-    def __init__(self, lang='en'):
-        self.session = requests.Session()
+    # api_url lets everything point at a stand-in server instead (see evaluation/fake_guerrilla.py)
+    def __init__(self, lang='en', api_url=None):
         self.lang = lang
+        self.api_url = api_url or self.API_URL
         self.sid_token = None
         self.email_addr = None
         self.email_timestamp = None
         self.alias = None
-        self.inbox = []
-        
-    def start_new_session(self):
-        params = {'lang': self.lang}
-        self.sid_token = None 
-        response = self._api_call('get_email_address', params, method='GET')
-        if response and 'email_addr' in response:
-            self._update_session_details(response)
-            return True
-        return False
-
-    def restore_session(self, sid_token):
-        if not sid_token:
-            raise ValueError("Session ID is required to restore.")
-            
-        params = {'sid_token': sid_token, 'lang': self.lang}
-        response = self._api_call('get_email_address', params, method='GET')
-        
-        if response and 'auth' in response and 'error_codes' in response['auth'] and 'auth-session-not-initialized' in response['auth']['error_codes']:
-            raise Exception(f"Session ID {sid_token} is invalid or has expired.")
-        elif response and 'email_addr' in response:
-            self._update_session_details(response)
-            return True
-        return False
+        self.inbox = Inbox()
+        self.last_seq = 0 # Highest mail_id seen so far, check_email only sends back what's newer than this
+        self.incremental_syncs = 0 # check_email refreshes since the last full get_email_list
+        self._state_lock = threading.Lock() # Downloads call the API from several threads at once
+        self.body_cache = shared_body_cache.view()
+        self.breaker = get_circuit_breaker(self.api_url)
 
     def _update_session_details(self, response_json):
         if not isinstance(response_json, dict):
             return
+        with self._state_lock:
+            self._apply_session_details(response_json)
 
+    def _apply_session_details(self, response_json):
         self.sid_token = response_json.get('sid_token', self.sid_token)
         self.email_addr = response_json.get('email_addr', self.email_addr)
         self.email_timestamp = response_json.get('email_timestamp', self.email_timestamp)
         self.alias = response_json.get('alias', self.alias)
         
         if 'list' in response_json:
-            existing_ids = {email['mail_id'] for email in self.inbox}
-            new_emails = [email for email in response_json['list'] if email['mail_id'] not in existing_ids]
-            self.inbox = new_emails + self.inbox
-            self.inbox.sort(key=lambda x: int(x.get('mail_timestamp', 0)), reverse=True)
+            self._merge_emails(response_json['list'])
 
-    def _api_call(self, func_name, params=None, method='GET'):
+    # New mail gets slotted into place (newest first) instead of re-sorting the whole inbox every time
+    def _merge_emails(self, emails):
+        for mail_id in self.inbox.extend(emails):
+            try:
+                self.last_seq = max(self.last_seq, int(mail_id))
+            except (TypeError, ValueError):
+                pass
+
+    def _reset_inbox(self):
+        self.inbox.clear()
+        self.last_seq = 0
+        self.incremental_syncs = 0
+
+    # A get_email_list at offset 0 is the newest page of the mailbox as the server has it right now, so anything held here that sorts
+    # inside that page but isn't on it was deleted or expired on the server (or deleted from another client)
+    # When the page is the whole mailbox ('count'), anything not on it is gone, older than the page included
+    def _drop_missing(self, response):
+        listed = {email['mail_id'] for email in response['list']}
+        try:
+            everything = len(listed) >= int(response.get('count') or 0)
+        except (TypeError, ValueError):
+            everything = False
+        with self._state_lock:
+            ids = self.inbox.ids()
+            if not everything:
+                positions = [self.inbox.position(mail_id) for mail_id in listed if mail_id in self.inbox]
+                ids = ids[:max(positions) + 1] if positions else []
+            gone = [mail_id for mail_id in ids if mail_id not in listed]
+            self.inbox.remove(gone)
+        self.body_cache.invalidate(gone)
+
+    def _build_params(self, func_name, params):
         if params is None:
             params = {}
         if isinstance(params, dict):
@@ -68,42 +295,56 @@ class GuerrillaSession:
             params_list.append(('f', func_name))
         if self.sid_token and 'sid_token' not in [p[0] for p in params_list]:
             params_list.append(('sid_token', self.sid_token))
+        return params_list
 
-        try:
-            if method.upper() == 'GET':
-                response = self.session.get(self.API_URL, params=params_list, timeout=10)
-            elif method.upper() == 'POST':
-                response = self.session.post(self.API_URL, data=params_list, timeout=10)
-            else:
-                raise ValueError("Method must be 'GET' or 'POST'")
+    # Full jitter, so a crowd of sessions that all failed together don't all come back at the same moment
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.BACKOFF_CAP, self.BACKOFF_BASE * (2 ** attempt)))
 
-            response.raise_for_status()
-            response_json = response.json()
+    # Called after every failed attempt, returns True if it's worth another go
+    # A DNS failure isn't retried and opens the breaker outright, only timeouts, dropped connections and 5xx are retried
+    def _should_retry(self, method, attempt, error):
+        if _is_name_resolution(error):
+            self.breaker.trip()
+            return False
+        outage = _is_outage(error)
+        if outage:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return outage and method == 'GET' and attempt < self.MAX_RETRIES and not self.breaker.is_open
 
-            if not isinstance(response_json, dict):
-                return response_json
-            
-            if 'sid_token' in response_json and response_json['sid_token'] != self.sid_token:
-                self.sid_token = response_json['sid_token']
-            
-            self._update_session_details(response_json)
+    def _handle_response(self, response_json, params_list):
+        if not isinstance(response_json, dict):
             return response_json
 
-        except (ConnectionError, NameResolutionError, HTTPError, RequestException) as e:
-            print(f"[GuerrillaSession ERROR] API call failed: {e}")
-            raise e
-        except json.JSONDecodeError:
-            print(f"[GuerrillaSession ERROR] Failed to decode JSON response: {response.text}")
-            raise Exception("Failed to decode API response.")
-        return None 
+        auth = response_json.get('auth')
+        if isinstance(auth, dict) and 'auth-session-not-initialized' in auth.get('error_codes', []):
+            sid_token = dict(params_list).get('sid_token', self.sid_token)
+            raise SessionExpiredError(f"Session ID {sid_token} is invalid or has expired.")
+        
+        if 'sid_token' in response_json and response_json['sid_token'] != self.sid_token:
+            self.sid_token = response_json['sid_token']
+        
+        self._update_session_details(response_json)
+        return response_json
 
-    def get_inbox_list(self, offset=0):
+    def _inbox_request(self, offset, incremental):
         if not self.sid_token:
             raise Exception("No active session.")
-        response = self._api_call('get_email_list', {'offset': str(offset)})
-        if response and 'list' in response:
-            return self.inbox
-        return []
+        if incremental and offset == 0 and self.last_seq and self.incremental_syncs < self.RESYNC_EVERY:
+            self.incremental_syncs += 1
+            return 'check_email', {'seq': str(self.last_seq)}
+        if offset == 0:
+            self.incremental_syncs = 0
+        return 'get_email_list', {'offset': str(offset)}
+
+    def _inbox_result(self, func_name, offset, response):
+        if not (response and 'list' in response):
+            return []
+        if func_name == 'get_email_list' and offset == 0:
+            self._drop_missing(response)
+        return self.inbox
 
     def _get_email_ids_from_indices(self, indices_str):
         if not self.inbox:
@@ -113,7 +354,7 @@ class GuerrillaSession:
         max_index = len(self.inbox)
         
         if indices_str.lower() == 'all':
-            return [email['mail_id'] for email in self.inbox]
+            return self.inbox.ids()
             
         parts = indices_str.split(',')
         for part in parts:
@@ -134,10 +375,10 @@ class GuerrillaSession:
                 except ValueError:
                     continue
                     
-        mail_ids = [self.inbox[i]['mail_id'] for i in sorted(list(indices_to_process))]
+        mail_ids = [self.inbox.id_at(i) for i in sorted(indices_to_process)]
         return mail_ids
 
-    def fetch_email_body(self, index):
+    def _resolve_index(self, index):
         if not self.sid_token:
             raise Exception("No active session.")
         try:
@@ -146,33 +387,30 @@ class GuerrillaSession:
                 raise ValueError(f"Index {index_int} is out of bounds (1-{len(self.inbox)}).")
         except ValueError:
             raise ValueError("Index must be a number.")
-            
-        mail_id = self.inbox[index_int - 1]['mail_id']
-        response = self._api_call('fetch_email', {'email_id': mail_id})
-        
-        if response and 'mail_body' in response:
-            self.inbox[index_int - 1]['mail_read'] = '1'
-            return response
-        return None
+        return index_int
 
-    def delete_emails(self, indices_str):
+    def cache_stats(self):
+        return self.body_cache.stats()
+
+    def _delete_request(self, indices_str):
         if not self.sid_token:
             raise Exception("No active session.")
         
         mail_ids = self._get_email_ids_from_indices(indices_str)
         if not mail_ids:
             raise ValueError("No valid email indices provided.")
-            
-        params = [('email_ids[]', mid) for mid in mail_ids]
-        response = self._api_call('del_email', params=params, method='POST')
-        
+        return [('email_ids[]', mid) for mid in mail_ids]
+
+    def _apply_deleted(self, response):
         if response and 'deleted_ids' in response:
             deleted_ids_set = set(response['deleted_ids'])
-            self.inbox = [email for email in self.inbox if email['mail_id'] not in deleted_ids_set]
+            with self._state_lock:
+                self.inbox.remove(deleted_ids_set)
+            self.body_cache.invalidate(deleted_ids_set)
             return deleted_ids_set
         return None
 
-    def download_emails(self, indices_str):
+    def _prepare_download(self, indices_str):
         if not self.sid_token:
             raise Exception("No active session.")
         
@@ -182,33 +420,223 @@ class GuerrillaSession:
             
         save_dir = os.path.join("downloads", self.sid_token)
         os.makedirs(save_dir, exist_ok=True)
+        return mail_ids, save_dir
+
+    def _finish_download(self, mail_ids, results, errors):
+        downloaded_files = [results[mail_id] for mail_id in mail_ids if results.get(mail_id)]
+        failed_files = len(mail_ids) - len(downloaded_files)
+        # If not a single one made it and the API was erroring, it's the connection that's the problem, let the handler say so
+        if not downloaded_files and errors:
+            raise errors[-1]
+        return (downloaded_files, failed_files)
+
+    def _save_email(self, save_dir, mail_id, email_data):
+        subject = email_data.get('mail_subject', 'no_subject').replace(' ', '_')
+        subject = "".join(c for c in subject if c.isalnum() or c in ('_', '-')).rstrip()
+        filename = f"{mail_id}_{subject[:30]}.html"
+        filepath = os.path.join(save_dir, filename)   
+        try:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(email_data['mail_body'])
+            return filepath
+        except IOError as e:
+            print(f"Error writing file {filepath}: {e}")
+            return None
+
+    def _prepare_export(self, indices_str, fmt, compress):
+        mail_ids, save_dir = self._prepare_download(indices_str)
+        path = archive_path(save_dir, fmt, compress)
+        return mail_ids, path, open_archive(path, fmt, compress)
+
+    def _export_one(self, archive, mail_id, email_data):
+        archive.add(mail_id, build_message(email_data, self.email_addr))
+        record = self.inbox.get(mail_id)
+        if record is not None:
+            record['mail_read'] = '1'
+
+    # Returns (archive_path, exported, failed), same idea as _finish_download, an empty archive isn't kept
+    def _finish_export(self, archive, total, exported, errors):
+        if not exported:
+            archive.abort()
+            if errors:
+                raise errors[-1]
+            return (None, 0, total)
+        archive.close()
+        return (archive.path, exported, total - exported)
+
+    def _apply_forget(self):
+        self.email_addr = None
+        self.email_timestamp = None
+        self.alias = None
+        self._reset_inbox()
+        self.body_cache.clear()
+
+# This is the API implementation
+class GuerrillaSession(_GuerrillaProtocol):
+
+    def __init__(self, lang='en', api_url=None):
+        super().__init__(lang, api_url)
+        self.session = requests.Session()
         
-        downloaded_files = []
-        failed_files = 0
-        
-        for mail_id in mail_ids:
-            index = next((i for i, email in enumerate(self.inbox) if email['mail_id'] == mail_id), -1)
-            if index == -1:
-                failed_files += 1
-                continue
+    def start_new_session(self):
+        params = {'lang': self.lang}
+        self.sid_token = None 
+        response = self._api_call('get_email_address', params, method='GET')
+        if response and 'email_addr' in response:
+            self._update_session_details(response)
+            return True
+        return False
 
-            email_data = self.fetch_email_body(index + 1)
+    def restore_session(self, sid_token):
+        if not sid_token:
+            raise ValueError("Session ID is required to restore.")
             
-            if isinstance(email_data, dict) and 'mail_body' in email_data:
-                subject = email_data.get('mail_subject', 'no_subject').replace(' ', '_')
-                subject = "".join(c for c in subject if c.isalnum() or c in ('_', '-')).rstrip()
-                filename = f"{mail_id}_{subject[:30]}.html"
-                filepath = os.path.join(save_dir, filename)   
+        params = {'sid_token': sid_token, 'lang': self.lang}
+        response = self._api_call('get_email_address', params, method='GET')
+        
+        if response and 'email_addr' in response:
+            self._update_session_details(response)
+            return True
+        return False
+
+    def _api_call(self, func_name, params=None, method='GET'):
+        params_list = self._build_params(func_name, params)
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise ValueError("Method must be 'GET' or 'POST'")
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                if method == 'GET':
+                    response = self.session.get(self.api_url, params=params_list, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+                else:
+                    response = self.session.post(self.api_url, data=params_list, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+                response.raise_for_status()
+                self.breaker.record_success()
+                break
+            except RequestException as e:
+                if self._should_retry(method, attempt, e):
+                    print(f"[GuerrillaSession WARNING] {func_name} failed, retrying: {e}")
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                print(f"[GuerrillaSession ERROR] API call failed: {e}")
+                raise e
+
+        try:
+            return self._handle_response(response.json(), params_list)
+        except json.JSONDecodeError:
+            print(f"[GuerrillaSession ERROR] Failed to decode JSON response: {response.text}")
+            raise Exception("Failed to decode API response.")
+
+    # Once the inbox has been fetched, refreshing only asks for mail newer than last_seq so the cost scales with new mail, not inbox size
+    # incremental=False (or any offset) goes back to the full get_email_list, which also drops what the server no longer has,
+    # and so does every RESYNC_EVERY-th refresh
+    def get_inbox_list(self, offset=0, incremental=True):
+        func_name, params = self._inbox_request(offset, incremental)
+        response = self._api_call(func_name, params)
+        return self._inbox_result(func_name, offset, response)
+
+    def fetch_email_body(self, index):
+        index_int = self._resolve_index(index)
+        mail_id = self.inbox[index_int - 1]['mail_id']
+        response = self._fetch_by_mail_id(mail_id)
+        
+        if response:
+            self.inbox[index_int - 1]['mail_read'] = '1'
+            return response
+        return None
+
+    # Everything that reads a body (view, download) goes through here, so it all shares the cache
+    # Exports pass cache=False, streaming a whole inbox through would just push out the emails the user actually opened
+    def _fetch_by_mail_id(self, mail_id, cache=True):
+        cached = self.body_cache.get(mail_id)
+        if cached is not None:
+            return cached
+        response = self._api_call('fetch_email', {'email_id': mail_id})
+        if isinstance(response, dict) and 'mail_body' in response:
+            if cache:
+                self.body_cache.put(mail_id, response)
+            return response
+        return None
+
+    def delete_emails(self, indices_str):
+        params = self._delete_request(indices_str)
+        response = self._api_call('del_email', params=params, method='POST')
+        return self._apply_deleted(response)
+
+    # Messages are fetched and written by a small pool of workers, so one file hits the disk while the next few are still downloading
+    # progress, if given, is called after each message as progress(mail_id, filepath_or_None, done, total)
+    def download_emails(self, indices_str, max_workers=4, progress=None):
+        mail_ids, save_dir = self._prepare_download(indices_str)
+        results = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(mail_ids))), thread_name_prefix="guerrilla-download") as pool:
+            futures = {pool.submit(self._download_one, mail_id, save_dir): mail_id for mail_id in mail_ids}
+            for done, future in enumerate(as_completed(futures), 1):
+                mail_id = futures[future]
                 try:
-                    with open(filepath, 'w', encoding='utf-8') as f:
-                        f.write(email_data['mail_body'])
-                    downloaded_files.append(filepath)
-                except IOError as e:
-                    print(f"Error writing file {filepath}: {e}")
-                    failed_files += 1
-            else:
-                failed_files += 1
-        return (downloaded_files, failed_files)
+                    results[mail_id] = future.result()
+                except SessionExpiredError:
+                    raise
+                except Exception as e:
+                    print(f"[GuerrillaSession ERROR] Download of email {mail_id} failed: {e}")
+                    results[mail_id] = None
+                    errors.append(e)
+                if progress:
+                    progress(mail_id, results[mail_id], done, len(mail_ids))
+        return self._finish_download(mail_ids, results, errors)
+
+    def _download_one(self, mail_id, save_dir):
+        record = self.inbox.get(mail_id)
+        if record is None:
+            return None
+        email_data = self._fetch_by_mail_id(mail_id)
+        if email_data is None:
+            return None
+        record['mail_read'] = '1'
+        return self._save_email(save_dir, mail_id, email_data)
+
+    # Streams the selected emails into a single mbox or zip instead of one .html file each
+    # Bodies are fetched by a few workers ahead of the writer but written in inbox order, and only a couple of windows' worth
+    # are ever in memory, so exporting 10 emails or 10,000 uses the same amount
+    # compress=None means the format's default (deflated zip, plain mbox), progress works like it does for download_emails
+    def export_emails(self, indices_str, fmt='mbox', compress=None, max_workers=4, progress=None):
+        if compress is None:
+            compress = fmt == 'zip'
+        mail_ids, path, archive = self._prepare_export(indices_str, fmt, compress)
+        exported = 0
+        errors = []
+        queued = iter(mail_ids)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="guerrilla-export") as pool:
+                pending = deque((mail_id, pool.submit(self._fetch_by_mail_id, mail_id, False)) for mail_id in itertools.islice(queued, max(1, max_workers) * 2))
+                done = 0
+                while pending:
+                    mail_id, future = pending.popleft()
+                    next_id = next(queued, None)
+                    if next_id is not None:
+                        pending.append((next_id, pool.submit(self._fetch_by_mail_id, next_id, False)))
+                    try:
+                        email_data = future.result()
+                    except SessionExpiredError:
+                        raise
+                    except Exception as e:
+                        print(f"[GuerrillaSession ERROR] Export of email {mail_id} failed: {e}")
+                        errors.append(e)
+                        email_data = None
+                    if email_data is not None:
+                        self._export_one(archive, mail_id, email_data)
+                        exported += 1
+                    done += 1
+                    if progress:
+                        progress(mail_id, path if email_data is not None else None, done, len(mail_ids))
+        except BaseException:
+            archive.abort()
+            raise
+        return self._finish_export(archive, len(mail_ids), exported, errors)
 
     def forget_current_email(self):
         if not self.sid_token:
@@ -220,9 +648,275 @@ class GuerrillaSession:
         response = self._api_call('forget_me', params, method='POST')
         
         if response:
-            self.email_addr = None
-            self.email_timestamp = None
-            self.alias = None
-            self.inbox = []
+            self._apply_forget()
+            return True
+        return False
+
+# Same operations as GuerrillaSession but every network call is a coroutine, so thousands of mailboxes can share one event loop
+# Pass in a shared aiohttp.ClientSession (with a DummyCookieJar, the sid_token is all Guerrilla needs) to pool connections between mailboxes
+# aiohttp errors are turned into the matching requests exceptions, so EmailHandler's error handling works the same for both
+class AsyncGuerrillaSession(_GuerrillaProtocol):
+
+    def __init__(self, lang='en', api_url=None, http=None):
+        if aiohttp is None:
+            raise ImportError("AsyncGuerrillaSession needs the 'aiohttp' package (pip install aiohttp).")
+        super().__init__(lang, api_url)
+        self.http = http
+        self._owns_http = http is None
+
+    def _get_http(self):
+        if self.http is None:
+            self.http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.CONNECT_TIMEOUT, sock_read=self.READ_TIMEOUT))
+        return self.http
+
+    async def close(self):
+        if self._owns_http and self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start_new_session(self):
+        params = {'lang': self.lang}
+        self.sid_token = None 
+        response = await self._api_call('get_email_address', params, method='GET')
+        if response and 'email_addr' in response:
+            self._update_session_details(response)
+            return True
+        return False
+
+    async def restore_session(self, sid_token):
+        if not sid_token:
+            raise ValueError("Session ID is required to restore.")
+            
+        params = {'sid_token': sid_token, 'lang': self.lang}
+        response = await self._api_call('get_email_address', params, method='GET')
+        
+        if response and 'email_addr' in response:
+            self._update_session_details(response)
+            return True
+        return False
+
+    async def _send(self, http, method, func_name, params_list, timeout):
+        try:
+            if method == 'GET':
+                request = http.get(self.api_url, params=params_list, timeout=timeout)
+            else:
+                request = http.post(self.api_url, data=aiohttp.FormData(params_list), timeout=timeout)
+            async with request as response:
+                response.raise_for_status()
+                return await response.text()
+        except aiohttp.ClientResponseError as e:
+            # Keeps the status around so a 5xx still counts against the breaker like it does for requests
+            status = requests.Response()
+            status.status_code = e.status
+            raise HTTPError(str(e), response=status)
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        except asyncio.TimeoutError:
+            raise Timeout(f"Request to {func_name} timed out.")
+        except aiohttp.ClientError as e:
+            raise RequestException(str(e))
+
+    async def _api_call(self, func_name, params=None, method='GET'):
+        params_list = self._build_params(func_name, params)
+        method = method.upper()
+        if method not in ('GET', 'POST'):
+            raise ValueError("Method must be 'GET' or 'POST'")
+        http = self._get_http()
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.CONNECT_TIMEOUT, sock_read=self.READ_TIMEOUT)
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                text = await self._send(http, method, func_name, params_list, timeout)
+                self.breaker.record_success()
+                break
+            except RequestException as e:
+                if self._should_retry(method, attempt, e):
+                    print(f"[GuerrillaSession WARNING] {func_name} failed, retrying: {e}")
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                print(f"[GuerrillaSession ERROR] API call failed: {e}")
+                raise e
+
+        try:
+            response_json = json.loads(text)
+        except json.JSONDecodeError:
+            print(f"[GuerrillaSession ERROR] Failed to decode JSON response: {text}")
+            raise Exception("Failed to decode API response.")
+        return self._handle_response(response_json, params_list)
+
+    async def get_inbox_list(self, offset=0, incremental=True):
+        func_name, params = self._inbox_request(offset, incremental)
+        response = await self._api_call(func_name, params)
+        return self._inbox_result(func_name, offset, response)
+
+    async def fetch_email_body(self, index):
+        index_int = self._resolve_index(index)
+        mail_id = self.inbox[index_int - 1]['mail_id']
+        response = await self._fetch_by_mail_id(mail_id)
+        
+        if response:
+            self.inbox[index_int - 1]['mail_read'] = '1'
+            return response
+        return None
+
+    async def _fetch_by_mail_id(self, mail_id, cache=True):
+        cached = self.body_cache.get(mail_id)
+        if cached is not None:
+            return cached
+        response = await self._api_call('fetch_email', {'email_id': mail_id})
+        if isinstance(response, dict) and 'mail_body' in response:
+            if cache:
+                self.body_cache.put(mail_id, response)
+            return response
+        return None
+
+    async def delete_emails(self, indices_str):
+        params = self._delete_request(indices_str)
+        response = await self._api_call('del_email', params=params, method='POST')
+        return self._apply_deleted(response)
+
+    # A semaphore plays the part of the worker pool, file writes go to a thread so they don't stall the loop
+    async def download_emails(self, indices_str, max_workers=4, progress=None):
+        mail_ids, save_dir = self._prepare_download(indices_str)
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def download_one(mail_id):
+            record = self.inbox.get(mail_id)
+            if record is None:
+                return mail_id, None, None
+            try:
+                async with semaphore:
+                    email_data = await self._fetch_by_mail_id(mail_id)
+                if email_data is None:
+                    return mail_id, None, None
+                record['mail_read'] = '1'
+                return mail_id, await asyncio.to_thread(self._save_email, save_dir, mail_id, email_data), None
+            except SessionExpiredError:
+                raise
+            except Exception as e:
+                return mail_id, None, e
+
+        results = {}
+        errors = []
+        for done, task in enumerate(asyncio.as_completed([download_one(mail_id) for mail_id in mail_ids]), 1):
+            mail_id, filepath, error = await task
+            if error is not None:
+                print(f"[GuerrillaSession ERROR] Download of email {mail_id} failed: {error}")
+                errors.append(error)
+            results[mail_id] = filepath
+            if progress:
+                progress(mail_id, filepath, done, len(mail_ids))
+        return self._finish_download(mail_ids, results, errors)
+
+    # Same window as the sync export, the fetches are tasks and each archive write goes to a thread so the loop isn't blocked on disk
+    async def export_emails(self, indices_str, fmt='mbox', compress=None, max_workers=4, progress=None):
+        if compress is None:
+            compress = fmt == 'zip'
+        mail_ids, path, archive = await asyncio.to_thread(self._prepare_export, indices_str, fmt, compress)
+        exported = 0
+        errors = []
+        queued = iter(mail_ids)
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def fetch(mail_id):
+            async with semaphore:
+                return await self._fetch_by_mail_id(mail_id, cache=False)
+
+        pending = deque((mail_id, asyncio.ensure_future(fetch(mail_id))) for mail_id in itertools.islice(queued, max(1, max_workers) * 2))
+        try:
+            done = 0
+            while pending:
+                mail_id, task = pending.popleft()
+                next_id = next(queued, None)
+                if next_id is not None:
+                    pending.append((next_id, asyncio.ensure_future(fetch(next_id))))
+                try:
+                    email_data = await task
+                except SessionExpiredError:
+                    raise
+                except Exception as e:
+                    print(f"[GuerrillaSession ERROR] Export of email {mail_id} failed: {e}")
+                    errors.append(e)
+                    email_data = None
+                if email_data is not None:
+                    await asyncio.to_thread(self._export_one, archive, mail_id, email_data)
+                    exported += 1
+                done += 1
+                if progress:
+                    progress(mail_id, path if email_data is not None else None, done, len(mail_ids))
+        except BaseException:
+            for _, task in pending:
+                task.cancel()
+            archive.abort()
+            raise
+        return await asyncio.to_thread(self._finish_export, archive, len(mail_ids), exported, errors)
+
+    async def forget_current_email(self):
+        if not self.sid_token:
+            raise Exception("No active session.")
+        if not self.email_addr:
+            return True 
+         
+        params = {'email_addr': self.email_addr}
+        response = await self._api_call('forget_me', params, method='POST')
+        
+        if response:
+            self._apply_forget()
             return True
-        return False
\ No newline at end of file
+        return False
+
+# Keeps the live GuerrillaSession for each sid_token around between turns, instead of building and restoring a new one every time
+# Guerrilla Mail drops a sid_token after 18 minutes without use, so entries idle longer than that are evicted here too
+class SessionRegistry:
+    def __init__(self, idle_ttl=15 * 60, max_sessions=256):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # An evicted session's bodies go with it, nothing can ask for them again (a restore builds a new session)
+    def _evict(self, now):
+        expired = [sid for sid, (_, last_used) in self._sessions.items() if now - last_used > self.idle_ttl]
+        for sid in expired:
+            self._sessions.pop(sid)[0].body_cache.clear()
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)[1][0].body_cache.clear()
+
+    def get(self, sid_token):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(sid_token)
+            if entry is None:
+                return None
+            self._sessions[sid_token] = (entry[0], now)
+            self._sessions.move_to_end(sid_token)
+            return entry[0]
+
+    def put(self, sid_token, session):
+        now = time.monotonic()
+        with self._lock:
+            replaced = self._sessions.get(sid_token)
+            if replaced is not None and replaced[0] is not session:
+                replaced[0].body_cache.clear()
+            self._sessions[sid_token] = (session, now)
+            self._sessions.move_to_end(sid_token)
+            self._evict(now)
+
+    def discard(self, sid_token):
+        with self._lock:
+            entry = self._sessions.pop(sid_token, None)
+        if entry is not None:
+            entry[0].body_cache.clear()
+
+    def __len__(self):
+        return len(self._sessions)
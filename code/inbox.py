@@ -0,0 +1,177 @@
+import sys
+from bisect import bisect_left
+
+# The fields Guerrilla Mail sends for every message in get_email_list/check_email, anything else it sends ends up in extra
+EMAIL_FIELDS = ('mail_id', 'mail_from', 'mail_subject', 'mail_excerpt', 'mail_timestamp', 'mail_read', 'mail_date')
+# The same few senders and dates come up over and over, interning them means one copy each instead of one per email
+INTERNED_FIELDS = ('mail_from', 'mail_date')
+
+# One inbox entry, a slotted object instead of a dict so a big inbox takes a fraction of the memory
+# It still reads like the dicts it replaced (email['mail_subject'], email.get(...)), so nothing that displays the inbox had to change
+class EmailRecord:
+    __slots__ = EMAIL_FIELDS + ('extra',)
+
+    def __init__(self, email):
+        for field in EMAIL_FIELDS:
+            value = email.get(field)
+            if field in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, field, value)
+        extra = {k: v for k, v in email.items() if k not in EMAIL_FIELDS}
+        self.extra = extra or None
+
+    def __getitem__(self, key):
+        if key in EMAIL_FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in EMAIL_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in EMAIL_FIELDS or bool(self.extra and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        email = {field: getattr(self, field) for field in EMAIL_FIELDS}
+        if self.extra:
+            email.update(self.extra)
+        return email
+
+    def __repr__(self):
+        return f"EmailRecord({self.to_dict()!r})"
+
+# The session's inbox, newest first like the Guerrilla Mail web page
+# Internally it's kept the other way round, oldest first, so new mail (the usual case) is an append instead of shifting everything
+# _keys is the sort order as plain ints (timestamp, then arrival order for ties) with the records in a list next to it and
+# _key_of maps mail_id -> key, so mail_id -> position is a bisect and position -> mail_id is a list index, no scanning either way
+# Finding where an email goes is O(log n), but putting it there (or taking it out) anywhere but the end still shifts the rest of
+# the list along, an O(n) memmove. That's a C-level pointer copy, microseconds at tens of thousands of emails, just not log n
+# Equal timestamps come out the way the old list sort had them: a newer batch ahead of an older one, each batch in the order
+# the API sent it
+# Not locked on its own, GuerrillaSession changes it under its _state_lock
+class Inbox:
+    def __init__(self, emails=()):
+        self._keys = []
+        self._records = []
+        self._key_of = {}
+        self._arrivals = 0
+        self.extend(emails)
+
+    def _sort_key(self, email, arrival):
+        try:
+            timestamp = int(email.get('mail_timestamp') or 0)
+        except (TypeError, ValueError):
+            timestamp = 0
+        return (timestamp << 32) + arrival
+
+    # Positions are newest first (0 is the most recent email), the lists underneath are oldest first
+    def _flip(self, position):
+        size = len(self._records)
+        if position < 0:
+            position += size
+        if not 0 <= position < size:
+            raise IndexError("Inbox index out of range.")
+        return size - 1 - position
+
+    # Returns False if the mail_id is already in the inbox
+    def add(self, email):
+        return bool(self.extend([email]))
+
+    # Adds one API response worth of emails, returns the mail_ids that weren't in the inbox yet
+    # _keys runs oldest first, so the first email of a batch gets the batch's highest arrival number to come out first on a tie
+    def extend(self, emails):
+        emails = list(emails)
+        last = self._arrivals + len(emails) - 1
+        self._arrivals += len(emails)
+        added = []
+        for offset, email in enumerate(emails):
+            if self._insert(email, last - offset):
+                added.append(email['mail_id'])
+        return added
+
+    def _insert(self, email, arrival):
+        mail_id = email['mail_id']
+        if mail_id in self._key_of:
+            return False
+        key = self._sort_key(email, arrival)
+        record = email if isinstance(email, EmailRecord) else EmailRecord(email)
+        if not self._keys or key > self._keys[-1]:
+            self._keys.append(key)
+            self._records.append(record)
+        else:
+            index = bisect_left(self._keys, key)
+            self._keys.insert(index, key)
+            self._records.insert(index, record)
+        self._key_of[mail_id] = key
+        return True
+
+    # Removing a handful is a bisect and a shift each, removing a lot is a single pass instead of one shift per email
+    def remove(self, mail_ids):
+        keys = {self._key_of.pop(mail_id) for mail_id in mail_ids if mail_id in self._key_of}
+        removed = set()
+        if len(keys) > 32:
+            kept_keys, kept_records = [], []
+            for key, record in zip(self._keys, self._records):
+                if key in keys:
+                    removed.add(record.mail_id)
+                else:
+                    kept_keys.append(key)
+                    kept_records.append(record)
+            self._keys, self._records = kept_keys, kept_records
+        else:
+            for key in keys:
+                index = bisect_left(self._keys, key)
+                del self._keys[index]
+                removed.add(self._records.pop(index).mail_id)
+        return removed
+
+    def clear(self):
+        self._keys = []
+        self._records = []
+        self._key_of = {}
+
+    def get(self, mail_id):
+        key = self._key_of.get(mail_id)
+        if key is None:
+            return None
+        return self._records[bisect_left(self._keys, key)]
+
+    # 0-based position of a mail_id (newest first), or None if it isn't in the inbox
+    def position(self, mail_id):
+        key = self._key_of.get(mail_id)
+        if key is None:
+            return None
+        return len(self._keys) - 1 - bisect_left(self._keys, key)
+
+    def id_at(self, position):
+        return self._records[self._flip(position)].mail_id
+
+    def ids(self):
+        return [record.mail_id for record in reversed(self._records)]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, mail_id):
+        return mail_id in self._key_of
+
+    def __iter__(self):
+        return reversed(list(self._records))
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self._records[::-1][position]
+        return self._records[self._flip(position)]
@@ -1,61 +1,139 @@
-import pandas as pd
+import threading
 import numpy as np
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
 from nltk.corpus import wordnet
 #from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
+from preprocessing import shared_preprocessor
+from compiled_index import load_or_build
+from scoring import top_k, best_match, best_per_row
+from match_cache import shared_match_cache
 
 # Very similar to the labs
 # Originally each of the modules (apart from QA/Small Talk) had their own intent classification as seen here
 # This would determine the user's general intent, and the speciailzed ones would determine the subintent
 # Instead I decided to just do subintents here and combine all the intents and subintents into one big intent database
 class IntentClassifier:
-    def __init__(self, data_path="datasets/intents_data.csv"):
-        self.lemmatizer = WordNetLemmatizer()
+    def __init__(self, data_path="datasets/intents_data.csv", preprocessor=None, match_cache=None):
+        self.data_path = data_path
+        self.preprocessor = preprocessor or shared_preprocessor
+        self.match_cache = match_cache or shared_match_cache
+        self.index = None
         self.vectorizer = None
         self.intent_phrases_tfidf = None
         self.phrases = []
         self.intents = []
         self.subintents = []
+        self._reload_lock = threading.Lock()
         self._load_and_train(data_path)
 
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
+    def _preprocess(self, text, cache=True):
+        return self.preprocessor.preprocess(text, cache=cache)
+
+    def _compile(self, previous=None):
+        return load_or_build("intents", self.data_path, 'Phrase', ['Intent', 'Subintent'], {'analyzer': 'word'}, self.preprocessor, fillna={'Subintent': 'none'}, previous=previous)
 
     def _load_and_train(self, data_path):
         try:
-            df = pd.read_csv(data_path)
-            df['Subintent'] = df['Subintent'].fillna('none') 
-            self.phrases = [self._preprocess(p) for p in df['Phrase'].tolist()]
-            self.intents = df['Intent'].tolist()
-            self.subintents = df['Subintent'].tolist()
-            self.vectorizer = TfidfVectorizer(analyzer='word')
-            self.intent_phrases_tfidf = self.vectorizer.fit_transform(self.phrases)
+            self._use(self._compile())
         # I've never actually managed to cause this, unless you mess with the actual CSV, but you find a way just by running Maila please tell me
         except Exception as e:
             print(f"[SYSTEM ERROR]: Error with loading or training intent data: {e}")
             self.vectorizer = None
 
+    # Queries only ever read self.index (once, at the start), so assigning it is the whole swap
+    # A query already running keeps the index it started with, the attributes are just there for convenience
+    def _use(self, index):
+        self.phrases = index.texts
+        self.intents = index.labels['Intent']
+        self.subintents = index.labels['Subintent']
+        self.vectorizer = index.vectorizer
+        self.intent_phrases_tfidf = index.matrix
+        self.index = index
+
+    # Picks up whatever changed in the CSV, appended rows are added on their own (see load_or_build)
+    # Returns how the new index came about ('appended', 'refit', 'built' or 'loaded'), or None if there was nothing to do
+    def reload(self):
+        with self._reload_lock:
+            previous = self.index
+            try:
+                index = self._compile(previous)
+            except Exception as e:
+                print(f"[SYSTEM ERROR]: Error reloading intent data, keeping the old one: {e}")
+                return None
+            if index is previous:
+                return None
+            self._use(index)
+            return index.origin
+
     def classify(self, query, threshold):
-        if self.vectorizer is None:
-            return "SystemError", "none", 0.0
+        return self.classify_n_best(query, threshold, n=1)[0]
+
+    # Same scoring pass as classify(), but it also hands back the n best (intent, subintent, score) for working out what was meant
+    # A subintent usually has several phrases close to each other, so a few more rows are pulled than asked for and repeats are skipped
+    def classify_n_best(self, query, threshold, n=3):
+        index = self.index
+        if index is None:
+            return ("SystemError", "none", 0.0), []
         processed_query = self._preprocess(query)
         if not processed_query.strip():
-            return "SystemError", "none", 0.0
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
-            return "Unrecognized", "none", 0.0
-        similarity_scores = cosine_similarity(query_tfidf, self.intent_phrases_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
+            return ("SystemError", "none", 0.0), []
+        return self.decide(index, self._matches(index, processed_query, self.rows_for(n)), threshold, n)
+
+    # How many rows classify_n_best pulls for n distinct guesses
+    @staticmethod
+    def rows_for(n):
+        return n if n == 1 else n * 4
+
+    # The (intent, subintent, score) and n best guesses from the matches for index, however they were scored (see unified_index.py)
+    # None is a query with no term the model knows
+    def decide(self, index, matches, threshold, n=3):
+        if matches is None:
+            return ("Unrecognized", "none", 0.0), []
+        intents, subintents = index.labels['Intent'], index.labels['Subintent']
+        candidates = []
+        for row, score in matches:
+            label = (intents[row], subintents[row])
+            if all(label != candidate[:2] for candidate in candidates):
+                candidates.append((*label, score))
+            if len(candidates) == n:
+                break
+        best_match_index, best_score = best_match(matches)
         if best_score >= threshold:
-            return self.intents[best_match_index], self.subintents[best_match_index], best_score
+            return (intents[best_match_index], subintents[best_match_index], best_score), candidates
         else:
-            return "Unrecognized", "none", best_score
\ No newline at end of file
+            return ("Unrecognized", "none", best_score), candidates
+
+    def _matches(self, index, processed_query, k):
+        def compute():
+            query_tfidf = index.vectorizer.transform([processed_query])
+            if query_tfidf.sum() == 0:
+                return None
+            return top_k(query_tfidf, index.matrix, k=k)
+        return self.match_cache.matches(("intents", index.key), processed_query, compute, k)
+
+    # classify() for a whole list of queries, the valid ones are vectorised and scored together as one sparse matrix product
+    # Gives back exactly what classify() would for each query, in the same order, SystemError/Unrecognized included
+    # Big batches are scored batch_size queries at a time so the score matrix never gets bigger than that many rows
+    # Doesn't go through the match cache, a log being labelled would only push the things people actually keep saying out of it
+    def classify_batch(self, queries, threshold, batch_size=1024):
+        results = [("SystemError", "none", 0.0)] * len(queries)
+        index = self.index
+        if index is None:
+            return results
+        intents, subintents = index.labels['Intent'], index.labels['Subintent']
+        processed = [self._preprocess(query) for query in queries]
+        valid = [i for i, text in enumerate(processed) if text.strip()]
+        for start in range(0, len(valid), batch_size):
+            chunk = valid[start:start + batch_size]
+            queries_tfidf = index.vectorizer.transform([processed[i] for i in chunk])
+            best_rows, best_scores = best_per_row(queries_tfidf @ index.matrix.T)
+            empty = np.asarray(queries_tfidf.sum(axis=1)).ravel() == 0
+            for i, best_match_index, best_score, unknown in zip(chunk, best_rows, best_scores, empty):
+                if unknown:
+                    results[i] = ("Unrecognized", "none", 0.0)
+                elif best_score >= threshold:
+                    results[i] = (intents[best_match_index], subintents[best_match_index], float(best_score))
+                else:
+                    results[i] = ("Unrecognized", "none", float(best_score))
+        return results
@@ -0,0 +1,118 @@
+import threading
+import numpy as np
+from scipy import sparse
+
+# Partial sums can come out a rounding error different from the bounds, the pruning errs on the side of keeping a row
+SLACK = 1e-9
+
+# Term -> postings index over the (already L2-normalised) TF-IDF rows, an alternative to scoring every row with cosine_similarity
+# Postings are the columns of the matrix in CSC form: for term t, docs[indptr[t]:indptr[t+1]] are the rows containing it (sorted)
+# and weights[...] their TF-IDF values. max_weight[t] is the biggest weight t has in any row, which is what the pruning works from
+#
+# search() is MaxScore with a moving threshold: query terms are taken rarest first, and every row in their postings is scored
+# As soon as the terms that are left can't add up to theta between them (their query weight * max_weight), no row that hasn't
+# shown up yet can make it, so the common terms with the long postings are only looked up for the candidates already found
+# theta starts at the threshold (anything under it gets "I don't know" anyway) and rises to the k-th best score seen so far
+def _kth_largest(values, k):
+    if k == 1:
+        return values.max()
+    return np.partition(values, len(values) - k)[len(values) - k]
+
+class InvertedIndex:
+    def __init__(self, indptr, docs, weights, n_rows):
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+        self.n_rows = n_rows
+        lengths = np.diff(indptr)
+        self.max_weight = np.zeros(len(lengths))
+        nonempty = lengths > 0
+        self.max_weight[nonempty] = np.maximum.reduceat(weights, indptr[:-1][nonempty]) if len(weights) else 0.0
+        self._local = threading.local()
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        columns = sparse.csc_matrix(matrix)
+        columns.sort_indices()
+        return cls(columns.indptr, columns.indices, columns.data.astype(np.float64, copy=False), matrix.shape[0])
+
+    # One score array (and one stamp array for de-duplicating) per thread, reset after every query by zeroing only the rows touched
+    def _scratch(self):
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._local.scratch = (np.zeros(self.n_rows), np.zeros(self.n_rows, dtype=np.int64))
+        return scratch
+
+    # Mask keeping the first of every repeated row, np.unique sorts and that was most of the query time on long postings
+    # Which write wins when a fancy assignment repeats an index isn't something NumPy promises, minimum.at is (unbuffered, every one counts)
+    def _first_seen(self, rows, stamps):
+        order = np.arange(len(rows))
+        stamps[rows] = len(rows)
+        np.minimum.at(stamps, rows, order)
+        return stamps[rows] == order
+
+    def _postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.docs[start:end], self.weights[start:end]
+
+    # query_vec is a 1 x n_terms sparse row from the same vectorizer, returns [(row, score), ...] best first
+    # Only rows scoring >= threshold are returned, ties go to the lower row like np.argmax would
+    def search(self, query_vec, k=1, threshold=0.0):
+        query = sparse.csr_matrix(query_vec)
+        terms, query_weights = query.indices, query.data
+        if len(terms) == 0 or k < 1:
+            return []
+        bounds = query_weights * self.max_weight[terms]
+        order = np.lexsort((-bounds, self.indptr[terms + 1] - self.indptr[terms]))
+        terms, query_weights, bounds = terms[order], query_weights[order], bounds[order]
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0) # remaining[i] = most that terms i.. can still add
+        theta = max(threshold, 1e-12)
+
+        # Scoring every row in the postings, only while a row we haven't seen could still reach theta
+        accumulator, stamps = self._scratch()
+        touched = []
+        i = 0
+        while i < len(terms) and remaining[i] >= theta - SLACK:
+            docs, weights = self._postings(terms[i])
+            accumulator[docs] += query_weights[i] * weights
+            touched.append(docs)
+            i += 1
+            # These are k different rows that score at least this much already, so the k-th best can't be lower
+            if len(docs) >= k:
+                theta = max(theta, _kth_largest(accumulator[docs], k))
+        if not touched:
+            return []
+        touched = np.concatenate(touched) if len(touched) > 1 else touched[0]
+        partial = accumulator[touched]
+        accumulator[touched] = 0.0
+        keep = partial + remaining[i] >= theta - SLACK
+        candidates, scores = touched[keep], partial[keep]
+        first = self._first_seen(candidates, stamps)
+        candidates, scores = candidates[first], scores[first]
+
+        # The rest are only looked up for the candidates that could still make it
+        for i in range(i, len(terms) + 1):
+            keep = scores + remaining[i] >= theta - SLACK
+            candidates, scores = candidates[keep], scores[keep]
+            if len(candidates) == 0:
+                return []
+            if len(scores) >= k:
+                theta = max(theta, _kth_largest(scores, k))
+            if i == len(terms):
+                break
+            docs, weights = self._postings(terms[i])
+            if len(docs) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+            hit = docs[positions] == candidates
+            scores = scores + np.where(hit, query_weights[i] * weights[positions], 0.0)
+
+        keep = scores >= threshold
+        candidates, scores = candidates[keep], scores[keep]
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            # argpartition doesn't care about ties, so anything equal to the k-th score is pulled back in before sorting
+            top = np.flatnonzero(scores >= scores[top].min())
+            candidates, scores = candidates[top], scores[top]
+        best = np.lexsort((candidates, -scores))[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in best]
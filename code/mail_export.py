@@ -0,0 +1,114 @@
+import os
+import re
+import gzip
+import time
+import zipfile
+from email.header import Header
+from email.utils import formatdate, formataddr, parseaddr
+
+EXPORT_FORMATS = ('mbox', 'zip')
+# mboxrd quoting, any body line that starts with "From " (after any number of '>') gets one more '>' so it can't pass for a separator
+FROM_LINE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+def _header(name, value):
+    value = ' '.join(str(value).split())
+    if not value.isascii():
+        value = Header(value, 'utf-8').encode()
+    return f"{name}: {value}\n"
+
+# Turns one fetch_email response into a proper RFC 822 message, so the export opens in Thunderbird/Outlook etc. and not just a browser
+# The headers are written by hand and the body as it is, going through EmailMessage/set_content cost more than fetching the email did
+# Returns (sender address, subject, headers as bytes, body as bytes)
+def build_message(email_data, recipient=None):
+    name, sender = parseaddr(' '.join((email_data.get('mail_from') or '').split()))
+    sender = sender or 'unknown@guerrillamail.com'
+    subject = ' '.join((email_data.get('mail_subject') or '(no subject)').split())
+    try:
+        timestamp = int(email_data.get('mail_timestamp'))
+    except (TypeError, ValueError):
+        timestamp = None
+    domain = recipient.split('@')[-1] if recipient and '@' in recipient else 'guerrillamail.com'
+    headers = [
+        f"From: {formataddr((name, sender), charset='utf-8')}\n",
+        _header("To", recipient) if recipient else "",
+        _header("Subject", subject),
+        f"Date: {formatdate(timestamp, localtime=True)}\n",
+        f"Message-ID: <{email_data.get('mail_id')}@{domain}>\n",
+        "MIME-Version: 1.0\n",
+        "Content-Type: text/html; charset=\"utf-8\"\n",
+        "Content-Transfer-Encoding: 8bit\n\n",
+    ]
+    body = (email_data.get('mail_body') or '').replace('\r\n', '\n').encode('utf-8')
+    if not body.endswith(b'\n'):
+        body += b'\n'
+    return sender, subject, ''.join(headers).encode('utf-8'), body
+
+# Each archive takes one message at a time and writes it straight out, nothing but the message being written is held in memory
+# Written to a .part file and renamed at the end, so a failed export never leaves a half archive that looks finished
+
+# Classic mbox, one file with every message after a "From " separator line
+# compress=True gzips it on the way out (.mbox.gz)
+class MboxWriter:
+    def __init__(self, path, compress=False):
+        self.path = path
+        self._part = path + ".part"
+        self._file = gzip.open(self._part, 'wb') if compress else open(self._part, 'wb')
+
+    def add(self, mail_id, message):
+        sender, _, headers, body = message
+        self._file.write(f"From {sender} {time.asctime()}\n".encode('utf-8'))
+        self._file.write(headers)
+        self._file.write(FROM_LINE.sub(rb'>\1', body))
+        self._file.write(b"\n")
+
+    def close(self):
+        self._file.close()
+        os.replace(self._part, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._part)
+
+# A zip with one .eml per message, deflated unless compress=False
+class ZipWriter:
+    def __init__(self, path, compress=True):
+        self.path = path
+        self._part = path + ".part"
+        self._zip = zipfile.ZipFile(self._part, 'w', compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+
+    def add(self, mail_id, message):
+        _, subject, headers, body = message
+        subject = subject.replace(' ', '_')
+        subject = "".join(c for c in subject if c.isalnum() or c in ('_', '-'))[:30]
+        with self._zip.open(f"{mail_id}_{subject}.eml", 'w') as entry:
+            entry.write(headers)
+            entry.write(body)
+
+    def close(self):
+        self._zip.close()
+        os.replace(self._part, self.path)
+
+    def abort(self):
+        self._zip.close()
+        os.remove(self._part)
+
+# Two exports in the same second get -2, -3... rather than one replacing the other
+def archive_path(save_dir, fmt, compress):
+    if fmt == 'zip':
+        extension = ".zip"
+    else:
+        extension = ".mbox.gz" if compress else ".mbox"
+    stem = os.path.join(save_dir, f"inbox-{time.strftime('%Y%m%d-%H%M%S')}")
+    path = stem + extension
+    copy = 1
+    while os.path.exists(path) or os.path.exists(path + ".part"):
+        copy += 1
+        path = f"{stem}-{copy}{extension}"
+    return path
+
+def open_archive(path, fmt, compress):
+    if fmt == 'zip':
+        return ZipWriter(path, compress)
+    if fmt == 'mbox':
+        return MboxWriter(path, compress)
+    raise ValueError(f"Unknown export format '{fmt}', use one of {', '.join(EXPORT_FORMATS)}.")
@@ -1,13 +1,11 @@
+import time
+from collections import deque
 import tkinter as tk
 from tkinter import scrolledtext
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from intent_classifier import IntentClassifier
-from small_talk import SmallTalkHandler
-from question_answer import QAHandler
-from identity import IdentityManagement
-from discoverability import Discoverability
-from transaction import EmailHandler, EMAIL_AWAITING_STATES, EMAIL_LOOP_STATES
+from engine import DialogueEngine, build_handler_registry
 
 BG_COLOR = "#ece5dd"
 CHAT_BG = "#ffffff"
@@ -94,47 +92,96 @@ class EmailViewer(tk.Toplevel):
         self.grab_set()
         self.lift()
 
+# Runs the conversation's turns one at a time off the Tk thread and hands each reply back on it, schedule is root.after
+# The classifier and whichever handler it picks can still be training when a message comes in, and get() waits for them,
+# an email job waits on Guerrilla Mail on top of that. Neither should freeze the window
+# Anything typed while a turn is out waits in queued and goes in order after it, commands too. An email job that's gone out
+# can't be called back (the delete or send still happens on the server), so a 'cancel' typed meanwhile is applied once its
+# result is in, to the state it left, instead of the job's result landing on top of whatever the cancel did
+class TurnRunner:
+    def __init__(self, engine, schedule, show, status, turn_pool, email_pool):
+        self.engine = engine
+        self.schedule = schedule
+        self.show = show
+        self.status = status
+        self.turn_pool = turn_pool
+        self.email_pool = email_pool
+        self.busy = False
+        self.job = None
+        self.queued = deque()
+
+    # False if it had to wait behind the turn that's already out
+    def submit(self, query):
+        if self.busy:
+            self.queued.append(query)
+            return False
+        self._start(query)
+        return True
+
+    def _start(self, query):
+        self.busy = True
+        started = time.perf_counter()
+        handlers = self.engine.handlers
+        if not all(handlers.is_ready(name) for name in ("intent", "small_talk", "qa", "identity")):
+            self.status("Maila is still loading, she'll answer in a moment...")
+        self.schedule(50, self._wait, self.turn_pool.submit(self.engine.begin_turn, query), self._turn_done, started)
+
+    # Tk isn't thread safe, so rather than having the worker call back into it the main loop checks on the future
+    def _wait(self, future, then, started):
+        if not future.done():
+            self.schedule(50, self._wait, future, then, started)
+            return
+        then(future, started)
+
+    def _turn_done(self, future, started):
+        try:
+            result, job = future.result()
+        except Exception as e:
+            print(f"[SYSTEM ERROR]: Turn failed: {e}")
+            result, job = {'text': "Sorry, something went wrong there.", 'action': None}, None
+        if job is None:
+            self._finish(result, started)
+            return
+        self.job = job
+        self.status("Maila is talking to the email service...")
+        self.schedule(50, self._wait, self.email_pool.submit(self.engine.run_email_job, job), self._email_done, started)
+
+    def _email_done(self, future, started):
+        job, self.job = self.job, None
+        try:
+            future.result()
+            result = self.engine.finish_email_job(job)
+        except Exception as e:
+            print(f"[SYSTEM ERROR]: Email task failed: {e}")
+            result = {'text': "Sorry, something went wrong with that email request.", 'action': None}
+        self._finish(result, started)
+
+    def _finish(self, result, started):
+        self.busy = False
+        self.status("")
+        self.show(result, started)
+        if self.queued and not self.busy:
+            self._start(self.queued.popleft())
+
 # Beleive it or not switching from command line to GUI caused a lot of problems
+# All the actual routing lives in engine.py now, this class just draws whatever the engine returns
 class ChatbotGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Maila Chatbot")
         self.root.geometry("420x600")
         self.root.configure(bg=BG_COLOR)
-        self.username = None
-        self.session_id = None
-        self.email_address = None
-        self.chat_stack = ["normal"] # This is what's used for "context tracking", I call it context tracking but state management would be more accurate, Maila is not that advanced
-        self.state_prompts = {}
-        self.IDENTITY_TASK_STATES = {"awaiting_name", "awaiting_name_confirm"}
-        self.DISCOVER_TASK_STATES = {"general_help_loop", "capabilities_help"}
-        self.EMAIL_TASK_STATES = set(EMAIL_LOOP_STATES + EMAIL_AWAITING_STATES)
-        self.EMAIL_LOOP_STATES = set(EMAIL_LOOP_STATES)
-        self.EMAIL_AWAITING_STATES = set(EMAIL_AWAITING_STATES)
-        self.intent_classifier = IntentClassifier()
-        self.small_talk_handler = SmallTalkHandler()
-        self.qa_handler = QAHandler()
-        self.identity_handler = IdentityManagement()
-        self.discoverability_handler = Discoverability()
-        self.email_handler = EmailHandler()
+        # The handlers train in the background now, the window used to stay blank until all of them were done
+        self.handlers = build_handler_registry()
+        self.engine = DialogueEngine(self.handlers)
+        # Guerrilla Mail calls can take up to 10s, they run here so the window doesn't freeze while they do
+        self.email_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="maila-email")
+        self.turn_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maila-turn")
+        self.turns = TurnRunner(self.engine, self.root.after, self.show_result, self.set_status, self.turn_pool, self.email_pool)
+        self.first_turn_reported = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.create_widgets()
         self.add_chat_message("Hello! I am Maila, let's chat!", "bot")
-        self.what_now_prompts = {
-            "normal": "You can chat with me, ask a question, ask for help, or manage your temporary email (e.g., 'start a new session').",
-            "awaiting_name_confirm": "You can say 'yes' to confirm setting your name, or 'no' to cancel.",
-            "awaiting_name": "You can type in the name you'd like me to call you, or say 'cancel'.",
-            "general_help_loop": "You can ask about 'commands', 'identification', or 'capabilities'. You can also say 'no' to exit help.",
-            "capabilities_help": "You can ask for more info on 'small talk', 'Q&A', 'identification', or 'email'. You can also say 'no' to exit.",
-            "email_manage_loop": "You are in your email session. You can say 'list emails', 'view [number]', 'delete [number]', 'download [number]', or 'end session'.",
-            "awaiting_session_start_confirm": "You can say 'yes' to create a new temporary email session, or 'no' to decline.",
-            "awaiting_session_restore_confirm": "You can say 'yes' to try again, 'no' to cancel, or just enter your session ID.",
-            "awaiting_session_restore": "You can type or paste your 24-character session ID, or say 'cancel'.",
-            "awaiting_session_end_confirm": "You can say 'yes' to permanently end your session, or 'no' to keep it active.",
-            "awaiting_view_index": "You can enter the number (index) of the email you want to read, or say 'cancel'.",
-            "awaiting_delete_index": "You can enter the email number(s) to delete (e.g., '1', '1, 3', '2-5', or 'all'), or say 'cancel'.",
-            "awaiting_download_index": "You can enter the email number(s) to download (e.g., '1', '1, 3', '2-5', or 'all'), or say 'cancel'.",
-            "awaiting_delete_all_confirm": "You must say 'yes' to confirm deleting ALL emails, or 'no' to cancel. This cannot be undone."
-        }
 
     def create_widgets(self):
         self.chat_frame = tk.Frame(self.root, bg=CHAT_BG, bd=0)
@@ -157,6 +204,8 @@ class ChatbotGUI:
         self.chat_history.tag_configure("bot_name", justify='left', font=FONT_BOLD, foreground="#000000", spacing1=6, spacing3=2)
         self.chat_history.tag_configure("timestamp_right", justify='right', foreground=TIME_COLOR, font=("Helvetica", 8), spacing1=2, spacing3=6)
         self.chat_history.tag_configure("timestamp_left", justify='left', foreground=TIME_COLOR, font=("Helvetica", 8), spacing1=0, spacing3=6)
+        self.status_label = tk.Label(self.root, text="", font=("Helvetica", 9, "italic"), bg=BG_COLOR, fg=TIME_COLOR, anchor='w')
+        self.status_label.pack(fill=tk.X, padx=12)
         input_frame = tk.Frame(self.root, bg=BG_COLOR, pady=6)
         input_frame.pack(fill=tk.X, padx=10)
         self.user_input = tk.Entry(
@@ -193,11 +242,20 @@ class ChatbotGUI:
         self.add_chat_message(query, "user")
         self.root.after(200, self.get_bot_response, query) # makes it realistic I guess?
 
+    # Only the first turn is interesting here, it's the one that used to pay for all the lazy loading
+    def report_first_turn(self, started):
+        if self.first_turn_reported:
+            return
+        self.first_turn_reported = True
+        latency = (time.perf_counter() - started) * 1000
+        since_launch = (time.perf_counter() - self.handlers.started) * 1000
+        print(f"[STARTUP]: First response took {latency:.0f}ms ({since_launch:.0f}ms after launch). Handler load times: {self.handlers.report()}")
+
     def add_chat_message(self, message, sender):
         self.chat_history.config(state=tk.NORMAL)
         timestamp = datetime.now().strftime("%H:%M")
         if sender == "user":
-            name = self.username.upper() if self.username else "YOU"
+            name = self.engine.username.upper() if self.engine.username else "YOU"
             self.chat_history.insert(tk.END, f"{name}\n", "user_name")
             self.chat_history.insert(tk.END, f"{message}\n", "user_bubble")
             self.chat_history.insert(tk.END, f"{timestamp}\n", "timestamp_right")
@@ -208,171 +266,27 @@ class ChatbotGUI:
         self.chat_history.config(state=tk.DISABLED)
         self.chat_history.see(tk.END)
 
-    # Manages the chat stack as a crude form of context tracking, also builds Maila's prompts for the 'repeat' command
-    def manage_state(self, new_state, prompt_to_save=None):
-            current_state = self.chat_stack[-1]
-            if new_state == "normal":
-                if current_state in self.IDENTITY_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
-                        state_to_pop = self.chat_stack.pop()
-                        if state_to_pop in self.state_prompts:
-                            del self.state_prompts[state_to_pop]
-                elif current_state in self.DISCOVER_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
-                        state_to_pop = self.chat_stack.pop()
-                        if state_to_pop in self.state_prompts:
-                            del self.state_prompts[state_to_pop]
-                elif current_state in self.EMAIL_TASK_STATES:
-                    while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
-                        state_to_pop = self.chat_stack.pop()
-                        if state_to_pop in self.state_prompts:
-                            del self.state_prompts[state_to_pop]   
-                elif len(self.chat_stack) > 1:
-                    state_to_pop = self.chat_stack.pop()
-                    if state_to_pop in self.state_prompts:
-                            del self.state_prompts[state_to_pop]           
-            elif new_state != current_state:
-                self.chat_stack.append(new_state)
-                if prompt_to_save:
-                    self.state_prompts[new_state] = prompt_to_save
-    
-    # This is the main function that determines Maila's response
     def get_bot_response(self, query):
-        current_state = self.chat_stack[-1]
-        response = ""
-        action_data = None
-        prompt_to_save = None
-        handled = False 
-
-        # Maila first checks if the query is a command, for commands only it has to be an exact match
-        if query.lower() == "cancel":
-            if current_state in self.IDENTITY_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.IDENTITY_TASK_STATES:
-                    state_to_pop = self.chat_stack.pop()
-                    if state_to_pop in self.state_prompts:
-                        del self.state_prompts[state_to_pop]
-                response = f"I've cancelled the identity task. We are now in the '{self.chat_stack[-1]}' state."
-            elif current_state in self.DISCOVER_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.DISCOVER_TASK_STATES:
-                    state_to_pop = self.chat_stack.pop()
-                    if state_to_pop in self.state_prompts:
-                        del self.state_prompts[state_to_pop]
-                response = f"I've cancelled the help task. We are now in the '{self.chat_stack[-1]}' state."
-            elif current_state in self.EMAIL_TASK_STATES:
-                while self.chat_stack and self.chat_stack[-1] in self.EMAIL_TASK_STATES:
-                    state_to_pop = self.chat_stack.pop()
-                    if state_to_pop in self.state_prompts:
-                        del self.state_prompts[state_to_pop]
-                response = f"I've cancelled the email task. We are now in the '{self.chat_stack[-1]}' state."
-            elif len(self.chat_stack) > 1:
-                state_to_pop = self.chat_stack.pop()
-                if state_to_pop in self.state_prompts:
-                        del self.state_prompts[state_to_pop]
-                response = f"I've cancelled the ongoing task. We are now in the '{self.chat_stack[-1]}' state. What now?"
-            else:
-                response = "There is no ongoing task to cancel."
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "go back":
-            if len(self.chat_stack) > 1:
-                state_popped = self.chat_stack.pop()
-                if state_popped in self.state_prompts:
-                    del self.state_prompts[state_popped]
-                response = f"Okay, I've gone back one step. We are now in the '{self.chat_stack[-1]}' state."
-            else:
-                response = "There's nothing to go back to."
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "where am i" or query.lower() == "where am i?":
-            response = f"The chatbot is currently in the '{current_state}' state."
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "repeat":
-            current_state = self.chat_stack[-1]
-            if current_state == "normal":
-                response = "There's no active task to repeat. How can I help?"
-            elif current_state in self.state_prompts:
-                response = self.state_prompts[current_state]
+        if not self.turns.submit(query):
+            if self.turns.job is not None:
+                self.add_chat_message("That email request has already gone out, I'll get to this as soon as it's back.", "bot")
             else:
-                response = f"I'm in the '{current_state}' state, but I don't have a specific prompt to repeat. What would you like to do?"
-            self.add_chat_message(response, "bot")
-            return
-        elif query.lower() == "what now" or query.lower() == "what now?":
-            current_state = self.chat_stack[-1]
-            default_fallback = f"I'm in the '{current_state}' state. You can try 'cancel' to exit this task or 'go back' to the previous step."
-            response = self.what_now_prompts.get(current_state, default_fallback)
-            self.add_chat_message(response, "bot")
-            return
+                self.add_chat_message("I'm still working on your last message, I'll get to this right after.", "bot")
 
-        # Next, Maila determines the user's intent
-        intent, subintent, score = self.intent_classifier.classify(query, threshold=0.2)
-        
-        # Maila will either route by intent or by the current state, the order of states determine if they would take priority over certain tasks
-        # Please read the report if you want a detailed breakdown, or just analyze my code
-        if current_state in self.IDENTITY_TASK_STATES:
-            handled = True
-            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent="none", current_state=current_state)
-            self.username = new_name
-            prompt_to_save = response_text if new_state != "normal" else None
-            self.manage_state(new_state, prompt_to_save)
-            response = response_text
-        elif intent == "IdentityManagement":
-            handled = True
-            response_text, new_name, new_state = self.identity_handler.get_identity_response(query, self.username, subintent=subintent, current_state=current_state)
-            self.username = new_name
-            prompt_to_save = response_text if new_state != "normal" else None
-            if new_state != "normal" or current_state in self.IDENTITY_TASK_STATES:
-                self.manage_state(new_state, prompt_to_save)     
-            response = response_text
-        elif current_state in self.DISCOVER_TASK_STATES:
-            handled = True
-            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent="none", current_state=current_state)
-            prompt_to_save = response_text if new_state != "normal" else None
-            self.manage_state(new_state, prompt_to_save)
-            response = response_text
+    def show_result(self, result, started):
+        self.add_chat_message(result['text'], "bot")
+        action_data = result['action']
+        if action_data and action_data['action'] == 'view_email':
+            EmailViewer(self.root, action_data['data'])
+        self.report_first_turn(started)
 
-        # Email states can uniquely pass down intents if it doesn't find a match within transaction.py
-        # For instance, "How are you" while in (general) email loop will not be matched and be passed through here and on to Small Talk
-        elif intent == "Email" or current_state in self.EMAIL_TASK_STATES:
-            pass_signal = "I'm not sure how to handle that email request."
-            new_state, response_text, session_data, action_data = self.email_handler.handle_email_task(current_state, subintent, query, self.session_id)
-            if response_text != pass_signal:
-                handled = True
-                if session_data is not None:
-                    self.session_id, self.email_address = session_data
-                managed_new_state = new_state if new_state else "normal"
-                prompt_to_save = response_text if managed_new_state != "normal" else None
-                self.manage_state(managed_new_state, prompt_to_save)
-                response = response_text
-                if action_data:
-                    if action_data['action'] == 'view_email':
-                        EmailViewer(self.root, action_data['data'])
-            pass 
-        # The order of the intents here don't matter, as the query is only labeled with one intent
-        if not handled and intent == "SmallTalk":
-            handled = True
-            raw_response = self.small_talk_handler.get_small_talk_response(query, threshold=0.4)
-            if "{username}" in raw_response:
-                name_to_insert = self.username if self.username else "friend"
-                response = raw_response.replace("{username}", name_to_insert)
-            else:
-                response = raw_response
-        elif not handled and intent == "QuestionAnswering":
-            handled = True
-            response = self.qa_handler.get_QA_response(query, threshold=0.65)
-        elif not handled and intent == "Discoverability":
-            handled = True
-            response_text, new_state = self.discoverability_handler.get_discoverability_response(query, subintent=subintent, current_state=current_state)
-            prompt_to_save = response_text if new_state != "normal" else None
-            self.manage_state(new_state, prompt_to_save)
-            response = response_text
-        if not handled:
-            if intent == "Unrecognized":
-                response = "Forgive me, but I'm unable to recognize what you are saying."
-            else:
-                # This only really happens if the intent classifier's dataset fails to load, usually it's a permission error
-                response = "[SYSTEM ERROR]: An internal classification error occurred."
-        self.add_chat_message(response, "bot")
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def on_close(self):
+        self.email_pool.shutdown(wait=False, cancel_futures=True)
+        self.turn_pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
 
 if __name__ == '__main__':
     root = tk.Tk()
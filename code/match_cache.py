@@ -0,0 +1,31 @@
+from preprocessing import LRUCache
+
+_MISSING = object()
+
+# People say the same handful of things over and over ("list emails", "hello", "what can you do"), and every time the classifier,
+# QA and small talk would vectorise and score it again. This keeps what the scoring found (the (row, score) matches) for a while
+# Only the matches are kept, not the replies, so thresholds still apply per call and small talk still picks a random template every time
+#
+# Keyed on (fingerprint, preprocessed text, ...), the fingerprint being the compiled index key (a hash of the CSV plus the vectorizer
+# and preprocessing settings). Change the data or the model and the key changes with it, so stale matches can never be served
+# The TTL is only there so a long-running server lets go of things nobody has said in a while
+class MatchCache:
+    def __init__(self, maxsize=4096, ttl=3600):
+        self._cache = LRUCache(maxsize, ttl)
+
+    # compute() only runs on a miss, it returns the matches or None when the query has no terms the model knows
+    def matches(self, fingerprint, processed_text, compute, *params):
+        key = (fingerprint, processed_text) + params
+        result = self._cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = compute()
+            self._cache.put(key, result)
+        return result
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+shared_match_cache = MatchCache()
@@ -0,0 +1,202 @@
+import os
+import re
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter, defaultdict
+import pandas as pd
+import nltk
+from nltk.stem import WordNetLemmatizer
+
+pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
+PREPROCESSING_MODES = ('full', 'fast')
+LEMMA_TABLE_PATH = "datasets/lemma_table.tsv"
+# Every word in these (they sit next to the table) is in the lemma table, which covers nearly everything people actually say to Maila
+LEMMA_TABLE_SOURCES = [("intents_data.csv", 'Phrase'), ("question_answer.csv", 'Question'), ("small_talk.csv", 'Question')]
+
+# word_tokenize splits "don't" into "do" + "n't" (and "can't" into "ca" + "n't"), the fast tokenizer has to give the lemma table the same words
+CONTRACTION = re.compile(r"\b(ca|wo|\w+?)(n't)\b|(\w)('(?:s|re|ve|ll|d|m))\b")
+# The clitics split off above come out whole, and so do hyphenated/dotted/underscored words, word_tokenize keeps those together too
+# None of them are alnum so they get dropped the same way the full pipeline drops them
+WORD = re.compile(r"n't|'\w+|\w+(?:[-.']\w+)*")
+
+# Tiny thread-safe LRU, the handlers get called from more than one thread so a plain dict won't do
+# ttl (seconds) is optional, an entry older than that counts as a miss and gets dropped when it's next asked for
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, expires = self._data[key]
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl if self.ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def __len__(self):
+        return len(self._data)
+
+# The intent classifier, QA and small talk all used to have their own copy of _preprocess, which meant every query got tagged twice per turn
+# Now they all share this one, a query is only tokenized/tagged/lemmatized once and then served from the cache for the rest of the turn
+class TextPreprocessor:
+    def __init__(self, max_queries=2048, max_lemmas=20000):
+        self.lemmatizer = WordNetLemmatizer()
+        self.query_cache = LRUCache(max_queries)
+        self.lemma_cache = LRUCache(max_lemmas)
+
+    def _lemmatize(self, word, tag):
+        key = (word, tag)
+        lemma = self.lemma_cache.get(key)
+        if lemma is None:
+            lemma = self.lemmatizer.lemmatize(word, pos=pos_map.get(tag, 'n'))
+            self.lemma_cache.put(key, lemma)
+        return lemma
+
+    def _process(self, text):
+        tokens = nltk.word_tokenize(text)
+        tagged = nltk.pos_tag(tokens, tagset='universal')
+        return tuple(self._lemmatize(w, t) for w, t in tagged if w.isalnum())
+
+    # Training rows pass cache=False so the dataset doesn't push the actual user queries out of the cache
+    def tokens(self, text, cache=True):
+        text = text.lower()
+        if not cache:
+            return self._process(text)
+        processed = self.query_cache.get(text)
+        if processed is None:
+            processed = self._process(text)
+            self.query_cache.put(text, processed)
+        return processed
+
+    def preprocess(self, text, cache=True):
+        return ' '.join(self.tokens(text, cache=cache))
+
+    # Anything that changes the output of preprocess() has to show up here, compiled indexes are keyed on it
+    def settings(self):
+        return {'pipeline': 'word_tokenize+pos_tag(universal)+wordnet', 'version': 1}
+
+    def stats(self):
+        return {'queries': self.query_cache.stats(), 'lemmas': self.lemma_cache.stats()}
+
+# The lemma table: every word in the datasets and the lemma the full pipeline gives it (the most common one, if the tag changes it)
+# Built once, offline, with the full pipeline (python preprocessing.py --build-lemma-table), so the fast mode never has to run pos_tag
+# Needs the punkt and tagger data, a missing one is a LookupError from NLTK
+def build_lemma_table(data_dir="datasets", sources=LEMMA_TABLE_SOURCES, preprocessor=None):
+    preprocessor = preprocessor or TextPreprocessor()
+    seen = defaultdict(Counter)
+    for filename, column in sources:
+        for text in pd.read_csv(os.path.join(data_dir, filename))[column].dropna().astype(str):
+            tagged = nltk.pos_tag(nltk.word_tokenize(text.lower()), tagset='universal')
+            for word, tag in tagged:
+                if word.isalnum():
+                    seen[word][preprocessor._lemmatize(word, tag)] += 1
+    return {word: lemmas.most_common(1)[0][0] for word, lemmas in seen.items()}
+
+def save_lemma_table(table, path=LEMMA_TABLE_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        for word in sorted(table):
+            f.write(f"{word}\t{table[word]}\n")
+
+def load_lemma_table(path=LEMMA_TABLE_PATH):
+    table = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            word, _, lemma = line.rstrip('\n').partition('\t')
+            if word:
+                table[word] = lemma or word
+    return table
+
+# Same output shape as TextPreprocessor, but a regex tokenizer and a table lookup instead of word_tokenize + pos_tag + WordNet
+# The tagger is most of what a query costs (and most of training), this skips it completely
+# A word that isn't in the table goes to WordNet untagged, noun first and then verb, which is right far more often than not
+# Accuracy against the full pipeline is in evaluation/evaluate_intents.py, so it can be picked per deployment
+# The table has to be built beforehand, building it here would run the very tagger this mode is meant to skip (inside the warm-up,
+# on every start of a fresh deployment) so a missing one is a FileNotFoundError that says how to make it
+class FastTextPreprocessor(TextPreprocessor):
+    def __init__(self, lemma_table_path=LEMMA_TABLE_PATH, max_queries=2048, max_lemmas=20000):
+        super().__init__(max_queries, max_lemmas)
+        self.lemma_table_path = lemma_table_path
+        try:
+            self.lemma_table = load_lemma_table(lemma_table_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"No lemma table at {os.path.abspath(lemma_table_path)}, the fast preprocessing mode needs one. "
+                                    f"Build it once with 'python preprocessing.py --build-lemma-table' (from inside code/, needs the NLTK tagger).") from None
+        self.table_digest = hashlib.sha1(''.join(f"{w}\t{l}\n" for w, l in sorted(self.lemma_table.items())).encode('utf-8')).hexdigest()[:16]
+
+    def _fallback(self, word):
+        lemma = self.lemma_cache.get(word)
+        if lemma is None:
+            try:
+                lemma = self.lemmatizer.lemmatize(word, pos='n')
+                if lemma == word:
+                    lemma = self.lemmatizer.lemmatize(word, pos='v')
+            except LookupError:
+                lemma = word # no WordNet data, the word as it is still beats failing the query
+            self.lemma_cache.put(word, lemma)
+        return lemma
+
+    def _process(self, text):
+        text = CONTRACTION.sub(lambda m: f"{m.group(1)} {m.group(2)}" if m.group(2) else f"{m.group(3)} {m.group(4)}", text)
+        lemmas = []
+        for word in WORD.findall(text):
+            if word.isalnum():
+                lemma = self.lemma_table.get(word)
+                lemmas.append(lemma if lemma is not None else self._fallback(word))
+        return tuple(lemmas)
+
+    def settings(self):
+        return {'pipeline': 'regex+lemma_table+wordnet_fallback', 'version': 1, 'table': self.table_digest}
+
+shared_preprocessor = TextPreprocessor()
+_fast_preprocessor = None
+_fast_lock = threading.Lock()
+
+# 'full' is the shared word_tokenize + pos_tag pipeline, 'fast' the lemma table one (also shared, made the first time it's asked for)
+def get_preprocessor(mode='full'):
+    global _fast_preprocessor
+    if mode == 'full':
+        return shared_preprocessor
+    if mode != 'fast':
+        raise ValueError(f"Unknown preprocessing mode '{mode}', use one of {', '.join(PREPROCESSING_MODES)}.")
+    with _fast_lock:
+        if _fast_preprocessor is None:
+            _fast_preprocessor = FastTextPreprocessor()
+        return _fast_preprocessor
+
+if __name__ == '__main__':
+    if '--build-lemma-table' not in sys.argv[1:]:
+        print("Usage: python preprocessing.py --build-lemma-table   (run from inside code/, needs the NLTK tagger and WordNet)")
+        sys.exit(1)
+    try:
+        table = build_lemma_table()
+    except LookupError as e:
+        print(f"[SYSTEM ERROR]: The lemma table is built with the full pipeline, and its NLTK data is missing: {e}")
+        sys.exit(1)
+    save_lemma_table(table)
+    print(f"Wrote {len(table)} lemmas to {os.path.abspath(LEMMA_TABLE_PATH)}")
@@ -1,53 +1,134 @@
-import pandas as pd
-import numpy as np
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
+import threading
 from nltk.corpus import wordnet
 #from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
+from preprocessing import shared_preprocessor
+from compiled_index import load_or_build
+from streaming_index import load_or_stream
+from inverted_index import InvertedIndex
+from sharded_index import ShardPool
+from scoring import top_k, best_match
+from match_cache import shared_match_cache
 
+QA_ENGINES = ('dense', 'inverted', 'sharded')
+# The answers live in a memory-mapped StringTable (see string_table.py), only the one that matched is decoded
+ANSWER_TABLE = {'Answer': None}
+
+# engine='dense' scores the query against every question (fine for the 534 we ship with)
+# engine='inverted' goes through an InvertedIndex instead, same answers but it only looks at questions sharing a term with the query,
+# which is what keeps it fast once there are hundreds of thousands of questions
+# engine='sharded' splits the questions across `shards` worker processes (one per core by default, see sharded_index.py),
+# same answers as dense but every core scores its share of a multi-million question corpus at once
+# streaming=True builds the index a chunk of the CSV at a time (see streaming_index.py), for dumps too big to train on in memory
 class QAHandler:
-    def __init__(self, data_path="datasets/question_answer.csv"):
-        self.lemmatizer = WordNetLemmatizer()
+    def __init__(self, data_path="datasets/question_answer.csv", preprocessor=None, engine='dense', match_cache=None, streaming=False, shards=None):
+        if engine not in QA_ENGINES:
+            raise ValueError(f"Unknown QA engine '{engine}', use one of {', '.join(QA_ENGINES)}.")
+        self.data_path = data_path
+        self.preprocessor = preprocessor or shared_preprocessor
+        self.match_cache = match_cache or shared_match_cache
+        self.engine = engine
+        self.streaming = streaming
+        self.shards = shards
+        self.index = None
         self.vectorizer = None
         self.questions_tfidf = None
-        self.questions = []
+        self.inverted_index = None
+        self.shard_pool = None
         self.answers = []
+        self._live = (None, None)
+        self._reload_lock = threading.Lock()
         self._load_and_train(data_path)
         
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
+    def _preprocess(self, text, cache=True):
+        return self.preprocessor.preprocess(text, cache=cache)
+
+    def _compile(self, previous=None):
+        if self.streaming:
+            return load_or_stream("question_answer", self.data_path, 'Question', ['Answer'], {'stop_words': 'english', 'analyzer': 'word'}, self.preprocessor, previous=previous, string_columns=ANSWER_TABLE)
+        return load_or_build("question_answer", self.data_path, 'Question', ['Answer'], {'stop_words': 'english', 'analyzer': 'word'}, self.preprocessor, previous=previous, string_columns=ANSWER_TABLE)
 
     def _load_and_train(self, data_path):
         try:
-            df = pd.read_csv(data_path)
-            self.questions = [self._preprocess(q) for q in df['Question'].tolist()]
-            self.answers = df['Answer'].tolist()
-            self.vectorizer = TfidfVectorizer(stop_words='english',analyzer='word')
-            self.questions_tfidf = self.vectorizer.fit_transform(self.questions)
+            self._use(self._compile())
         except Exception as e:
             print(f"[SYSTEM ERROR]: Error loading QA dataset: {e}")
             self.vectorizer = None
 
+    # The index and whatever the engine searches it with (inverted index or shard pool) have to change together,
+    # so queries read them as one (index, searcher) pair
+    # A query already running keeps the pair it started with, the attributes are just there for convenience
+    def _use(self, index):
+        inverted_index = InvertedIndex.from_matrix(index.matrix) if self.engine == 'inverted' else None
+        shard_pool = ShardPool(index.matrix, self.shards, index.path) if self.engine == 'sharded' else None
+        old_pool = self.shard_pool
+        self.answers = index.labels['Answer']
+        self.vectorizer = index.vectorizer
+        self.questions_tfidf = index.matrix
+        self.inverted_index = inverted_index
+        self.shard_pool = shard_pool
+        self.index = index
+        self._live = (index, inverted_index or shard_pool)
+        # The old workers go once the query on them (if any) is done, anything still headed their way is scored in process
+        if old_pool is not None:
+            old_pool.close()
+
+    # Only the sharded engine has anything to shut down, the worker processes
+    def close(self):
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+
+    # Only read off the index when something asks, a big streamed index doesn't need them in memory to answer questions
+    @property
+    def questions(self):
+        return self.index.texts if self.index is not None else []
+
+    # Picks up whatever changed in the CSV, appended rows are added on their own (see load_or_build)
+    # Returns how the new index came about ('appended', 'refit', 'built' or 'loaded'), or None if there was nothing to do
+    def reload(self):
+        with self._reload_lock:
+            previous = self.index
+            try:
+                index = self._compile(previous)
+                if index is previous:
+                    return None
+                self._use(index)
+            except Exception as e:
+                print(f"[SYSTEM ERROR]: Error reloading QA dataset, keeping the old one: {e}")
+                return None
+            return index.origin
+
     def get_QA_response(self, query, threshold):
-        if self.questions_tfidf is None or self.vectorizer is None:
+        live = self._live
+        if live[0] is None:
             return "[SYSTEM ERROR]: Error with QA processing"
         processed_query = self._preprocess(query)
         if not processed_query.strip():
             return "[SYSTEM ERROR]: Error with QA processing"
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
+        return self.respond(live[0], self._matches(live, processed_query, 1, threshold), threshold)
+
+    # The reply for the matches found in index, however they were scored (see unified_index.py), None is no known term in the query
+    def respond(self, index, matches, threshold):
+        if matches is None:
             return "I'm afraid I don't have the answer to that."
-        similarity_scores = cosine_similarity(query_tfidf, self.questions_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
+        best_match_index, best_score = best_match(matches)
         if best_score >= threshold:
-            return f"{self.answers[best_match_index]}"
+            return f"{index.labels['Answer'][best_match_index]}"
         else:
             return "I'm afraid I don't have the answer to that."
+
+    # The inverted index can use the threshold to prune, dense and sharded just leave anything under it for the caller to drop
+    # The threshold is part of the cache key for that reason, what the inverted index finds depends on it
+    def _matches(self, live, processed_query, k, threshold):
+        index, searcher = live
+        def compute():
+            query_tfidf = index.vectorizer.transform([processed_query])
+            if query_tfidf.sum() == 0:
+                return None
+            if self.engine == 'inverted':
+                return searcher.search(query_tfidf, k=k, threshold=threshold)
+            if self.engine == 'sharded':
+                return searcher.search(query_tfidf, k=k)
+            return top_k(query_tfidf, index.matrix, k=k)
+        return self.match_cache.matches(("question_answer", self.engine, index.key), processed_query, compute, k, threshold)
@@ -0,0 +1,46 @@
+import numpy as np
+from scipy import sparse
+
+# The compiled rows and the transformed query both come out of TfidfVectorizer already L2-normalised, so cosine is just the dot product
+# cosine_similarity normalised both sides again and handed back a dense score for every row, only for us to keep the argmax
+# query @ matrix.T stays sparse (only rows sharing a term with the query get a score) and argpartition finds the k best without a sort
+# Returns [(row, score), ...] best first, ties go to the lower row like np.argmax, rows scoring 0 are never returned
+def top_k(query_vec, matrix, k=1):
+    scores = sparse.csr_matrix(query_vec @ matrix.T)
+    return top_k_scores(scores.indices, scores.data, k)
+
+# The selection half of top_k, for scores that were worked out some other way (rows and their scores, zeros left out)
+def top_k_scores(rows, values, k=1):
+    if len(values) == 0 or k < 1:
+        return []
+    if len(values) > k:
+        pick = np.argpartition(-values, k - 1)[:k]
+        # argpartition doesn't care about ties, anything equal to the k-th best is pulled back in so the lower row can win
+        pick = np.flatnonzero(values >= values[pick].min())
+        rows, values = rows[pick], values[pick]
+    best = np.lexsort((rows, -values))[:k]
+    return [(int(rows[i]), float(values[i])) for i in best]
+
+# Best score first and ties to the lower row, so the first entry is what np.argmax over the full scores would have picked
+# An empty result means nothing shared a term with the query, which argmax would have reported as row 0 scoring 0.0
+def best_match(matches):
+    if matches:
+        return matches[0]
+    return 0, 0.0
+
+# The batch version of best_match over a whole queries x rows score matrix in one go, no Python loop over the queries
+# Returns (best row, best score) arrays, one entry per query, a query that shared no term with any row gets row 0 scoring 0.0
+def best_per_row(scores):
+    scores = sparse.csr_matrix(scores)
+    n_queries = scores.shape[0]
+    best_rows = np.zeros(n_queries, dtype=np.int64)
+    best_scores = np.zeros(n_queries)
+    if scores.nnz == 0:
+        return best_rows, best_scores
+    queries = np.repeat(np.arange(n_queries), np.diff(scores.indptr))
+    order = np.lexsort((scores.indices, -scores.data, queries))
+    # After the sort each query's best row (lowest on ties) is the first of its run
+    first = order[np.flatnonzero(np.r_[True, queries[order][1:] != queries[order][:-1]])]
+    best_rows[queries[first]] = scores.indices[first]
+    best_scores[queries[first]] = scores.data[first]
+    return best_rows, best_scores
@@ -0,0 +1,344 @@
+import json
+import time
+import uuid
+import base64
+import struct
+import asyncio
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from engine import DialogueEngine, build_handler_registry
+from preprocessing import PREPROCESSING_MODES
+from match_cache import shared_match_cache
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY_BYTES = 64 * 1024
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 410: "Gone", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+class ConversationBusy(Exception):
+    pass
+
+class ServerFull(Exception):
+    pass
+
+# A conversation that was deleted or evicted, anything still waiting on it gets this instead of hanging
+class ConversationClosed(Exception):
+    pass
+
+# One of these per user, it owns its own DialogueEngine (name, session, chat stack) and a bounded queue of pending messages
+# Messages for one conversation are handled strictly one after another, so the engine state never gets touched by two threads at once
+class Conversation:
+    def __init__(self, conversation_id, handlers, max_pending):
+        self.id = conversation_id
+        self.engine = DialogueEngine(handlers)
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.last_active = time.monotonic()
+        self.worker = None
+        self.current = None # the future of the message being worked on right now
+        self.sockets = 0 # open websockets on this conversation, it's never idle while there are any
+        self.closed = False
+
+    def is_idle(self, idle_timeout):
+        return self.sockets == 0 and self.current is None and self.queue.empty() and time.monotonic() - self.last_active > idle_timeout
+
+# Hosts many conversations on one event loop, all of them share the same trained handlers (one copy of each model, not one per user)
+# The NLP and email work is blocking so it runs on a thread pool, the event loop itself only does the networking
+class MailaServer:
+    def __init__(self, handlers=None, max_pending=8, max_conversations=1000, idle_timeout=1800, workers=8):
+        self.handlers = handlers if handlers is not None else build_handler_registry()
+        self.max_pending = max_pending
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="maila-turn")
+        self.conversations = {}
+
+    def get_conversation(self, conversation_id=None, create=True):
+        if conversation_id in self.conversations:
+            return self.conversations[conversation_id]
+        if not create:
+            return None
+        if len(self.conversations) >= self.max_conversations:
+            self.evict_idle()
+            if len(self.conversations) >= self.max_conversations:
+                raise ServerFull("Too many active conversations.")
+        conversation = Conversation(conversation_id or uuid.uuid4().hex, self.handlers, self.max_pending)
+        conversation.worker = asyncio.get_running_loop().create_task(self._conversation_worker(conversation))
+        self.conversations[conversation.id] = conversation
+        return conversation
+
+    # Everything still waiting on the conversation (queued, in flight, or blocked putting into a full queue) gets ConversationClosed
+    def close_conversation(self, conversation_id):
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation:
+            conversation.closed = True
+            if conversation.worker:
+                conversation.worker.cancel()
+            while not conversation.queue.empty():
+                _, future = conversation.queue.get_nowait()
+                if not future.done():
+                    future.set_exception(ConversationClosed(f"Conversation {conversation.id} was closed."))
+        return conversation is not None
+
+    def evict_idle(self):
+        for conversation_id in [c.id for c in self.conversations.values() if c.is_idle(self.idle_timeout)]:
+            self.close_conversation(conversation_id)
+
+    async def _conversation_worker(self, conversation):
+        loop = asyncio.get_running_loop()
+        while True:
+            query, future = await conversation.queue.get()
+            conversation.current = future
+            try:
+                result = await loop.run_in_executor(self.executor, conversation.engine.respond, query)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                # The message was already taken off the queue, so close_conversation can't see it, it has to be answered here
+                if not future.done():
+                    future.set_exception(ConversationClosed(f"Conversation {conversation.id} was closed."))
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                conversation.current = None
+                conversation.last_active = time.monotonic()
+                conversation.queue.task_done()
+
+    # wait=False is for HTTP, a full queue is rejected straight away (429)
+    # wait=True is for websockets, the reader just stops reading until there's room, which pushes back on the client through TCP
+    # A closed conversation raises ConversationClosed, its worker is gone and nothing would ever answer
+    async def submit(self, conversation, query, wait=False):
+        if conversation.closed:
+            raise ConversationClosed(f"Conversation {conversation.id} was closed.")
+        future = asyncio.get_running_loop().create_future()
+        if wait:
+            await conversation.queue.put((query, future))
+            # close_conversation emptying the queue is what let the put through, nobody is going to take this one off it
+            if conversation.closed and not future.done():
+                future.set_exception(ConversationClosed(f"Conversation {conversation.id} was closed."))
+        else:
+            try:
+                conversation.queue.put_nowait((query, future))
+            except asyncio.QueueFull:
+                raise ConversationBusy(f"Conversation {conversation.id} already has {self.max_pending} messages waiting.")
+        conversation.last_active = time.monotonic()
+        return await future
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            self.evict_idle()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if headers.get('upgrade', '').lower() == 'websocket':
+                    await self._handle_websocket(reader, writer, path, headers)
+                    break
+                status, payload = await self._route(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            self._write_response(writer, 400, {'error': str(e)}, False)
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ValueError("Malformed request line.")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large.")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    def _write_response(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+
+    # POST /conversations                   -> start a conversation
+    # POST /conversations/<id>/messages     -> {"message": "..."} in, Maila's response out
+    # DELETE /conversations/<id>            -> forget a conversation
+    # GET /health                           -> number of conversations, which handlers are loaded and the match cache hit rate
+    async def _route(self, method, target, body):
+        parts = [p for p in urlsplit(target).path.split('/') if p]
+        try:
+            if parts == ['health'] and method == 'GET':
+                # Every registered handler, whatever build_handler_registry ended up registering ("unified" only with dense QA)
+                ready = {name: self.handlers.is_ready(name) for name in self.handlers}
+                return 200, {'conversations': len(self.conversations), 'ready': ready, 'match_cache': shared_match_cache.stats()}
+            if parts == ['conversations'] and method == 'POST':
+                conversation = self.get_conversation()
+                return 201, {'conversation_id': conversation.id}
+            if len(parts) == 2 and parts[0] == 'conversations' and method == 'DELETE':
+                if self.close_conversation(parts[1]):
+                    return 200, {'closed': parts[1]}
+                return 404, {'error': "Unknown conversation."}
+            if len(parts) == 3 and parts[0] == 'conversations' and parts[2] == 'messages':
+                if method != 'POST':
+                    return 405, {'error': "Use POST to send a message."}
+                try:
+                    message = json.loads(body or b'{}').get('message', '').strip()
+                except (json.JSONDecodeError, AttributeError):
+                    return 400, {'error': "Body must be a JSON object with a 'message' field."}
+                if not message:
+                    return 400, {'error': "Message is empty."}
+                conversation = self.get_conversation(parts[1])
+                result = await self.submit(conversation, message)
+                return 200, dict(result, conversation_id=conversation.id)
+            return 404, {'error': "Not found."}
+        except ConversationBusy as e:
+            return 429, {'error': str(e)}
+        except ConversationClosed as e:
+            return 410, {'error': str(e)}
+        except ServerFull as e:
+            return 503, {'error': str(e)}
+        except Exception as e:
+            print(f"[SERVER ERROR]: {e}")
+            return 500, {'error': "Maila ran into an internal error."}
+
+    # GET /ws?conversation=<id>, every text frame is one message and every reply is one JSON text frame
+    async def _handle_websocket(self, reader, writer, target, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            self._write_response(writer, 400, {'error': "Missing Sec-WebSocket-Key."}, False)
+            return
+        conversation_id = parse_qs(urlsplit(target).query).get('conversation', [None])[0]
+        try:
+            conversation = self.get_conversation(conversation_id)
+        except ServerFull as e:
+            self._write_response(writer, 503, {'error': str(e)}, False)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('latin-1')).digest()).decode('latin-1')
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode('latin-1'))
+        self._write_ws_frame(writer, json.dumps({'conversation_id': conversation.id}))
+        await writer.drain()
+        conversation.sockets += 1
+        try:
+            while True:
+                opcode, payload = await self._read_ws_message(reader)
+                if opcode == 0x8:
+                    self._write_ws_frame(writer, payload, opcode=0x8)
+                    await writer.drain()
+                    return
+                if opcode == 0x9:
+                    self._write_ws_frame(writer, payload, opcode=0xA)
+                elif opcode == 0x1:
+                    message = payload.decode('utf-8', errors='replace').strip()
+                    if message:
+                        try:
+                            result = await self.submit(conversation, message, wait=True)
+                        except ConversationClosed as e:
+                            # Deleted over HTTP while the socket was open, 1008 (policy violation) is the nearest close code
+                            self._write_ws_frame(writer, json.dumps({'error': str(e)}))
+                            self._write_ws_frame(writer, struct.pack('!H', 1008), opcode=0x8)
+                            await writer.drain()
+                            return
+                        self._write_ws_frame(writer, json.dumps(dict(result, conversation_id=conversation.id), default=str))
+                await writer.drain()
+        finally:
+            conversation.sockets -= 1
+
+    async def _read_ws_message(self, reader):
+        message = b''
+        message_opcode = None
+        while True:
+            first, second = await reader.readexactly(2)
+            fin = first & 0x80
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            if length > MAX_BODY_BYTES:
+                raise ConnectionError("WebSocket frame too large.")
+            mask = await reader.readexactly(4) if second & 0x80 else b'\x00\x00\x00\x00'
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+            # Control frames can turn up in the middle of a fragmented message, they're answered on their own
+            if opcode >= 0x8:
+                return opcode, payload
+            if opcode != 0x0:
+                message_opcode = opcode
+            message += payload
+            if len(message) > MAX_BODY_BYTES:
+                raise ConnectionError("WebSocket message too large.")
+            if fin:
+                return message_opcode, message
+
+    def _write_ws_frame(self, writer, payload, opcode=0x1):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        writer.write(header + payload)
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        evictor = asyncio.get_running_loop().create_task(self._evict_loop())
+        print(f"[SERVER]: Maila is listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self.executor.shutdown(wait=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve many Maila conversations over HTTP and WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="threads used for the blocking NLP/email work")
+    parser.add_argument("--max-pending", type=int, default=8, help="messages a single conversation may have queued before it gets a 429")
+    parser.add_argument("--max-conversations", type=int, default=1000)
+    parser.add_argument("--idle-timeout", type=int, default=1800, help="seconds before an idle conversation is dropped")
+    parser.add_argument("--preprocessing", choices=PREPROCESSING_MODES, default='full', help="'fast' skips the POS tagger and uses the precomputed lemma table")
+    parser.add_argument("--watch-datasets", action="store_true", help="reload the CSVs in datasets/ when they change, without a restart")
+    parser.add_argument("--qa-shards", type=int, default=None, help="answer Q&A from this many worker processes")
+    args = parser.parse_args()
+    try:
+        handlers = build_handler_registry(args.preprocessing, args.watch_datasets, args.qa_shards)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    server = MailaServer(handlers=handlers, max_pending=args.max_pending, max_conversations=args.max_conversations, idle_timeout=args.idle_timeout, workers=args.workers)
+    asyncio.run(server.serve(args.host, args.port))
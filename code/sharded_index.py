@@ -0,0 +1,121 @@
+import os
+import threading
+import multiprocessing
+import numpy as np
+from scipy import sparse
+
+from scoring import top_k
+
+# The TF-IDF rows split into contiguous shards, each one owned by its own worker process so they're all scored at once, not one core
+# under the GIL. A query goes to every shard, each sends back its local top k, and the k best of those are the overall top k
+# Every shard hands back its k best (ties to the lower row) and shard rows are offset back to the full matrix, so the merge picks
+# exactly what top_k over the whole matrix would have, and get_QA_response answers the same
+#
+# A compiled index that's on disk (index.path) is memory-mapped by the workers, so the shards share the page cache instead of
+# being copied. One that only exists in memory has its shards pickled over to the workers once, when the pool starts
+# Workers are spawned rather than forked, the server and the dataset watcher have threads running that a fork would copy mid-way
+def shard_bounds(n_rows, shards):
+    return np.linspace(0, n_rows, shards + 1).astype(np.int64)
+
+def _rows(data, indices, indptr, start, end, n_columns):
+    lo, hi = indptr[start], indptr[end]
+    return sparse.csr_matrix((data[lo:hi], indices[lo:hi], np.asarray(indptr[start:end + 1]) - lo), shape=(end - start, n_columns), copy=False)
+
+def _load_shard(spec):
+    if spec[0] == 'path':
+        _, path, start, end, n_columns = spec
+        arrays = [np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in ("data", "indices", "indptr")]
+        return _rows(*arrays, start, end, n_columns)
+    return spec[1]
+
+def _serve(conn, spec):
+    matrix = _load_shard(spec)
+    conn.send(matrix.shape[0])
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        indices, data, k = request
+        query = sparse.csr_matrix((data, indices, [0, len(indices)]), shape=(1, matrix.shape[1]))
+        conn.send(top_k(query, matrix, k=k))
+    conn.close()
+
+# The local lists are each best first already, this just puts them together the way top_k orders things
+def merge_top_k(shard_matches, k):
+    merged = [match for matches in shard_matches for match in matches]
+    merged.sort(key=lambda match: (-match[1], match[0]))
+    return merged[:k]
+
+class ShardPool:
+    def __init__(self, matrix, shards=None, path=None):
+        self.matrix = matrix
+        self.shards = max(1, min(shards or os.cpu_count() or 1, matrix.shape[0] or 1))
+        self.bounds = shard_bounds(matrix.shape[0], self.shards)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._workers = []
+        context = multiprocessing.get_context('spawn')
+        try:
+            for start, end in zip(self.bounds[:-1], self.bounds[1:]):
+                if path is not None:
+                    spec = ('path', path, int(start), int(end), matrix.shape[1])
+                else:
+                    spec = ('matrix', matrix[int(start):int(end)])
+                parent, child = context.Pipe()
+                process = context.Process(target=_serve, args=(child, spec), daemon=True)
+                process.start()
+                child.close()
+                self._workers.append((process, parent))
+            # Each worker says how many rows it ended up with, which is also how a broken path shows up here instead of on a query
+            for (process, conn), start, end in zip(self._workers, self.bounds[:-1], self.bounds[1:]):
+                if conn.recv() != end - start:
+                    raise RuntimeError("shard came up with the wrong number of rows")
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.shards
+
+    # Queries take turns on the pool: there's one pipe per shard and a reply has to come back on the pipe its query went out on,
+    # so concurrent queries (the server's turn threads) queue up here. Each one still has every shard working on it at once,
+    # which is where the win is. The pool is for cutting the latency of one big scan, not for more queries at the same time
+    # A pool that's been closed (the index was reloaded while the query was on its way) scores the query on the matrix right here
+    # So does one that lost a worker (killed, out of memory): the pool shuts down for good and every query after is scored in process
+    # until the next reload starts a new one, slower but still the same answers
+    def search(self, query_vec, k=1):
+        query_vec = sparse.csr_matrix(query_vec)
+        with self._lock:
+            if not self._closed:
+                try:
+                    for _, conn in self._workers:
+                        conn.send((query_vec.indices, query_vec.data, k))
+                    shard_matches = [conn.recv() for _, conn in self._workers]
+                    return merge_top_k([[(row + int(start), score) for row, score in matches]
+                                        for matches, start in zip(shard_matches, self.bounds[:-1])], k)
+                except (OSError, EOFError) as e:
+                    print(f"[SYSTEM WARNING]: A QA shard worker stopped ({e!r}), answering without the shards until the next reload")
+                    self._shutdown()
+        return top_k(query_vec, self.matrix, k=k)
+
+    # Waits for the query on the pool to finish, so a reload never pulls a shard out from under it
+    def close(self):
+        with self._lock:
+            self._shutdown()
+
+    # Only with _lock held
+    def _shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for process, _ in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
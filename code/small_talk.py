@@ -1,56 +1,90 @@
-import pandas as pd
-import numpy as np
-import nltk
-import random
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.stem import WordNetLemmatizer
+import threading
 from nltk.corpus import wordnet
 #from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
-pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
+from preprocessing import shared_preprocessor
+from compiled_index import load_or_build
+from scoring import top_k, best_match
+from match_cache import shared_match_cache
+
+# The "|" alternatives are split once when the index is built, and only the one picked gets decoded (see string_table.py)
+ANSWER_TABLE = {'Answer': '|'}
 
 # Nearly identical to QA except no stopword removal
 class SmallTalkHandler:
-    def __init__(self, data_path="datasets/small_talk.csv"):
-        self.lemmatizer = WordNetLemmatizer()
+    def __init__(self, data_path="datasets/small_talk.csv", preprocessor=None, match_cache=None):
+        self.data_path = data_path
+        self.preprocessor = preprocessor or shared_preprocessor
+        self.match_cache = match_cache or shared_match_cache
+        self.index = None
         self.vectorizer = None
         self.questions_tfidf = None
         self.questions = []
         self.answers = []
+        self._reload_lock = threading.Lock()
         self._load_and_train(data_path)
 
-    def _preprocess(self, text):
-        tokens = nltk.word_tokenize(text.lower())
-        tagged = nltk.pos_tag(tokens, tagset='universal')
-        return ' '.join(self.lemmatizer.lemmatize(w, pos=pos_map.get(t, 'n')) for w, t in tagged if w.isalnum())
+    def _preprocess(self, text, cache=True):
+        return self.preprocessor.preprocess(text, cache=cache)
+
+    def _compile(self, previous=None):
+        return load_or_build("small_talk", self.data_path, 'Question', ['Answer'], {'analyzer': 'word'}, self.preprocessor, previous=previous, string_columns=ANSWER_TABLE)
 
     def _load_and_train(self, data_path):
         try:
-            df = pd.read_csv(data_path)
-            self.questions = [self._preprocess(q) for q in df['Question'].tolist()]
-            self.answers = df['Answer'].tolist()
-            self.vectorizer = TfidfVectorizer(analyzer='word')
-            self.questions_tfidf = self.vectorizer.fit_transform(self.questions)
+            self._use(self._compile())
         except Exception as e:
             print(f"[SYSTEM ERROR]: Error loading small talk data: {e}")
             self.vectorizer = None
 
+    # Queries only ever read self.index (once, at the start), so assigning it is the whole swap
+    def _use(self, index):
+        self.questions = index.texts
+        self.answers = index.labels['Answer']
+        self.vectorizer = index.vectorizer
+        self.questions_tfidf = index.matrix
+        self.index = index
+
+    # Picks up whatever changed in the CSV, appended rows are added on their own (see load_or_build)
+    # Returns how the new index came about ('appended', 'refit', 'built' or 'loaded'), or None if there was nothing to do
+    def reload(self):
+        with self._reload_lock:
+            previous = self.index
+            try:
+                index = self._compile(previous)
+            except Exception as e:
+                print(f"[SYSTEM ERROR]: Error reloading small talk data, keeping the old one: {e}")
+                return None
+            if index is previous:
+                return None
+            self._use(index)
+            return index.origin
+
     def get_small_talk_response(self, query, threshold):
-        if self.questions_tfidf is None or self.vectorizer is None:
+        index = self.index
+        if index is None:
             return "[SYSTEM ERROR]: Error with small talk processing"
         processed_query = self._preprocess(query)
         if not processed_query.strip():
             return "[SYSTEM ERROR]: Error with small talk processing"
-        query_tfidf = self.vectorizer.transform([processed_query])
-        if query_tfidf.sum() == 0:
+        return self.respond(index, self._matches(index, processed_query, 1), threshold)
+
+    # The reply for the matches found in index, however they were scored (see unified_index.py), None is no known term in the query
+    def respond(self, index, matches, threshold):
+        if matches is None:
             return "[SYSTEM ERROR]: No match for query within small talk"  
-        similarity_scores = cosine_similarity(query_tfidf, self.questions_tfidf)[0]
-        best_match_index = np.argmax(similarity_scores)
-        best_score = similarity_scores[best_match_index]
+        best_match_index, best_score = best_match(matches)
+        # Only the match is cached, the template is still picked fresh every time so Maila doesn't get stuck on one reply
         if best_score >= threshold:
-            responses = [r.strip() for r in self.answers[best_match_index].split("|")]
-            return random.choice(responses)
+            return index.labels['Answer'].choice(best_match_index)
         else:
             return "[SYSTEM ERROR]: Error with small talk processing"
+
+    def _matches(self, index, processed_query, k):
+        def compute():
+            query_tfidf = index.vectorizer.transform([processed_query])
+            if query_tfidf.sum() == 0:
+                return None
+            return top_k(query_tfidf, index.matrix, k=k)
+        return self.match_cache.matches(("small_talk", index.key), processed_query, compute, k)
@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from string_table import StringTableWriter
+from compiled_index import CompiledIndex, FORMAT_VERSION, index_settings, hash_source, cache_path, remove_stale
+
+# Builds a compiled index (same files CompiledIndex.save writes, so CompiledIndex.load memory-maps it straight back) without ever
+# having the whole CSV, the preprocessed texts or the matrix in memory at once. Meant for Q&A dumps far bigger than RAM
+#
+# Two passes, so the result is exactly what TfidfVectorizer would have fitted on the whole thing:
+# 1. the CSV is read chunksize rows at a time, every question is preprocessed once and spilled to a scratch file (with the labels),
+#    and the document frequency of every term is counted. Only the term counts stay in memory, and those grow with the vocabulary
+# 2. that gives the vocabulary and IDF, and the number of non-zeros is just the sum of the document frequencies, so the .npy files
+#    are created at their final size up front and every chunk of rows is vectorised straight into them
+def _json_array(path, items_path):
+    with open(path, 'w', encoding='utf-8') as out, open(items_path, encoding='utf-8') as items:
+        out.write('[')
+        for i, line in enumerate(items):
+            out.write((',' if i else '') + line.rstrip('\n'))
+        out.write(']')
+
+def _spill(scratch_dir, data_path, text_column, label_columns, vectorizer_params, preprocessor, fillna, chunksize):
+    analyzer = TfidfVectorizer(**vectorizer_params).build_analyzer()
+    doc_freq = {}
+    rows = 0
+    files = {column: open(os.path.join(scratch_dir, f"{column}.jsonl"), 'w', encoding='utf-8') for column in [text_column] + label_columns}
+    try:
+        for chunk in pd.read_csv(data_path, chunksize=chunksize):
+            if fillna:
+                chunk = chunk.fillna(fillna)
+            for text in chunk[text_column].tolist():
+                processed = preprocessor.preprocess(text, cache=False)
+                files[text_column].write(json.dumps(processed) + '\n')
+                for term in set(analyzer(processed)):
+                    doc_freq[term] = doc_freq.get(term, 0) + 1
+            for column in label_columns:
+                files[column].writelines(json.dumps(value) + '\n' for value in chunk[column].tolist())
+            rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    return rows, doc_freq
+
+def _processed_chunks(path, chunksize):
+    chunk = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            chunk.append(json.loads(line))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def stream_build(data_path, path, text_column, label_columns, vectorizer_params, preprocessor, key, source, fillna=None, chunksize=10000, string_columns=None):
+    string_columns = string_columns or {}
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    scratch_dir = tempfile.mkdtemp(prefix="maila-stream-", dir=os.path.dirname(path))
+    try:
+        rows, doc_freq = _spill(scratch_dir, data_path, text_column, label_columns, vectorizer_params, preprocessor, fillna, chunksize)
+        # Same vocabulary order and smoothed IDF as TfidfVectorizer.fit
+        terms = sorted(doc_freq)
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        frequencies = np.fromiter((doc_freq[term] for term in terms), dtype=np.int64, count=len(terms))
+        del doc_freq, terms
+        idf = np.log((1 + rows) / (1 + frequencies)) + 1
+        nnz = int(frequencies.sum())
+        vectorizer = TfidfVectorizer(vocabulary=vocabulary, **vectorizer_params)
+        vectorizer.idf_ = idf
+
+        data = open_memmap(os.path.join(tmp_path, "data.npy"), mode='w+', dtype=np.float64, shape=(nnz,))
+        indices = open_memmap(os.path.join(tmp_path, "indices.npy"), mode='w+', dtype=np.int32, shape=(nnz,))
+        indptr = open_memmap(os.path.join(tmp_path, "indptr.npy"), mode='w+', dtype=np.int64, shape=(rows + 1,))
+        indptr[0] = 0
+        row = written = 0
+        for texts in _processed_chunks(os.path.join(scratch_dir, f"{text_column}.jsonl"), chunksize):
+            block = vectorizer.transform(texts)
+            data[written:written + block.nnz] = block.data
+            indices[written:written + block.nnz] = block.indices
+            indptr[row + 1:row + 1 + len(texts)] = block.indptr[1:] + written
+            row += len(texts)
+            written += block.nnz
+        data.flush(); indices.flush(); indptr.flush()
+        del data, indices, indptr
+
+        np.save(os.path.join(tmp_path, "idf.npy"), idf)
+        with open(os.path.join(tmp_path, "vocabulary.json"), 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f)
+        _json_array(os.path.join(tmp_path, "texts.json"), os.path.join(scratch_dir, f"{text_column}.jsonl"))
+        # The string columns (the answers) become string tables, read back off the spill one line at a time
+        for column, delimiter in string_columns.items():
+            writer = StringTableWriter(os.path.join(tmp_path, column), delimiter)
+            with open(os.path.join(scratch_dir, f"{column}.jsonl"), encoding='utf-8') as f:
+                for line in f:
+                    writer.add(json.loads(line))
+            writer.close()
+        # labels.json is {"column": [...], ...} for the rest, written one column at a time
+        with open(os.path.join(tmp_path, "labels.json"), 'w', encoding='utf-8') as out:
+            out.write('{')
+            for i, column in enumerate(c for c in label_columns if c not in string_columns):
+                column_path = os.path.join(scratch_dir, f"{column}.array.json")
+                _json_array(column_path, os.path.join(scratch_dir, f"{column}.jsonl"))
+                out.write((', ' if i else '') + json.dumps(column) + ': ')
+                with open(column_path, encoding='utf-8') as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(column_path)
+            out.write('}')
+        params = {k: v for k, v in vectorizer.get_params().items() if k in ('analyzer', 'stop_words')}
+        meta = {'format': FORMAT_VERSION, 'key': key, 'shape': [rows, len(vocabulary)], 'params': params, 'source': source, 'fit_rows': rows, 'unseen_terms': {},
+                'string_columns': string_columns}
+        with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+# The streaming counterpart of load_or_build: reuses the compiled index if the CSV and settings hash the same, otherwise streams a new one
+# The CSV is only ever hashed in chunks here. An index this size is always rebuilt whole, appends aren't worth telling apart
+def load_or_stream(name, data_path, text_column, label_columns, vectorizer_params, preprocessor, fillna=None, cache_dir=None, previous=None, chunksize=10000, string_columns=None):
+    settings = index_settings(text_column, label_columns, vectorizer_params, preprocessor, fillna, string_columns)
+    key, source = hash_source(data_path, settings)
+    if previous is not None and previous.key == key:
+        return previous
+    path = cache_path(name, data_path, key, settings, cache_dir)
+    if os.path.isdir(path):
+        try:
+            return CompiledIndex.load(path)
+        except Exception as e:
+            print(f"[SYSTEM WARNING]: Compiled index for {name} is unreadable, rebuilding: {e}")
+    # Unlike load_or_build there's no in-memory index to fall back on, so it can't be built anywhere but the cache folder
+    # The old index stays until the new one is built and loaded, an interrupted multi-GB build still leaves one to start from
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    stream_build(data_path, path, text_column, label_columns, vectorizer_params, preprocessor, key, source, fillna, chunksize, string_columns)
+    index = CompiledIndex.load(path)
+    index.origin = 'built'
+    remove_stale(path, keep=previous.path if previous is not None else None)
+    return index
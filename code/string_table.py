@@ -0,0 +1,104 @@
+import os
+import random
+from array import array
+import numpy as np
+
+# A column of strings (the answers) as one UTF-8 blob plus an offsets array, string i is blob[offsets[i]:offsets[i+1]]
+# Saved as a raw .blob and an .npy that are memory-mapped back in, so a million answers cost some page cache rather than a million
+# Python str objects, and only the answer a query actually matched ever gets decoded
+#
+# delimiter splits every string into alternatives once, when the table is written (small talk's "|"), instead of on every query
+# The parts are what's in the blob then, and groups[i]:groups[i+1] are the parts that make up string i
+class StringTable:
+    def __init__(self, offsets, blob, groups=None, delimiter=None):
+        self.offsets = offsets
+        self.blob = blob
+        self.groups = groups
+        self.delimiter = delimiter
+
+    # Only the missing answers that pandas turns into NaN aren't str already, they come out as "nan" like they always did
+    @staticmethod
+    def _parts(value, delimiter):
+        value = value if isinstance(value, str) else str(value)
+        if delimiter is None:
+            return [value]
+        return [part.strip() for part in value.split(delimiter)]
+
+    @classmethod
+    def from_strings(cls, strings, delimiter=None):
+        encoded = []
+        groups = [0]
+        for value in strings:
+            encoded.extend(part.encode('utf-8') for part in cls._parts(value, delimiter))
+            groups.append(len(encoded))
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(part) for part in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, blob, np.array(groups, dtype=np.int64) if delimiter is not None else None, delimiter)
+
+    def __len__(self):
+        return len(self.groups if self.groups is not None else self.offsets) - 1
+
+    def _part(self, j):
+        return bytes(self.blob[self.offsets[j]:self.offsets[j + 1]]).decode('utf-8')
+
+    # A split table gives back every alternative of string i, an unsplit one the string itself
+    def __getitem__(self, i):
+        if self.groups is None:
+            return self._part(i)
+        return [self._part(j) for j in range(self.groups[i], self.groups[i + 1])]
+
+    # One alternative of string i picked at random, the only one that gets decoded
+    def choice(self, i, rng=random):
+        if self.groups is None:
+            return self._part(i)
+        return self._part(self.groups[i] + rng.randrange(self.groups[i + 1] - self.groups[i]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # A new table with the strings added at the end, this one is left as it is
+    def extend(self, strings):
+        tail = StringTable.from_strings(strings, self.delimiter)
+        offsets = np.concatenate([self.offsets, tail.offsets[1:] + self.offsets[-1]])
+        blob = np.concatenate([np.asarray(self.blob), tail.blob])
+        groups = np.concatenate([self.groups, tail.groups[1:] + self.groups[-1]]) if self.groups is not None else None
+        return StringTable(offsets, blob, groups, self.delimiter)
+
+    def save(self, prefix):
+        np.asarray(self.blob).tofile(prefix + ".blob")
+        np.save(prefix + ".offsets.npy", np.asarray(self.offsets))
+        if self.groups is not None:
+            np.save(prefix + ".groups.npy", np.asarray(self.groups))
+
+    @classmethod
+    def load(cls, prefix, delimiter=None):
+        offsets = np.load(prefix + ".offsets.npy", mmap_mode='r')
+        groups = np.load(prefix + ".groups.npy", mmap_mode='r') if delimiter is not None else None
+        # mmap can't map an empty file, a table of empty strings just doesn't need one
+        blob = np.memmap(prefix + ".blob", dtype=np.uint8, mode='r') if os.path.getsize(prefix + ".blob") else np.zeros(0, dtype=np.uint8)
+        return cls(offsets, blob, groups, delimiter)
+
+# Writes a table one string at a time, for the streaming build where the column never sits in memory
+# The blob goes straight to disk, the offsets are kept as a compact int64 array until close()
+class StringTableWriter:
+    def __init__(self, prefix, delimiter=None):
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self._blob = open(prefix + ".blob", 'wb')
+        self._offsets = array('q', [0])
+        self._groups = array('q', [0])
+
+    def add(self, value):
+        for part in StringTable._parts(value, self.delimiter):
+            encoded = part.encode('utf-8')
+            self._blob.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+        self._groups.append(len(self._offsets) - 1)
+
+    def close(self):
+        self._blob.close()
+        np.save(self.prefix + ".offsets.npy", np.frombuffer(self._offsets, dtype=np.int64))
+        if self.delimiter is not None:
+            np.save(self.prefix + ".groups.npy", np.frombuffer(self._groups, dtype=np.int64))
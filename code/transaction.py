@@ -1,7 +1,8 @@
 import re
 import os
 import random
-from guerrilla_mail import GuerrillaSession
+import inspect
+from guerrilla_mail import GuerrillaSession, AsyncGuerrillaSession, SessionRegistry, SessionExpiredError, aiohttp
 from requests.exceptions import RequestException, ConnectionError, HTTPError
 from urllib3.exceptions import NameResolutionError
 
@@ -91,9 +92,49 @@ class EmailResponseGenerator:
             return random.choice(self.templates['confirm_delete_all'])
         return "I'm not sure how to phrase that."
 
+# The email state machine is written once, as a coroutine, and every session call goes through _resolve
+# With a sync GuerrillaSession the calls just return values, so the coroutine never suspends and _run_sync can drive it without an event loop
+# With an AsyncGuerrillaSession the same coroutine really awaits the network, that's AsyncEmailHandler
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+def _run_sync(coroutine):
+    try:
+        coroutine.send(None)
+    except StopIteration as finished:
+        return finished.value
+    coroutine.close()
+    raise RuntimeError("The sync email handler was given a session that needs an event loop, use AsyncEmailHandler instead.")
+
 class EmailHandler:
-    def __init__(self):
+    def __init__(self, sessions=None, api_url=None):
         self.responder = EmailResponseGenerator()
+        self.sessions = sessions if sessions is not None else SessionRegistry()
+        self.api_url = api_url
+        # session_id -> (format, compress) asked for by a download that still needed its indices, see awaiting_download_index
+        self.pending_exports = {}
+
+    # Reuses the live session for this sid_token if there is one, restoring only costs a round trip the first time (or after eviction)
+    def _new_session(self):
+        return GuerrillaSession(api_url=self.api_url)
+
+    async def _get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._new_session()
+            await _resolve(session.restore_session(sid_token=session_id))
+            self.sessions.put(session_id, session)
+        return session
+
+    # The cached session is trusted until the server says otherwise, then it gets restored once and the action is retried
+    async def _with_session(self, session_id, action):
+        try:
+            return await _resolve(action(await self._get_session(session_id)))
+        except SessionExpiredError:
+            self.sessions.discard(session_id)
+            return await _resolve(action(await self._get_session(session_id)))
 
     def _extract_session_id(self, text):
         match = re.search(r'\b([a-z0-9]{26})\b', text.lower())
@@ -105,13 +146,24 @@ class EmailHandler:
 
     def _extract_email_indices(self, text, subintent):
         processed_text = text.lower().replace(subintent, "").strip()
-        if "all" in processed_text:
+        # A whole word, "install" or "small" shouldn't pick every email for a delete
+        if re.search(r'\ball\b', processed_text):
             return "all"
         matches = re.findall(r'(\d+-\d+|\d+)', processed_text)  
         if matches:
             return ",".join(matches)
         return None
         
+    # "download all as zip", "download 1-5 as mbox", "download all as compressed mbox" -> (format, compress)
+    # None means the usual one .html file per email
+    def _extract_export_format(self, text):
+        text = text.lower()
+        if 'zip' in text or 'archive' in text:
+            return ('zip', 'uncompressed' not in text)
+        if 'mbox' in text:
+            return ('mbox', 'uncompressed' not in text and any(word in text for word in ('compress', 'gz')))
+        return None
+
     def _get_mail_id_from_index(self, session, index_str):
         if not session.inbox:
             session.get_inbox_list()
@@ -124,11 +176,114 @@ class EmailHandler:
                 pass 
         return index_str
 
+    async def _delete_all(self, session):
+        if not session.inbox:
+            await _resolve(session.get_inbox_list())
+        return await _resolve(session.delete_emails('all'))
+
+    # Everything that needs a live session, split out of handle_email_task so it can be retried as a whole if the session expired
+    # export_format is the one a download asked for before it was prompted for the indices, if the reply doesn't name one itself
+    async def _manage_session(self, session, current_state, subintent, user_input, session_id=None, export_format=None):
+        response = "I'm not sure how to handle that email request."
+        new_state = current_state
+        new_session_data = None
+        action_data = None
+        if not session.email_addr:
+            raise Exception("Session expired or is invalid.")
+        if subintent == 'exit_loop':
+            response = "Okay, closing the email task. I'll remember your session if you need it again."
+            new_state = None
+            return (new_state, response, None, None)
+        if subintent in ['view_email', 'download_email', 'delete_email'] and not session.inbox:
+            await _resolve(session.get_inbox_list())
+        if subintent in ['list_emails', 'update_inbox']:
+            # Asking to update is asking for what the server has now, deletions included, not just what's new
+            inbox = await _resolve(session.get_inbox_list(incremental=subintent != 'update_inbox'))
+            response = self.responder.generate_response({'type': 'list_emails', 'inbox': inbox})
+            new_state = 'email_manage_loop'
+        elif subintent == 'view_email':
+            email_index_str = self._extract_email_id(user_input)
+            if email_index_str:
+                email_content = await _resolve(session.fetch_email_body(email_index_str))
+                if isinstance(email_content, dict) and 'mail_body' in email_content:
+                    subject = email_content.get('mail_subject', 'No Subject')
+                    response = f"Opening email {email_index_str}: '{subject}'"
+                    action_data = {'action': 'view_email', 'data': email_content}
+                else:
+                    response = f"Error: Could not fetch email index {email_index_str}."
+                    new_state = 'email_manage_loop'
+            else:
+                response = "Which email index would you like to view? Please enter a number."
+                new_state = 'awaiting_view_index'
+        elif subintent == 'download_email':
+            indices_str = self._extract_email_indices(user_input, subintent)
+            export_format = self._extract_export_format(user_input) or export_format
+            # "export my inbox as mbox" is all of it, only with a format though, "download the email in my inbox" still asks which
+            if not indices_str and export_format and re.search(r'\b(inbox|everything)\b', user_input.lower()):
+                indices_str = 'all'
+            if indices_str and export_format:
+                fmt, compress = export_format
+                (archive_path, exported, failed_files) = await _resolve(session.export_emails(indices_str, fmt, compress))
+                if archive_path:
+                    result_text = f"exported {exported} email(s) to {archive_path}"
+                else:
+                    result_text = "I couldn't export any of those emails"
+                if failed_files > 0:
+                    result_text += f", {failed_files} failed"
+                response = self.responder.generate_response({'type': 'download_emails', 'result_text': result_text})
+                new_state = 'email_manage_loop'
+            elif indices_str:
+                (downloaded_files, failed_files) = await _resolve(session.download_emails(indices_str))
+                result_text = f"Successfully downloaded {len(downloaded_files)} email(s)."
+                if failed_files > 0:
+                    result_text += f" {failed_files} failed."
+                response = self.responder.generate_response({'type': 'download_emails', 'result_text': result_text})
+                new_state = 'email_manage_loop'
+            else:
+                # Kept (or cleared) on every prompt, so the answer always goes with the format of the request that asked for it
+                if export_format and session_id:
+                    self.pending_exports[session_id] = export_format
+                else:
+                    self.pending_exports.pop(session_id, None)
+                response = "Which email(s) would you like to download? You can enter '1', '1, 2', '1-3', or 'all', and add 'as zip' or 'as mbox' to get them in one file."
+                new_state = 'awaiting_download_index'
+        elif subintent == 'delete_email':
+            indices_str = self._extract_email_indices(user_input, subintent)
+            if indices_str:
+                if indices_str.strip() == 'all':
+                    response = self.responder.generate_response({'type': 'confirm_delete_all'})
+                    new_state = 'awaiting_delete_all_confirm'
+                else:
+                    deleted_ids = await _resolve(session.delete_emails(indices_str))
+                    if deleted_ids is not None:
+                        result_text = f"Successfully deleted {len(deleted_ids)} email(s)."
+                    else:
+                        result_text = "I failed to delete those emails."
+                    response = self.responder.generate_response({'type': 'delete_emails', 'result_text': result_text})
+                    new_state = 'email_manage_loop'
+            else:
+                response = "Which email(s) would you like to delete? You can enter '1', '1, 2', '1-3', or 'all'."
+                new_state = 'awaiting_delete_index'
+        elif subintent == 'end_session':
+            response = "Are you sure you want to end your current session?"
+            new_state = 'awaiting_session_end_confirm'
+        elif subintent == 'manage_session':
+            response = self.responder.generate_response({'type': 'manage_session'})
+            new_state = 'email_manage_loop'
+        else: 
+            #response = self.responder.generate_response({'type': 'manage_session'})
+            #new_state = 'email_manage_loop'
+            pass # Should pass down now
+        return (new_state, response, new_session_data, action_data)
+
     # I found a flaw here during user testing, if you read my report, then you know what it is or you may have run into it if you were testing it
     # If you didn't, try to see what could potentially ruin a user's day here
     # A hint is that it invovles states and how Maila handles those inputs
     # Also I just realized that there no questions to actually ask Maila "What is my email" or for the session ID, apart from telling you it upon initation, whoops
     def handle_email_task(self, current_state, subintent, user_input, session_id):
+        return _run_sync(self._handle_email_task(current_state, subintent, user_input, session_id))
+
+    async def _handle_email_task(self, current_state, subintent, user_input, session_id):
         response = "I'm not sure how to handle that email request."
         new_state = current_state
         new_session_data = None
@@ -145,11 +300,12 @@ class EmailHandler:
                     response = "You already have an active session. You must 'end session' before starting a new one."
                     new_state = None
                     return (new_state, response, None, None)
-                session = GuerrillaSession()
-                success = session.start_new_session()
+                session = self._new_session()
+                success = await _resolve(session.start_new_session())
                 if success:
                     new_session_id = session.sid_token
                     new_email_address = session.email_addr
+                    self.sessions.put(new_session_id, session)
                     content = {'type': 'start_session', 'email': new_email_address, 'sid': new_session_id}
                     response = self.responder.generate_response(content)
                     new_state = None 
@@ -161,9 +317,11 @@ class EmailHandler:
             elif subintent == 'restore_session':
                 provided_id = self._extract_session_id(user_input)
                 if provided_id:
-                    session = GuerrillaSession()
-                    success = session.restore_session(sid_token=provided_id)
+                    self.sessions.discard(provided_id)
+                    session = self._new_session()
+                    success = await _resolve(session.restore_session(sid_token=provided_id))
                     if success:
+                        self.sessions.put(provided_id, session)
                         email_address = session.email_addr
                         content = {'type': 'restore_session', 'email': email_address, 'sid': provided_id}
                         response = self.responder.generate_response(content)                      
@@ -183,7 +341,7 @@ class EmailHandler:
             
             if current_state == 'awaiting_session_start_confirm':
                 if 'yes' in user_input.lower():
-                    return self.handle_email_task(None, 'start_session', user_input, None)
+                    return await self._handle_email_task(None, 'start_session', user_input, None)
                 else:
                     response = "Okay, no problem. Let me know if you change your mind."
                     new_state = None
@@ -191,7 +349,7 @@ class EmailHandler:
             elif current_state == 'awaiting_session_restore':
                 provided_id = self._extract_session_id(user_input)
                 if provided_id:
-                    return self.handle_email_task(None, 'restore_session', user_input, None)
+                    return await self._handle_email_task(None, 'restore_session', user_input, None)
                 else:
                     response = "I didn't catch a session ID in that message. Please provide your full session ID, or say 'cancel'."
                 return (new_state, response, None, None)
@@ -202,17 +360,16 @@ class EmailHandler:
                     return (new_state, response, None, None)
                 provided_id = self._extract_session_id(user_input)
                 if provided_id:
-                    return self.handle_email_task(None, 'restore_session', user_input, None)
+                    return await self._handle_email_task(None, 'restore_session', user_input, None)
                 else:
                     response = "Okay, what is the session ID you'd like to try?"
                     new_state = 'awaiting_session_restore' 
                 return (new_state, response, None, None)
             elif current_state == 'awaiting_session_end_confirm':
                 if 'yes' in user_input.lower():
-                    session = GuerrillaSession()
-                    session.restore_session(sid_token=session_id)
-                    success = session.forget_current_email()
+                    success = await self._with_session(session_id, lambda session: session.forget_current_email())
                     if success:
+                        self.sessions.discard(session_id)
                         response = "Your session has been ended and your email address deleted. Let me know if you need a new one."
                         new_session_data = (None, None) 
                     else:
@@ -225,7 +382,7 @@ class EmailHandler:
             elif current_state == 'awaiting_view_index':
                 email_index_str = self._extract_email_id(user_input)
                 if email_index_str:
-                    return self.handle_email_task('email_manage_loop', 'view_email', user_input, session_id)
+                    return await self._handle_email_task('email_manage_loop', 'view_email', user_input, session_id)
                 else:
                     response = "I didn't catch that. Please provide a number for the email you want to view, or say 'cancel'."
                     new_state = 'awaiting_view_index'
@@ -233,7 +390,8 @@ class EmailHandler:
             elif current_state == 'awaiting_download_index':
                 indices_str = self._extract_email_indices(user_input, "download")
                 if indices_str:
-                    return self.handle_email_task('email_manage_loop', 'download_email', user_input, session_id)
+                    export_format = self.pending_exports.pop(session_id, None)
+                    return await self._with_session(session_id, lambda session: self._manage_session(session, 'email_manage_loop', 'download_email', user_input, session_id, export_format))
                 else:
                     response = "I didn't catch that. Please provide indices (e.g., '1', '1, 2', '1-3', 'all'), or say 'cancel'."
                     new_state = 'awaiting_download_index'
@@ -245,17 +403,14 @@ class EmailHandler:
                         response = self.responder.generate_response({'type': 'confirm_delete_all'})
                         new_state = 'awaiting_delete_all_confirm'
                     else:
-                        return self.handle_email_task('email_manage_loop', 'delete_email', user_input, session_id)
+                        return await self._handle_email_task('email_manage_loop', 'delete_email', user_input, session_id)
                 else:
                     response = "I didn't catch that. Please provide indices (e.g., '1', '1, 2', '1-3', 'all'), or say 'cancel'."
                     new_state = 'awaiting_delete_index'
                 return (new_state, response, None, None)
             elif current_state == 'awaiting_delete_all_confirm':
                 if 'yes' in user_input.lower():
-                    session = GuerrillaSession()
-                    session.restore_session(sid_token=session_id)
-                    session.get_inbox_list() 
-                    deleted_ids = session.delete_emails('all')
+                    deleted_ids = await self._with_session(session_id, self._delete_all)
                     if deleted_ids is not None:
                         result_text = f"Successfully deleted {len(deleted_ids)} email(s)."
                         response = self.responder.generate_response({'type': 'delete_emails', 'result_text': result_text})
@@ -268,78 +423,12 @@ class EmailHandler:
                 return (new_state, response, None, None)
             
             if session_id:
-                session = GuerrillaSession()
-                session.restore_session(sid_token=session_id) 
-                if not session.email_addr:
-                    raise Exception("Session expired or is invalid.")
-                if subintent == 'exit_loop':
-                    response = "Okay, closing the email task. I'll remember your session if you need it again."
-                    new_state = None
-                    return (new_state, response, None, None)
-                if subintent in ['view_email', 'download_email', 'delete_email']:
-                    session.get_inbox_list()
-                if subintent in ['list_emails', 'update_inbox']:
-                    inbox = session.get_inbox_list()
-                    response = self.responder.generate_response({'type': 'list_emails', 'inbox': inbox})
-                    new_state = 'email_manage_loop'
-                elif subintent == 'view_email':
-                    email_index_str = self._extract_email_id(user_input)
-                    if email_index_str:
-                        email_content = session.fetch_email_body(email_index_str)
-                        if isinstance(email_content, dict) and 'mail_body' in email_content:
-                            subject = email_content.get('mail_subject', 'No Subject')
-                            response = f"Opening email {email_index_str}: '{subject}'"
-                            action_data = {'action': 'view_email', 'data': email_content}
-                        else:
-                            response = f"Error: Could not fetch email index {email_index_str}."
-                            new_state = 'email_manage_loop'
-                    else:
-                        response = "Which email index would you like to view? Please enter a number."
-                        new_state = 'awaiting_view_index'
-                elif subintent == 'download_email':
-                    indices_str = self._extract_email_indices(user_input, subintent)
-                    if indices_str:
-                        (downloaded_files, failed_files) = session.download_emails(indices_str)
-                        result_text = f"Successfully downloaded {len(downloaded_files)} email(s)."
-                        if failed_files > 0:
-                            result_text += f" {failed_files} failed."
-                        response = self.responder.generate_response({'type': 'download_emails', 'result_text': result_text})
-                        new_state = 'email_manage_loop'
-                    else:
-                        response = "Which email(s) would you like to download? You can enter '1', '1, 2', '1-3', or 'all'."
-                        new_state = 'awaiting_download_index'
-                elif subintent == 'delete_email':
-                    indices_str = self._extract_email_indices(user_input, subintent)
-                    if indices_str:
-                        if indices_str.strip() == 'all':
-                            response = self.responder.generate_response({'type': 'confirm_delete_all'})
-                            new_state = 'awaiting_delete_all_confirm'
-                        else:
-                            deleted_ids = session.delete_emails(indices_str)
-                            if deleted_ids is not None:
-                                result_text = f"Successfully deleted {len(deleted_ids)} email(s)."
-                            else:
-                                result_text = "I failed to delete those emails."
-                            response = self.responder.generate_response({'type': 'delete_emails', 'result_text': result_text})
-                            new_state = 'email_manage_loop'
-                    else:
-                        response = "Which email(s) would you like to delete? You can enter '1', '1, 2', '1-3', or 'all'."
-                        new_state = 'awaiting_delete_index'
-                elif subintent == 'end_session':
-                    response = "Are you sure you want to end your current session?"
-                    new_state = 'awaiting_session_end_confirm'
-                elif subintent == 'manage_session':
-                    response = self.responder.generate_response({'type': 'manage_session'})
-                    new_state = 'email_manage_loop'
-                else: 
-                    #response = self.responder.generate_response({'type': 'manage_session'})
-                    #new_state = 'email_manage_loop'
-                    pass # Should pass down now
-                return (new_state, response, new_session_data, action_data)
+                return await self._with_session(session_id, lambda session: self._manage_session(session, current_state, subintent, user_input, session_id))
             pass
         # The first one happens if you try to make API calls without an internet connection
         # If you haven't already started the session, then it will actually freeze for like 10 seconds likely because it's trying to resolve the hostname
         # If you have already started the session and then cut the internet, it doesn't freeze
+        # The connect timeout is short now, and after a few failures the circuit breaker in guerrilla_mail makes the rest fail instantly (CircuitOpenError)
         except (ConnectionError, NameResolutionError) as e:
             print(f"[TRANSACTION_ERROR] Connection error: {e}")
             response = "I'm sorry, I'm having trouble connecting to the email service. Please check your internet connection and try again."
@@ -356,4 +445,31 @@ class EmailHandler:
             print(f"[TRANSACTION_ERROR] An unexpected error occurred: {e}")
             response = f"An unexpected error occurred: {e}. Returning to the main menu."
             new_state = None
-        return (new_state, response, new_session_data, action_data)
\ No newline at end of file
+        return (new_state, response, new_session_data, action_data)
+
+# Same flows as EmailHandler, but handle_email_task is a coroutine and the sessions are AsyncGuerrillaSessions
+# All mailboxes share one aiohttp connection pool, so a server can keep thousands of email operations in flight on a single event loop
+class AsyncEmailHandler(EmailHandler):
+    def __init__(self, sessions=None, api_url=None, max_connections=100):
+        if aiohttp is None:
+            raise ImportError("AsyncEmailHandler needs the 'aiohttp' package (pip install aiohttp).")
+        super().__init__(sessions, api_url)
+        self.max_connections = max_connections
+        self._http = None
+
+    def _new_session(self):
+        if self._http is None:
+            self._http = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=GuerrillaSession.CONNECT_TIMEOUT, sock_read=GuerrillaSession.READ_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                cookie_jar=aiohttp.DummyCookieJar()
+            )
+        return AsyncGuerrillaSession(api_url=self.api_url, http=self._http)
+
+    async def handle_email_task(self, current_state, subintent, user_input, session_id):
+        return await self._handle_email_task(current_state, subintent, user_input, session_id)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
@@ -0,0 +1,118 @@
+import threading
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from scoring import top_k_scores
+from match_cache import shared_match_cache
+
+SOURCES = ('intents', 'question_answer', 'small_talk')
+
+# The intent phrases, the Q&A questions and the small talk questions as one matrix over one shared vocabulary, each row tagged with
+# the dataset it came from. A conversational turn used to transform the query and score it against the intents, then transform it
+# again with a different vectorizer for the QA or small talk matrix. Here one count vector and one sparse product score all three
+#
+# The scores are exactly what each dataset's own TF-IDF model gives, so the 0.2/0.4/0.65 thresholds mean what they always did
+# Each dataset keeps its own IDF and stop words: a row is its usual L2-normalised TF-IDF row times that dataset's IDF, so
+# counts @ row is the dot product the dataset's vectorizer would have got before normalising the query. Normalising is then just
+# dividing by the norm of the query under that dataset's IDF, three small sums over the terms the query actually has
+# A term a dataset doesn't know (QA never has stop words) has an IDF of 0 there, so it counts for nothing in that dataset
+class UnifiedIndex:
+    def __init__(self, indices):
+        self.indices = indices
+        self.keys = tuple(indices[source].key for source in SOURCES)
+        vectorizers = [indices[source].vectorizer for source in SOURCES]
+        # Stop words are the only setting the datasets are allowed to differ on, they're taken care of by the IDF
+        params = [{k: v for k, v in vectorizer.get_params().items() if k not in ('stop_words', 'vocabulary', 'dtype')} for vectorizer in vectorizers]
+        if any(p != params[0] for p in params[1:]):
+            raise ValueError("The intent, QA and small talk vectorizers tokenise differently, they can't share a vocabulary.")
+        if params[0]['norm'] != 'l2' or params[0]['sublinear_tf'] or not params[0]['use_idf']:
+            raise ValueError("The unified index only reproduces plain L2-normalised TF-IDF.")
+        terms = sorted(set().union(*(vectorizer.vocabulary_ for vectorizer in vectorizers)))
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        self.counter = CountVectorizer(vocabulary=vocabulary, **{k: v for k, v in params[0].items() if k in CountVectorizer().get_params()})
+        self.idf = np.zeros((len(SOURCES), len(terms)))
+        blocks = []
+        self.offsets = [0]
+        for s, (source, vectorizer) in enumerate(zip(SOURCES, vectorizers)):
+            columns = np.empty(len(vectorizer.vocabulary_), dtype=np.int64)
+            for term, column in vectorizer.vocabulary_.items():
+                columns[column] = vocabulary[term]
+            self.idf[s, columns] = vectorizer.idf_
+            matrix = sparse.csr_matrix(indices[source].matrix)
+            blocks.append(sparse.csr_matrix((matrix.data * vectorizer.idf_[matrix.indices], columns[matrix.indices], matrix.indptr),
+                                            shape=(matrix.shape[0], len(terms))))
+            self.offsets.append(self.offsets[-1] + matrix.shape[0])
+        self.matrix = sparse.vstack(blocks, format='csr')
+        self.sources = np.repeat(np.arange(len(SOURCES), dtype=np.int8), np.diff(self.offsets))
+
+    # {source: [(row, score), ...] best first, or None when the query has no term that dataset knows}, rows local to each dataset
+    # ks is how many rows to keep per source, in SOURCES order
+    def search(self, processed_query, ks):
+        counts = self.counter.transform([processed_query])
+        weights = counts.data * self.idf[:, counts.indices]
+        norms = np.sqrt((weights ** 2).sum(axis=1))
+        scores = sparse.csr_matrix(counts @ self.matrix.T)
+        scores.sort_indices()
+        rows, values = scores.indices, scores.data
+        bounds = np.searchsorted(rows, self.offsets)
+        result = {}
+        for s, (source, k) in enumerate(zip(SOURCES, ks)):
+            if norms[s] == 0:
+                result[source] = None
+                continue
+            start, end = bounds[s], bounds[s + 1]
+            result[source] = top_k_scores(rows[start:end] - self.offsets[s], values[start:end] / norms[s], k)
+        return result
+
+# Keeps a UnifiedIndex over whatever the three handlers have loaded. When one of them reloads (see dataset_watcher.py), the next
+# query builds a new one over the new indices, queries already running carry on with the one they started with
+# search() gives back {source: (that dataset's index, matches)}, which is what IntentClassifier.decide(), QAHandler.respond()
+# and SmallTalkHandler.respond() take. None means the query has to go to the handlers the old way (not loaded, nothing left after
+# preprocessing), which is also where their error replies come from
+class UnifiedRetriever:
+    def __init__(self, intent_classifier, qa_handler, small_talk_handler, match_cache=None):
+        self.handlers = {'intents': intent_classifier, 'question_answer': qa_handler, 'small_talk': small_talk_handler}
+        if any(handler.preprocessor is not intent_classifier.preprocessor for handler in self.handlers.values()):
+            raise ValueError("The intent, QA and small talk handlers have to share one preprocessor to share an index.")
+        if qa_handler.engine != 'dense' or qa_handler.streaming:
+            raise ValueError("The unified index only stands in for the dense, in-memory QA engine.")
+        self.preprocessor = intent_classifier.preprocessor
+        self.match_cache = match_cache or shared_match_cache
+        self.index = None
+        self._failed = None
+        self._lock = threading.Lock()
+        self._current()
+
+    def _current(self):
+        indices = {source: handler.index for source, handler in self.handlers.items()}
+        if any(index is None for index in indices.values()):
+            return None
+        index = self.index
+        if index is not None and all(index.indices[source] is indices[source] for source in SOURCES):
+            return index
+        with self._lock:
+            index = self.index
+            if index is None or any(index.indices[source] is not indices[source] for source in SOURCES):
+                # Only said once per set of datasets, the handlers answer on their own until one of them changes
+                keys = tuple(indices[source].key for source in SOURCES)
+                if keys == self._failed:
+                    return None
+                try:
+                    index = UnifiedIndex(indices)
+                except Exception as e:
+                    print(f"[SYSTEM ERROR]: Could not build the unified index, using the handlers on their own: {e}")
+                    self._failed = keys
+                    return None
+                self.index = index
+            return index
+
+    def search(self, query, ks):
+        index = self._current()
+        if index is None:
+            return None
+        processed_query = self.preprocessor.preprocess(query)
+        if not processed_query.strip():
+            return None
+        matches = self.match_cache.matches(("unified",) + index.keys, processed_query, lambda: index.search(processed_query, ks), *ks)
+        return {source: (index.indices[source], matches[source]) for source in SOURCES}
@@ -0,0 +1,81 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import nltk
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+# NLTK loads the tagger, WordNet and the stopword list lazily on first use, and those loaders aren't safe to race from several threads
+# So this runs once, before any handler starts training, and the first query doesn't pay for it either
+def warm_nltk_resources():
+    tokens = nltk.word_tokenize("maila is warming up her taggers")
+    nltk.pos_tag(tokens, tagset='universal')
+    WordNetLemmatizer().lemmatize("warming", pos='v')
+    stopwords.words('english')
+
+# The fast preprocessing mode only ever asks WordNet (for words the lemma table doesn't have), the tokenizer and tagger never load
+# Identity still loads punkt and the stopwords itself, nothing else touches those in this mode so there's nobody to race
+def warm_wordnet():
+    WordNetLemmatizer().lemmatize("warming", pos='v')
+
+# Builds the handlers concurrently in the background so the window can show straight away
+# get() only blocks on the one handler being asked for, so an early query just waits for what it actually needs
+# warm is what runs before the needs_nltk handlers are built
+class HandlerRegistry:
+    def __init__(self, max_workers=4, warm=warm_nltk_resources):
+        self.started = time.perf_counter()
+        self.load_times = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="maila-warmup")
+        self._nltk_ready = self._executor.submit(self._timed, "nltk", lambda: self._warm(warm))
+
+    # Missing NLTK data (punkt, the tagger, stopwords) is said once here and the handlers still get built
+    # They fail on their own then and give their "[SYSTEM ERROR]" replies, instead of every get() raising the warm-up error again
+    def _warm(self, warm):
+        try:
+            warm()
+        except Exception as e:
+            print(f"[SYSTEM WARNING]: Could not load NLTK resources, the handlers that need them will not work: {e}")
+
+    def _timed(self, name, factory):
+        start = time.perf_counter()
+        result = factory()
+        with self._lock:
+            self.load_times[name] = time.perf_counter() - start
+        return result
+
+    def _build(self, name, factory, needs_nltk):
+        if needs_nltk:
+            self._nltk_ready.result()
+        return self._timed(name, factory)
+
+    def register(self, name, factory, needs_nltk=True):
+        self._futures[name] = self._executor.submit(self._build, name, factory, needs_nltk)
+
+    def get(self, name):
+        return self._futures[name].result()
+
+    def __contains__(self, name):
+        return name in self._futures
+
+    # The handler names in the order they were registered
+    def __iter__(self):
+        return iter(list(self._futures))
+
+    def is_ready(self, name):
+        return self._futures[name].done()
+
+    def wait_all(self):
+        for future in self._futures.values():
+            future.result()
+        return self
+
+    def report(self):
+        with self._lock:
+            times = dict(self.load_times)
+        pending = [name for name, future in self._futures.items() if not future.done()]
+        parts = [f"{name} {seconds * 1000:.0f}ms" for name, seconds in times.items()]
+        if pending:
+            parts.append(f"still loading: {', '.join(pending)}")
+        return "; ".join(parts)
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from transaction import EmailHandler, AsyncEmailHandler
+from fake_guerrilla import FakeGuerrillaServer
+
+# One full email task, the same steps as Flow 1 in test_flows.txt: (operation, current_state, subintent, what the user typed)
+FLOW = [
+    ('start_session', None, 'start_session', "start a new session"),
+    ('list_emails', None, 'list_emails', "check my inbox"),
+    ('view_email', 'email_manage_loop', 'view_email', "view email 2"),
+    ('download_email', 'email_manage_loop', 'download_email', "download emails 1-5"),
+    ('delete_email', 'email_manage_loop', 'delete_email', "delete emails 1 and 3"),
+    ('update_inbox', 'email_manage_loop', 'update_inbox', "update my inbox"),
+    ('end_session', 'email_manage_loop', 'end_session', "end session"),
+    ('confirm_end', 'awaiting_session_end_confirm', 'none', "yes"),
+]
+
+# EmailHandler never raises, a failed call comes back as one of these replies
+FAILURE_REPLIES = ("Error:", "I'm sorry, I'm having trouble", "The email service seems", "An unexpected error", "Sorry,", "I ran into a value error")
+
+def is_failure(response):
+    return response.startswith(FAILURE_REPLIES)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name, _, _, _ in FLOW}
+        self.failures = {name: 0 for name, _, _, _ in FLOW}
+        self.completed_flows = 0
+
+    def record(self, name, seconds, response):
+        self.latencies[name].append(seconds)
+        if is_failure(response):
+            self.failures[name] += 1
+            return False
+        return True
+
+    def report(self, wall_time, flows):
+        calls = sum(len(v) for v in self.latencies.values())
+        print(f"\n{flows} flows, {self.completed_flows} completed in {wall_time:.2f}s")
+        print(f"Throughput: {self.completed_flows / wall_time:.1f} flows/s, {calls / wall_time:.1f} operations/s\n")
+        print(f"{'operation':<16}{'calls':>7}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, samples in self.latencies.items():
+            if not samples:
+                continue
+            p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+            print(f"{name:<16}{len(samples):>7}{self.failures[name]:>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{max(samples) * 1000:>10.1f}")
+
+# A flow stops at the first failed step, the rest of it would just be talking to a session that isn't there
+def run_flow(handler, recorder):
+    session_id = None
+    for name, state, subintent, text in FLOW:
+        start = time.perf_counter()
+        new_state, response, session_data, _ = handler.handle_email_task(state, subintent, text, session_id)
+        if not recorder.record(name, time.perf_counter() - start, response):
+            return
+        if session_data:
+            session_id = session_data[0]
+    recorder.completed_flows += 1
+
+async def run_flow_async(handler, recorder, limit):
+    async with limit:
+        session_id = None
+        for name, state, subintent, text in FLOW:
+            start = time.perf_counter()
+            new_state, response, session_data, _ = await handler.handle_email_task(state, subintent, text, session_id)
+            if not recorder.record(name, time.perf_counter() - start, response):
+                return
+            if session_data:
+                session_id = session_data[0]
+        recorder.completed_flows += 1
+
+async def run_async(api_url, flows, concurrency, recorder):
+    handler = AsyncEmailHandler(api_url=api_url, max_connections=concurrency)
+    try:
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(run_flow_async(handler, recorder, limit) for _ in range(flows)))
+    finally:
+        await handler.close()
+
+def run_benchmark(api_url, flows, concurrency, use_async=False):
+    recorder = Recorder()
+    start = time.perf_counter()
+    if use_async:
+        asyncio.run(run_async(api_url, flows, concurrency, recorder))
+    else:
+        handler = EmailHandler(api_url=api_url)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(run_flow, handler, recorder) for _ in range(flows)]:
+                future.result()
+    recorder.report(time.perf_counter() - start, flows)
+    return recorder
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drive many concurrent email tasks against a fake Guerrilla Mail and report latency per operation.")
+    parser.add_argument("--flows", type=int, default=100, help="number of full email tasks to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="flows in flight at once")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use AsyncEmailHandler (needs aiohttp) instead of threads")
+    parser.add_argument("--url", default=None, help="an already running fake (or real) API, otherwise one is started in-process")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--inbox-size", type=int, default=20)
+    parser.add_argument("--body-size", type=int, default=2048)
+    args = parser.parse_args()
+
+    fake = None
+    if args.url is None:
+        fake = FakeGuerrillaServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, inbox_size=args.inbox_size, body_size=args.body_size).start()
+    # Downloads land in ./downloads/<sid>, so run somewhere that gets thrown away afterwards
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            run_benchmark(args.url or fake.url, args.flows, args.concurrency, args.use_async)
+        finally:
+            os.chdir(original_dir)
+            if fake:
+                print(f"\nFake server calls: {fake.calls}, injected errors: {fake.errors}")
+                fake.stop()
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import bisect
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from inbox import Inbox
+
+# What GuerrillaSession used to do: a list of dicts kept in order with insort, a set of ids next to it,
+# index -> id by indexing the list, id -> position by scanning it, and every delete rebuilding the list
+class ListInbox:
+    def __init__(self):
+        self.emails = []
+        self.ids = set()
+
+    def add(self, email):
+        if email['mail_id'] in self.ids:
+            return False
+        bisect.insort_left(self.emails, email, key=lambda e: -int(e['mail_timestamp']))
+        self.ids.add(email['mail_id'])
+        return True
+
+    def remove(self, mail_ids):
+        mail_ids = set(mail_ids)
+        self.emails = [e for e in self.emails if e['mail_id'] not in mail_ids]
+        self.ids -= mail_ids
+
+    def position(self, mail_id):
+        return next((i for i, e in enumerate(self.emails) if e['mail_id'] == mail_id), None)
+
+    def id_at(self, position):
+        return self.emails[position]['mail_id']
+
+    def __len__(self):
+        return len(self.emails)
+
+def make_emails(size, seed):
+    rng = random.Random(seed)
+    base = 1_700_000_000
+    emails = []
+    for i in range(1, size + 1):
+        emails.append({
+            'mail_id': str(i),
+            'mail_from': f"sender{rng.randrange(500)}@example.com",
+            'mail_subject': f"Subject number {i}",
+            'mail_excerpt': "Lorem ipsum dolor sit amet, consectetur adipiscing",
+            'mail_timestamp': str(base + i * 7 + rng.randrange(600)), # Mostly in arrival order, with some out of order like real mail
+            'mail_read': '0',
+            'mail_date': "12:00:00",
+        })
+    return emails
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+# Everything the inbox keeps alive once the API responses themselves are gone, the list keeps the dicts, Inbox keeps its records
+def footprint(inbox_class, size, seed):
+    tracemalloc.start()
+    inbox = inbox_class()
+    for email in make_emails(size, seed):
+        inbox.add(email)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory / 1e6
+
+def run(inbox_class, emails, lookups, deletes, seed):
+    rng = random.Random(seed)
+    inbox = inbox_class()
+    results = {}
+
+    results['build'] = timed(lambda: [inbox.add(email) for email in emails])
+
+    ids = [email['mail_id'] for email in emails]
+    targets = [rng.choice(ids) for _ in range(lookups)]
+    results['id_to_position'] = timed(lambda: [inbox.position(mail_id) for mail_id in targets]) / lookups
+
+    positions = [rng.randrange(len(inbox)) for _ in range(lookups)]
+    results['position_to_id'] = timed(lambda: [inbox.id_at(p) for p in positions]) / lookups
+
+    # One "delete 5" at a time, the way a user actually deletes
+    doomed = [rng.sample(ids, 1) for _ in range(deletes)]
+    results['delete_one'] = timed(lambda: [inbox.remove(batch) for batch in doomed]) / deletes
+
+    results['delete_half'] = timed(lambda: inbox.remove(ids[::2]))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the indexed Inbox with the old list-of-dicts inbox on large mailboxes.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--deletes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'emails':>8} {'inbox':<6}{'build s':>10}{'memory MB':>11}{'id->pos us':>12}{'pos->id us':>12}{'delete 1 us':>13}{'delete half ms':>16}")
+    for size in args.sizes:
+        emails = make_emails(size, args.seed)
+        for name, inbox_class in (("list", ListInbox), ("Inbox", Inbox)):
+            r = run(inbox_class, emails, args.lookups, args.deletes, args.seed)
+            r['memory_mb'] = footprint(inbox_class, size, args.seed)
+            print(f"{size:>8} {name:<6}{r['build']:>10.3f}{r['memory_mb']:>11.1f}{r['id_to_position'] * 1e6:>12.1f}"
+                  f"{r['position_to_id'] * 1e6:>12.2f}{r['delete_one'] * 1e6:>13.1f}{r['delete_half'] * 1e3:>16.1f}")
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from inverted_index import InvertedIndex
+from scoring import top_k
+
+# Synthetic Q&A corpus, questions are 3-9 words drawn from a Zipf-ish vocabulary so a few terms are everywhere and most are rare,
+# which is roughly what real questions look like once stop words are gone
+def make_questions(count, vocabulary, seed):
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, vocabulary + 1) ** 1.05
+    weights /= weights.sum()
+    lengths = rng.integers(3, 10, size=count)
+    words = rng.choice(vocabulary, size=int(lengths.sum()), p=weights)
+    questions = []
+    start = 0
+    for length in lengths:
+        questions.append(' '.join(f"w{w}" for w in words[start:start + length]))
+        start += length
+    return questions
+
+# Queries are real questions with a word dropped or swapped, so some clear the threshold and some don't
+def make_queries(questions, count, vocabulary, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in rng.integers(0, len(questions), size=count):
+        words = questions[i].split()
+        if rng.random() < 0.5:
+            words.pop(rng.integers(len(words)))
+        else:
+            words[rng.integers(len(words))] = f"w{rng.integers(vocabulary)}"
+        queries.append(' '.join(words))
+    return queries
+
+def percentiles(samples):
+    return np.percentile(np.array(samples) * 1000, [50, 95, 99])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare dense cosine_similarity QA lookups with the sparse top_k and the InvertedIndex on a large synthetic corpus.")
+    parser.add_argument("--questions", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--threshold", type=float, default=0.65, help="the QA threshold Maila uses")
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    questions = make_questions(args.questions, args.vocabulary, args.seed)
+    vectorizer = TfidfVectorizer(analyzer='word')
+    matrix = vectorizer.fit_transform(questions)
+    print(f"Built {matrix.shape[0]} x {matrix.shape[1]} TF-IDF matrix ({matrix.nnz} non-zeros) in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    index = InvertedIndex.from_matrix(matrix)
+    print(f"Built inverted index in {time.perf_counter() - start:.1f}s\n")
+
+    queries = [vectorizer.transform([q]) for q in make_queries(questions, args.queries, args.vocabulary, args.seed)]
+    dense_times, sparse_times, inverted_times = [], [], []
+    agree = answered = 0
+    for query in queries:
+        start = time.perf_counter()
+        scores = cosine_similarity(query, matrix)[0]
+        best = int(np.argmax(scores))
+        dense = best if scores[best] >= args.threshold else None
+        dense_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        matches = top_k(query, matrix, k=args.k)
+        sparse_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        matches = index.search(query, k=args.k, threshold=args.threshold)
+        inverted_times.append(time.perf_counter() - start)
+        inverted = matches[0][0] if matches else None
+
+        agree += dense == inverted
+        answered += dense is not None
+
+    print(f"{args.queries} queries, {answered} above the {args.threshold} threshold, inverted index agreed on {agree}/{args.queries}\n")
+    print(f"{'engine':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, samples in (("dense", dense_times), ("sparse", sparse_times), ("inverted", inverted_times)):
+        p50, p95, p99 = percentiles(samples)
+        print(f"{name:<10}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}")
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from compiled_index import CompiledIndex
+from sharded_index import ShardPool
+from scoring import top_k
+from benchmark_qa_index import make_questions, make_queries, percentiles
+
+# The index is saved and loaded back like the QA handler's would be, so the shards memory-map it rather than get a copy each
+# Every shard count answers the same queries, and every answer is checked against top_k over the whole matrix in one process
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency of the sharded QA search against the number of worker processes, on a large synthetic corpus.")
+    parser.add_argument("--questions", type=int, default=4_000_000)
+    parser.add_argument("--vocabulary", type=int, default=400_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--shards", default=None, help="comma separated shard counts, defaults to 1, 2, 4... up to the number of cores")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    cores = os.cpu_count() or 1
+    if args.shards:
+        shard_counts = [int(s) for s in args.shards.split(',')]
+    else:
+        shard_counts = [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+
+    start = time.perf_counter()
+    questions = make_questions(args.questions, args.vocabulary, args.seed)
+    vectorizer = TfidfVectorizer(analyzer='word')
+    matrix = vectorizer.fit_transform(questions)
+    print(f"Built {matrix.shape[0]} x {matrix.shape[1]} TF-IDF matrix ({matrix.nnz} non-zeros) in {time.perf_counter() - start:.1f}s, {cores} cores")
+    queries = [vectorizer.transform([q]) for q in make_queries(questions, args.queries, args.vocabulary, args.seed)]
+    del questions
+
+    scratch = tempfile.mkdtemp(prefix="maila-bench-")
+    try:
+        path = os.path.join(scratch, "question_answer")
+        CompiledIndex(vectorizer, matrix, [], {}).save(path)
+        index = CompiledIndex.load(path)
+        del matrix
+
+        expected, single_times = [], []
+        for query in queries:
+            start = time.perf_counter()
+            expected.append(top_k(query, index.matrix, k=args.k))
+            single_times.append(time.perf_counter() - start)
+        single_p50 = percentiles(single_times)[0]
+
+        print(f"\n{'shards':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'speedup':>10}{'agree':>10}")
+        p50, p95, p99 = percentiles(single_times)
+        print(f"{'none':>8}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{1.0:>10.2f}{len(queries):>10}")
+        for shards in shard_counts:
+            pool = ShardPool(index.matrix, shards, index.path)
+            try:
+                times, agree = [], 0
+                for query, matches in zip(queries, expected):
+                    start = time.perf_counter()
+                    found = pool.search(query, k=args.k)
+                    times.append(time.perf_counter() - start)
+                    agree += found == matches
+            finally:
+                pool.close()
+            p50, p95, p99 = percentiles(times)
+            print(f"{shards:>8}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{single_p50 / p50:>10.2f}{agree:>10}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,80 @@
+import os
+import sys
+import csv
+import time
+import json
+import shutil
+import resource
+import tempfile
+import argparse
+import subprocess
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from compiled_index import CompiledIndex, index_settings, hash_source
+from streaming_index import stream_build
+from benchmark_qa_index import make_questions
+
+VECTORIZER = {'stop_words': 'english', 'analyzer': 'word'}
+ANSWER_TABLE = {'Answer': None}
+
+# The builds are what's being measured, not NLTK, so the questions (already lemma-like words) just get split on whitespace
+class PlainPreprocessor:
+    def preprocess(self, text, cache=True):
+        return ' '.join(str(text).lower().split())
+
+    def settings(self):
+        return {'pipeline': 'whitespace', 'version': 1}
+
+def write_csv(path, count, vocabulary, seed):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Question", "Answer"])
+        for start in range(0, count, 100_000):
+            questions = make_questions(min(100_000, count - start), vocabulary, seed + start)
+            writer.writerows((q, f"Answer number {start + i}, which is about {q.split()[0]}.") for i, q in enumerate(questions))
+
+# Each build runs in its own process, so ru_maxrss is the peak for that build alone
+# CSV in, compiled index on disk out, the same steps load_or_build and load_or_stream take on a cache miss
+def run_child(mode, csv_path, chunksize):
+    preprocessor = PlainPreprocessor()
+    path = os.path.join(os.path.dirname(csv_path), "compiled", "question_answer")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    start = time.perf_counter()
+    key, source = hash_source(csv_path, index_settings('Question', ['Answer'], VECTORIZER, preprocessor, string_columns=ANSWER_TABLE))
+    if mode == 'memory':
+        df = pd.read_csv(csv_path)
+        texts = [preprocessor.preprocess(t, cache=False) for t in df['Question'].tolist()]
+        CompiledIndex.build(texts, {'Answer': df['Answer'].tolist()}, VECTORIZER, key, source, ANSWER_TABLE).save(path)
+    else:
+        stream_build(csv_path, path, 'Question', ['Answer'], VECTORIZER, preprocessor, key, source, chunksize=chunksize, string_columns=ANSWER_TABLE)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'seconds': seconds, 'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Peak memory and time of the in-memory QA index build vs the streaming one, on growing synthetic CSVs.")
+    parser.add_argument("--sizes", default="100000,400000,1600000", help="comma separated question counts")
+    parser.add_argument("--vocabulary", type=int, default=200_000)
+    parser.add_argument("--chunksize", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "CSV"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child[0], args.child[1], args.chunksize)
+        sys.exit(0)
+
+    print(f"{'questions':>10}{'CSV MB':>10}{'mode':>10}{'seconds':>10}{'peak MB':>10}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        scratch = tempfile.mkdtemp(prefix="maila-bench-")
+        try:
+            csv_path = os.path.join(scratch, "question_answer.csv")
+            write_csv(csv_path, size, args.vocabulary, args.seed)
+            csv_mb = os.path.getsize(csv_path) / 1e6
+            for mode in ('memory', 'streaming'):
+                shutil.rmtree(os.path.join(scratch, "compiled"), ignore_errors=True)
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--chunksize", str(args.chunksize), "--child", mode, csv_path],
+                                        capture_output=True, text=True, check=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{size:>10}{csv_mb:>10.0f}{mode:>10}{result['seconds']:>10.1f}{result['peak_mb']:>10.0f}")
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code")
+sys.path.insert(0, CODE_DIR)
+from preprocessing import get_preprocessor, PREPROCESSING_MODES
+from intent_classifier import IntentClassifier
+from question_answer import QAHandler
+from small_talk import SmallTalkHandler
+from unified_index import UnifiedIndex
+from scoring import top_k
+from benchmark_qa_index import percentiles
+
+DATASETS = os.path.join(CODE_DIR, "datasets")
+
+# A conversational turn the old way: the query is transformed and scored against the intents, then transformed and scored again
+# against QA or small talk (whichever the intent says). The unified index does both in one transform and one product
+# Preprocessing happens once either way, so it's left out. Every turn is also checked to come out the same both ways
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Per-turn scoring time of the separate intent + QA/small talk lookups against the unified index.")
+    parser.add_argument("--preprocessing", choices=PREPROCESSING_MODES, default='full')
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    preprocessor = get_preprocessor(args.preprocessing)
+    intents = IntentClassifier(os.path.join(DATASETS, "intents_data.csv"), preprocessor)
+    qa = QAHandler(os.path.join(DATASETS, "question_answer.csv"), preprocessor)
+    small_talk = SmallTalkHandler(os.path.join(DATASETS, "small_talk.csv"), preprocessor)
+    start = time.perf_counter()
+    unified = UnifiedIndex({'intents': intents.index, 'question_answer': qa.index, 'small_talk': small_talk.index})
+    print(f"Unified index: {unified.matrix.shape[0]} rows x {unified.matrix.shape[1]} terms, built in {(time.perf_counter() - start) * 1000:.1f}ms\n")
+
+    queries = pd.concat([pd.read_csv(os.path.join(DATASETS, "question_answer.csv"))['Question'],
+                         pd.read_csv(os.path.join(DATASETS, "small_talk.csv"))['Question']]).tolist()
+    processed = [text for text in (preprocessor.preprocess(q) for q in queries) if text.strip()]
+    ks = (IntentClassifier.rows_for(3), 1, 1)
+    separate_times, unified_times = [], []
+    agree = 0
+    for _ in range(args.repeat):
+        for text in processed:
+            start = time.perf_counter()
+            query_tfidf = intents.index.vectorizer.transform([text])
+            intent_matches = top_k(query_tfidf, intents.index.matrix, k=ks[0])
+            (intent, _, _), _ = intents.decide(intents.index, intent_matches, threshold=0.2)
+            handler = small_talk if intent == "SmallTalk" else qa
+            query_tfidf = handler.index.vectorizer.transform([text])
+            matches = top_k(query_tfidf, handler.index.matrix, k=1)
+            separate_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            found = unified.search(text, ks)
+            unified_times.append(time.perf_counter() - start)
+            source = 'small_talk' if handler is small_talk else 'question_answer'
+            agree += [row for row, _ in found['intents'] or []] == [row for row, _ in intent_matches] and \
+                     [row for row, _ in found[source] or []] == [row for row, _ in matches]
+
+    print(f"{len(processed) * args.repeat} turns, the unified index agreed on {agree}\n")
+    print(f"{'lookup':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, samples in (("separate", separate_times), ("unified", unified_times)):
+        p50, p95, p99 = percentiles(samples)
+        print(f"{name:<10}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}")
+    print(f"\nMean per turn: separate {np.mean(separate_times) * 1000:.3f}ms, unified {np.mean(unified_times) * 1000:.3f}ms")
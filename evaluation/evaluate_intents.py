@@ -1,3 +1,6 @@
+import os
+import sys
+import time
 import pandas as pd
 import numpy as np
 import nltk
@@ -34,6 +37,10 @@ except LookupError:
     print("Downloading NLTK 'universal_tagset'...")
     nltk.download('universal_tagset', quiet=True)
 
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code")
+sys.path.insert(0, CODE_DIR)
+from preprocessing import FastTextPreprocessor, LEMMA_TABLE_PATH, build_lemma_table, save_lemma_table
+
 pos_map = {'ADJ': 'a', 'ADV': 'r', 'NOUN': 'n', 'VERB': 'v'}
 lemmatizer = WordNetLemmatizer()
 
@@ -54,38 +61,53 @@ except FileNotFoundError:
 df['Subintent'] = df['Subintent'].fillna('none')
 print(f"Loaded {len(df)} intent phrases.")
 
-print("Preprocessing data...")
-df['processed_phrase'] = df['Phrase'].apply(preprocess)
+# Both preprocessing modes get the exact same split, so the only thing that differs between them is the preprocessing
+def evaluate(preprocess_fn):
+    start = time.perf_counter()
+    X = df['Phrase'].apply(preprocess_fn)
+    seconds = time.perf_counter() - start
+    X_train, X_test = X.loc[train_index], X.loc[test_index]
+    vectorizer = TfidfVectorizer(analyzer='word')
+    tfidf_train = vectorizer.fit_transform(X_train)
+    tfidf_test = vectorizer.transform(X_test)
+    similarity_matrix = cosine_similarity(tfidf_test, tfidf_train)
+    best_match_indices = np.argmax(similarity_matrix, axis=1)
+    y_pred = [y_train.iloc[i] for i in best_match_indices]
+    return y_pred, accuracy_score(y_test, y_pred), seconds
 
-X = df['processed_phrase']
 y = df['Intent']
 # I don't see a reason to test subintents as they should be already matched from the primary
 
 labels = sorted(y.unique())
 
 print("Splitting data into 70-30 train-test split")
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, 
+train_index, test_index, y_train, y_test = train_test_split(
+    df.index, y, 
     test_size=0.3, 
     random_state=42, # just in case
     stratify=y
 )
 
-print("Training vectorizer on training data...")
-vectorizer = TfidfVectorizer(analyzer='word')
-tfidf_train = vectorizer.fit_transform(X_train)
-tfidf_test = vectorizer.transform(X_test)
+print("Preprocessing, training and predicting with the full pipeline (word_tokenize + pos_tag + WordNet)...")
+y_pred, accuracy, full_seconds = evaluate(preprocess)
 
-print("Getting predictions for the test set...")
-similarity_matrix = cosine_similarity(tfidf_test, tfidf_train)
-best_match_indices = np.argmax(similarity_matrix, axis=1)
-y_pred = [y_train.iloc[i] for i in best_match_indices]
+print("Same again with the fast pipeline (regex + lemma table)...")
+# This script has the full pipeline anyway, so it can do the offline step Maila itself won't
+lemma_table_path = os.path.join(CODE_DIR, LEMMA_TABLE_PATH)
+if not os.path.exists(lemma_table_path):
+    print("No lemma table yet, building it with the full pipeline...")
+    save_lemma_table(build_lemma_table(os.path.dirname(lemma_table_path)), lemma_table_path)
+fast_preprocessor = FastTextPreprocessor(lemma_table_path)
+fast_pred, fast_accuracy, fast_seconds = evaluate(lambda text: fast_preprocessor.preprocess(text, cache=False))
 
 print("\n--- PERFORMANCE RESULTS ---")
 
-accuracy = accuracy_score(y_test, y_pred)
-print(f"Accuracy: {accuracy * 100:.2f}%")
+print(f"{'Preprocessing':<15}{'Accuracy':>10}{'Time':>12}")
+print(f"{'full':<15}{accuracy * 100:>9.2f}%{full_seconds * 1000:>10.0f}ms")
+print(f"{'fast':<15}{fast_accuracy * 100:>9.2f}%{fast_seconds * 1000:>10.0f}ms")
+print(f"The two modes predict the same intent for {sum(a == b for a, b in zip(y_pred, fast_pred))}/{len(y_pred)} test phrases")
 print("-" * 27)
+print("(The report and confusion matrix below are for the full pipeline)")
  
 print("Classification Report:")
 print(classification_report(y_test, y_pred, labels=labels))
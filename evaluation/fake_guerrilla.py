@@ -0,0 +1,188 @@
+import json
+import time
+import random
+import string
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# A local stand-in for api.guerrillamail.com/ajax.php, only the functions GuerrillaSession actually calls are here
+# It's not trying to be Guerrilla Mail, it's there so the email side of Maila can be timed and broken on purpose without the real service
+# latency/jitter are seconds added to every call, error_rate is the fraction of calls that get a 500 back
+class FakeGuerrillaServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, inbox_size=20, body_size=2048, page_size=20, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.inbox_size = inbox_size
+        self.body_size = body_size
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.sessions = {}
+        self.calls = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/ajax.php"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-guerrilla", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Puts new mail into a mailbox, handy for checking that check_email only brings back what's new
+    def deliver(self, sid_token, count=1):
+        with self._lock:
+            mailbox = self.sessions[sid_token]
+            return [self._new_email(mailbox) for _ in range(count)]
+
+    def _new_email(self, mailbox):
+        mailbox['next_id'] += 1
+        mail_id = str(mailbox['next_id'])
+        timestamp = int(time.time()) + mailbox['next_id']
+        subject = f"Test message {mail_id}"
+        body = f"<p>{subject}</p>" + "x" * max(0, self.body_size - len(subject) - 7)
+        mailbox['emails'][mail_id] = {
+            'mail_id': mail_id,
+            'mail_from': f"sender{mail_id}@example.com",
+            'mail_subject': subject,
+            'mail_excerpt': body[:40],
+            'mail_timestamp': str(timestamp),
+            'mail_read': '0',
+            'mail_date': time.strftime('%H:%M:%S', time.localtime(timestamp)),
+            'mail_size': str(len(body)),
+            'mail_body': body,
+        }
+        return mail_id
+
+    def _summary(self, email):
+        return {k: v for k, v in email.items() if k != 'mail_body'}
+
+    def _new_session(self):
+        sid_token = ''.join(self.random.choices(string.ascii_lowercase + string.digits, k=26))
+        mailbox = {'email_addr': f"{sid_token[:10]}@fakemail.local", 'timestamp': int(time.time()), 'emails': {}, 'next_id': 0}
+        for _ in range(self.inbox_size):
+            self._new_email(mailbox)
+        self.sessions[sid_token] = mailbox
+        return sid_token, mailbox
+
+    def _address(self, sid_token, mailbox):
+        return {'email_addr': mailbox['email_addr'], 'email_timestamp': mailbox['timestamp'], 'alias': mailbox['email_addr'].split('@')[0], 'sid_token': sid_token}
+
+    def _newest_first(self, mailbox):
+        return sorted(mailbox['emails'].values(), key=lambda e: -int(e['mail_timestamp']))
+
+    # Returns (status, payload), the payloads have the same shape as the real API for the fields Maila reads
+    def dispatch(self, params):
+        func = params.get('f')
+        sid_token = params.get('sid_token')
+        with self._lock:
+            self.calls[func] = self.calls.get(func, 0) + 1
+            if func == 'get_email_address' and not sid_token:
+                sid_token, mailbox = self._new_session()
+                return 200, self._address(sid_token, mailbox)
+            mailbox = self.sessions.get(sid_token)
+            if mailbox is None:
+                return 200, {'auth': {'success': False, 'error_codes': ['auth-session-not-initialized']}}
+            if func == 'get_email_address':
+                return 200, self._address(sid_token, mailbox)
+            if func == 'get_email_list':
+                offset = int(params.get('offset', 0) or 0)
+                emails = self._newest_first(mailbox)
+                page = [self._summary(e) for e in emails[offset:offset + self.page_size]]
+                return 200, {'list': page, 'count': str(len(emails)), 'email': mailbox['email_addr'], 'ts': int(time.time()), 'sid_token': sid_token}
+            if func == 'check_email':
+                seq = int(params.get('seq', 0) or 0)
+                emails = [self._summary(e) for e in self._newest_first(mailbox) if int(e['mail_id']) > seq]
+                return 200, {'list': emails, 'count': str(len(mailbox['emails'])), 'email': mailbox['email_addr'], 'ts': int(time.time()), 'sid_token': sid_token}
+            if func == 'fetch_email':
+                email = mailbox['emails'].get(str(params.get('email_id')))
+                if email is None:
+                    return 200, False
+                email['mail_read'] = '1'
+                return 200, dict(email, sid_token=sid_token)
+            if func == 'del_email':
+                deleted = [mail_id for mail_id in params.get('email_ids[]', []) if mailbox['emails'].pop(mail_id, None) is not None]
+                return 200, {'deleted_ids': deleted, 'sid_token': sid_token}
+            if func == 'forget_me':
+                mailbox['emails'].clear()
+                mailbox['email_addr'] = None
+                return 200, True
+            return 400, {'error': f"Unknown function {func}."}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, so requests.Session/aiohttp can reuse the connection like they would for real
+            disable_nagle_algorithm = True # Otherwise headers and body go out as two packets and every call eats a ~40ms delayed ACK
+
+            def _params(self, raw):
+                parsed = parse_qs(raw, keep_blank_values=True)
+                params = {k: v[-1] for k, v in parsed.items()}
+                if 'email_ids[]' in parsed:
+                    params['email_ids[]'] = parsed['email_ids[]']
+                return params
+
+            def _respond(self, raw):
+                delay = fake.latency + (fake.random.uniform(0, fake.jitter) if fake.jitter else 0)
+                if delay:
+                    time.sleep(delay)
+                if fake.error_rate and fake.random.random() < fake.error_rate:
+                    with fake._lock:
+                        fake.errors += 1
+                    status, payload = 500, {'error': "Injected failure."}
+                else:
+                    status, payload = fake.dispatch(self._params(raw))
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(urlsplit(self.path).query)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0) or 0)
+                self._respond(self.rfile.read(length).decode('utf-8'))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake of the Guerrilla Mail API for testing Maila's email tasks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds, picked at random per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    parser.add_argument("--inbox-size", type=int, default=20, help="emails already waiting in every new mailbox")
+    parser.add_argument("--body-size", type=int, default=2048, help="size of each email body in characters")
+    args = parser.parse_args()
+    server = FakeGuerrillaServer(args.host, args.port, args.latency, args.jitter, args.error_rate, args.inbox_size, args.body_size)
+    print(f"[FAKE GUERRILLA]: Listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules in code/ import each other by bare name, the same way evaluation/ gets at them
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "code"))
+sys.path.insert(0, os.path.join(ROOT, "evaluation"))
@@ -0,0 +1,122 @@
+import socket
+import time
+
+import pytest
+from requests.exceptions import ConnectionError
+
+import guerrilla_mail
+from guerrilla_mail import GuerrillaSession, CircuitOpenError, EmailBodyCache, SessionRegistry
+from transaction import EmailHandler
+from fake_guerrilla import FakeGuerrillaServer
+
+OFFLINE_URL = "http://maila-offline.invalid/ajax.php"
+
+@pytest.fixture
+def offline(monkeypatch):
+    # No network at all: every lookup fails the way it does with the cable out, and each test gets its own breakers
+    def no_dns(*args, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    monkeypatch.setattr(socket, "getaddrinfo", no_dns)
+    monkeypatch.setattr(guerrilla_mail, "_breakers", {})
+
+@pytest.fixture
+def fake():
+    with FakeGuerrillaServer(inbox_size=5, seed=1) as server:
+        yield server
+
+def count_calls(session):
+    calls = []
+    get = session.session.get
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return get(*args, **kwargs)
+    session.session.get = counted
+    return calls
+
+def test_dns_failure_is_not_retried_and_opens_the_breaker(offline):
+    session = GuerrillaSession(api_url=OFFLINE_URL)
+    calls = count_calls(session)
+    with pytest.raises(ConnectionError):
+        session.start_new_session()
+    assert len(calls) == 1
+    assert session.breaker.is_open
+
+def test_second_offline_call_fails_fast_without_the_transport(offline):
+    first = GuerrillaSession(api_url=OFFLINE_URL)
+    with pytest.raises(ConnectionError):
+        first.start_new_session()
+    second = GuerrillaSession(api_url=OFFLINE_URL)
+    calls = count_calls(second)
+    started = time.perf_counter()
+    with pytest.raises(CircuitOpenError):
+        second.start_new_session()
+    assert time.perf_counter() - started < 0.1
+    assert calls == []
+
+def delete_on_server(fake, sid_token, mail_id):
+    with fake._lock:
+        del fake.sessions[sid_token]['emails'][mail_id]
+
+def test_full_refresh_drops_mail_deleted_on_the_server(fake):
+    session = GuerrillaSession(api_url=fake.url)
+    session.start_new_session()
+    session.get_inbox_list()
+    gone = session.inbox.id_at(2)
+    delete_on_server(fake, session.sid_token, gone)
+    fake.deliver(session.sid_token)
+    # check_email only ever says what's new
+    session.get_inbox_list()
+    assert gone in session.inbox and len(session.inbox) == 6
+    session.get_inbox_list(incremental=False)
+    assert gone not in session.inbox and len(session.inbox) == 5
+
+def test_incremental_refreshes_resync_every_so_often(fake):
+    session = GuerrillaSession(api_url=fake.url)
+    session.start_new_session()
+    session.get_inbox_list()
+    gone = session.inbox.id_at(0)
+    delete_on_server(fake, session.sid_token, gone)
+    for _ in range(session.RESYNC_EVERY):
+        session.get_inbox_list()
+    assert fake.calls['check_email'] == session.RESYNC_EVERY
+    assert gone in session.inbox
+    session.get_inbox_list()
+    assert fake.calls['get_email_list'] == 2
+    assert gone not in session.inbox
+
+def test_update_command_shows_server_side_deletion(fake):
+    owner = GuerrillaSession(api_url=fake.url)
+    owner.start_new_session()
+    handler = EmailHandler(api_url=fake.url)
+    _, listed, _, _ = handler.handle_email_task("email_manage_loop", "list_emails", "list emails", owner.sid_token)
+    assert "Test message 3" in listed
+    # Deleted by another client, this handler's cached session never hears about it
+    delete_on_server(fake, owner.sid_token, "3")
+    _, updated, _, _ = handler.handle_email_task("email_manage_loop", "update_inbox", "update inbox", owner.sid_token)
+    assert "Test message 3" not in updated
+    assert "Test message 4" in updated
+
+def body(size):
+    return {'mail_body': "x" * size}
+
+def test_body_cache_bound_is_shared_by_every_session():
+    cache = EmailBodyCache(max_bytes=1000)
+    first, second = cache.view(), cache.view()
+    first.put("1", body(600))
+    second.put("1", body(600))
+    # Same mail_id in two mailboxes, different bodies, and only one fits under the shared limit
+    assert first.get("1") is None
+    assert second.get("1") == body(600)
+    assert cache.size_bytes == 600
+
+def test_evicted_session_takes_its_bodies_with_it(monkeypatch):
+    cache = EmailBodyCache()
+    monkeypatch.setattr(guerrilla_mail, "shared_body_cache", cache)
+    registry = SessionRegistry(max_sessions=1)
+    kept, evicted = GuerrillaSession(), GuerrillaSession()
+    evicted.body_cache.put("1", body(10))
+    kept.body_cache.put("1", body(20))
+    registry.put("a", evicted)
+    registry.put("b", kept)
+    assert cache.size_bytes == 20
+    assert kept.body_cache.get("1") == body(20)
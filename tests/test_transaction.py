@@ -0,0 +1,14 @@
+import pytest
+
+from transaction import EmailHandler
+
+@pytest.mark.parametrize("text, expected", [
+    ("delete all", "all"),
+    ("delete all of them", "all"),
+    ("download 1-3 as zip", "1-3"),
+    ("delete the one about the install", None),
+    ("finally delete 2", "2"),
+    ("download the small one", None),
+])
+def test_email_indices_only_take_all_as_a_word(text, expected):
+    assert EmailHandler()._extract_email_indices(text, "delete_email") == expected
@@ -0,0 +1,88 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import TurnRunner
+
+# Stands in for root.after, run() is the Tk main loop until nothing is left scheduled
+class Loop:
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, callback, *args):
+        self.calls.append((callback, args))
+
+    def step(self):
+        callback, args = self.calls.pop(0)
+        callback(*args)
+        time.sleep(0.001)
+
+    def run(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.calls:
+            assert time.monotonic() < deadline, "turns never finished"
+            self.step()
+
+class AllReady:
+    def is_ready(self, name):
+        return True
+
+# Only what TurnRunner calls: a delete that has to go out to the email service, and a cancel that drops out of the email states
+class StubEngine:
+    def __init__(self):
+        self.handlers = AllReady()
+        self.chat_stack = ["normal", "email_manage_loop"]
+        self.events = []
+        self.release = threading.Event()
+
+    def begin_turn(self, query):
+        self.events.append(("begin", query, self.chat_stack[-1]))
+        if query == "cancel":
+            while len(self.chat_stack) > 1:
+                self.chat_stack.pop()
+            return {'text': "cancelled", 'action': None}, None
+        return None, query
+
+    def run_email_job(self, job):
+        self.release.wait(5)
+        self.events.append(("run", job))
+        return job
+
+    def finish_email_job(self, job):
+        self.events.append(("finish", job, self.chat_stack[-1]))
+        self.chat_stack.append("awaiting_delete_all_confirm")
+        return {'text': "sure?", 'action': None}
+
+def make_runner(engine, loop, shown):
+    return TurnRunner(engine, loop.after, lambda result, started: shown.append(result['text']), lambda text: None,
+                      ThreadPoolExecutor(max_workers=1), ThreadPoolExecutor(max_workers=1))
+
+def test_cancel_during_email_job_waits_for_the_job():
+    engine, loop, shown = StubEngine(), Loop(), []
+    runner = make_runner(engine, loop, shown)
+    assert runner.submit("delete all")
+    # Let the turn get as far as the email service
+    while runner.job is None:
+        loop.step()
+    assert not runner.submit("cancel")
+    assert engine.chat_stack[-1] == "email_manage_loop"
+    engine.release.set()
+    loop.run()
+    assert engine.events == [("begin", "delete all", "email_manage_loop"),
+                             ("run", "delete all"),
+                             ("finish", "delete all", "email_manage_loop"),
+                             ("begin", "cancel", "awaiting_delete_all_confirm")]
+    assert shown == ["sure?", "cancelled"]
+    assert engine.chat_stack == ["normal"]
+    assert not runner.busy
+
+def test_messages_queue_in_order_behind_a_turn():
+    engine, loop, shown = StubEngine(), Loop(), []
+    engine.release.set()
+    runner = make_runner(engine, loop, shown)
+    assert runner.submit("delete 1")
+    assert not runner.submit("delete 2")
+    assert not runner.submit("cancel")
+    loop.run()
+    assert [event[1] for event in engine.events if event[0] == "begin"] == ["delete 1", "delete 2", "cancel"]
+    assert shown == ["sure?", "sure?", "cancelled"]